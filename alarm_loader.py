@@ -2,7 +2,7 @@
 import json
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, Text, DateTime
-from config import make_engine_and_session
+from database import make_engine_and_session
 
 # 初始化資料庫
 engine, Session, Base = make_engine_and_session("db/alarm_zones.db")
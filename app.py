@@ -3,7 +3,7 @@ from flask_cors import CORS
 import os
 
 # 自訂模組
-from config import MAIN_DB_PATH
+from config import MAIN_DB_PATH, UNIFIED_STORE, UNIFIED_DB_PATH
 from database import init_db
 from models import init_models
 from routes import api_blueprint, web_blueprint
@@ -17,8 +17,9 @@ from scheduler import init_scheduler
 app = Flask(__name__, static_folder="static", template_folder="templates")
 CORS(app)
 
-# 設定主資料庫 URI（Flask 綁定）
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.abspath(MAIN_DB_PATH)}"
+# 設定主資料庫 URI（Flask 綁定；單一檔案模式時所有資料表都在這個檔案）
+main_db_path = UNIFIED_DB_PATH if UNIFIED_STORE else MAIN_DB_PATH
+app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.abspath(main_db_path)}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # =========================================
@@ -39,16 +40,17 @@ app.register_blueprint(web_blueprint)
 # 主程式入口
 # =========================================
 if __name__ == "__main__":
+    first_cycle = None
     with app.app_context():
         print("🚀 伺服器啟動中：執行第一次 AIS 抓取 ...")
         try:
-            fetch_data(force_push=True)
+            first_cycle = fetch_data(force_push=True)
             print("✅ 首次資料抓取完成")
         except Exception as e:
             print(f"⚠️ 初次 fetch_data() 執行失敗: {e}")
 
     # 啟動定時排程（背景自動抓取）
-    init_scheduler(app)
+    init_scheduler(app, first_cycle)
 
     # 啟動 Flask 伺服器
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -0,0 +1,176 @@
+"""
+經緯度範圍查詢 benchmark：B-tree 索引（timestamp / ship_id）vs R*Tree（spatial_index）
+
+    python bench_bbox.py --ships 20000 --cycles 150      # ship_ais 約 300 萬筆
+
+先以合成船隊填滿 ship_ais（每輪每艘一筆，10 分鐘一輪），再量測：
+  - 各種範圍大小、有無時間區間時，兩種查詢方式的延遲（與 /api/ais/history 相同的條件）
+  - R*Tree trigger 對整輪 executemany 寫入的額外成本
+使用暫存資料夾，不會動到正式資料。
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+LAT_RANGE = (21.5, 26.5)
+LON_RANGE = (118.0, 123.0)
+CYCLE_MINUTES = 10
+
+
+class Fleet:
+    """隨機漫步的合成船隊；每輪回傳 (ship_id, lat, lon, speed, course)"""
+
+    def __init__(self, ships, seed=0):
+        self.rnd = np.random.default_rng(seed)
+        self.ids = [str(100000 + i) for i in range(ships)]
+        self.lat = self.rnd.uniform(*LAT_RANGE, ships)
+        self.lon = self.rnd.uniform(*LON_RANGE, ships)
+
+    def step(self):
+        n = len(self.ids)
+        self.lat = np.clip(self.lat + self.rnd.normal(0, 0.02, n), *LAT_RANGE)
+        self.lon = np.clip(self.lon + self.rnd.normal(0, 0.02, n), *LON_RANGE)
+        return self.lat.round(5), self.lon.round(5), self.rnd.integers(0, 200, n), self.rnd.integers(0, 360, n)
+
+
+def fill(session, table, fleet, cycles, base):
+    """直接以 driver executemany 填資料（trigger 會同步 R*Tree）"""
+    sql = (f"INSERT INTO {table} (timestamp, source, ship_id, shipname, lat, lon, speed, course, flag) "
+           f"VALUES (?, 'bench', ?, ?, ?, ?, ?, ?, 'TW')")
+    for cycle in range(cycles):
+        # 與 SQLAlchemy DateTime 寫入的格式相同
+        ts = (base + timedelta(minutes=CYCLE_MINUTES * cycle)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        lat, lon, speed, course = fleet.step()
+        session.connection().exec_driver_sql(sql, list(zip(
+            [ts] * len(fleet.ids), fleet.ids, fleet.ids, lat.tolist(), lon.tolist(),
+            speed.tolist(), course.tolist())))
+        if (cycle + 1) % 25 == 0:
+            session.commit()
+            print(f"[bench] 已寫入 {cycle + 1}/{cycles} 輪")
+    session.commit()
+
+
+def insert_overhead(session, Model, fleet, cycles, base):
+    """fetcher.bulk_insert 整輪寫入：保留 trigger vs 暫時拿掉（交易內 DROP，最後 rollback）"""
+    from fetcher import bulk_insert
+    from spatial_index import rtree_name
+
+    def run():
+        started = time.perf_counter()
+        for cycle in range(cycles):
+            lat, lon, speed, course = fleet.step()
+            ts = base + timedelta(minutes=CYCLE_MINUTES * cycle)
+            bulk_insert(session, Model, [
+                {"timestamp": ts, "source": "bench", "ship_id": sid, "shipname": sid,
+                 "lat": y, "lon": x, "speed": s, "course": c, "flag": "TW"}
+                for sid, y, x, s, c in zip(fleet.ids, lat.tolist(), lon.tolist(), speed.tolist(), course.tolist())])
+        return cycles * len(fleet.ids) / (time.perf_counter() - started)
+
+    results = {}
+    for mode in ("rtree", "no trigger"):
+        if mode == "no trigger":
+            conn = session.connection()
+            # pysqlite 遇到 DDL 不會自動 BEGIN：先執行一個 DML 開啟交易，DROP 才能一起 rollback
+            conn.exec_driver_sql(f"DELETE FROM {Model.__tablename__} WHERE 0")
+            rtree = rtree_name(Model.__tablename__)
+            for suffix in ("ai", "ad", "au"):
+                conn.exec_driver_sql(f"DROP TRIGGER {rtree}_{suffix}")
+        results[mode] = run()
+        session.rollback()
+    return results
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return len(rows), float(np.median(samples))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="經緯度範圍查詢：B-tree vs R*Tree")
+    ap.add_argument("--ships", type=int, default=20000)
+    ap.add_argument("--cycles", type=int, default=150, help="輪數（每輪 --ships 筆）")
+    ap.add_argument("--boxes", default="0.1,0.5,2", help="範圍邊長（度），逗號分隔")
+    ap.add_argument("--window-hours", default="1,24", help="時間區間（小時），逗號分隔")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--overhead-cycles", type=int, default=5)
+    ap.add_argument("--db-dir", default=None, help="DB 存放位置（預設為暫存資料夾）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    # 必須在匯入 config 之前設定
+    work_dir = args.db_dir or tempfile.mkdtemp(prefix="ais_bench_bbox_")
+    os.environ["AIS_DB_DIR"] = work_dir
+    os.environ["AIS_FAILED_LOG"] = os.path.join(work_dir, "failed_records.json")
+    os.environ["MIGRATIONS_ONLINE"] = "0"   # R*Tree 與 trigger 在填資料前建立
+
+    from app import app
+    from models import db, ShipAIS, MainReadSession
+    from spatial_index import bbox_filter
+
+    base = datetime(2025, 1, 1)
+    fleet = Fleet(args.ships, args.seed)
+    with app.app_context():
+        total = db.session.query(ShipAIS).count()
+        if total == 0:
+            started = time.perf_counter()
+            fill(db.session, ShipAIS.__tablename__, fleet, args.cycles, base)
+            total = args.ships * args.cycles
+            print(f"[bench] 填入 {total} 筆，{total / (time.perf_counter() - started):.0f} rows/s")
+            db.session.execute(db.text("ANALYZE"))
+            db.session.commit()
+        last = db.session.query(db.func.max(ShipAIS.timestamp)).scalar()
+        overhead = insert_overhead(db.session, ShipAIS, fleet, args.overhead_cycles,
+                                   last + timedelta(minutes=CYCLE_MINUTES))
+
+    rnd = np.random.default_rng(args.seed + 1)
+    cases = []
+    for size in (float(s) for s in args.boxes.split(",")):
+        for hours in [None] + [float(h) for h in args.window_hours.split(",")]:
+            lat0 = rnd.uniform(LAT_RANGE[0], LAT_RANGE[1] - size)
+            lon0 = rnd.uniform(LON_RANGE[0], LON_RANGE[1] - size)
+            window = None
+            if hours is not None:
+                end = last - (last - base) * float(rnd.uniform(0, 0.5))
+                window = (end - timedelta(hours=hours), end)
+            cases.append((size, hours, (lat0, lat0 + size), (lon0, lon0 + size), window))
+
+    results = []
+    session = MainReadSession
+    for size, hours, lat_range, lon_range, window in cases:
+        # 與 /api/ais/history 相同的條件（只取 id，避免 ORM 建物件的時間蓋過查詢本身）
+        query = session.query(ShipAIS.id).filter(
+            ShipAIS.lat >= lat_range[0], ShipAIS.lat <= lat_range[1],
+            ShipAIS.lon >= lon_range[0], ShipAIS.lon <= lon_range[1])
+        if window:
+            query = query.filter(ShipAIS.timestamp.between(*window))
+        start, end = window or (None, None)
+        plain_n, plain_ms = timed(query.all, args.repeat)
+        rtree_n, rtree_ms = timed(bbox_filter(query, session, ShipAIS, lat_range, lon_range, start, end).all,
+                                  args.repeat)
+        assert plain_n == rtree_n, (plain_n, rtree_n)
+        results.append((size, hours, plain_n, plain_ms, rtree_ms))
+    session.remove()
+
+    print()
+    print(f" ship_ais {total} 筆")
+    print(f" {'box_deg':>7} {'window_h':>8} {'rows':>8} {'btree_ms':>9} {'rtree_ms':>9} {'speedup':>8}")
+    for size, hours, n, plain_ms, rtree_ms in results:
+        window = "-" if hours is None else f"{hours:g}"
+        print(f" {size:7g} {window:>8} {n:8d} {plain_ms:9.1f} {rtree_ms:9.1f} {plain_ms / rtree_ms:7.1f}x")
+    print()
+    print(f" bulk_insert ({args.overhead_cycles} 輪 x {args.ships} 筆): "
+          f"有 R*Tree {overhead['rtree']:.0f} rows/s，無 trigger {overhead['no trigger']:.0f} rows/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
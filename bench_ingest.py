@@ -0,0 +1,128 @@
+"""
+端到端 ingest benchmark：以本機替身伺服器執行真正的 fetch_data
+
+    python bench_ingest.py --fleet 200000 --cycles 3
+    python bench_ingest.py --grid 10:426-429:221-224 --grid 9:212-214:108-110 --latency-ms 300
+    python bench_ingest.py --error-400 0.1 --timeout-rate 0.02 --fetch-timeout 2
+
+預設使用暫存資料夾存放所有 DB 與錯誤紀錄，不會動到正式資料。
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import tracemalloc
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+MT_TILE_URL = "https://www.marinetraffic.com/getData/get_data_json_4/z:{z}/X:{x}/Y:{y}/station:0"
+
+
+def parse_grid(spec):
+    """'10:426-429:221-224' → 該範圍所有 tile 的 URL"""
+    z, xs, ys = spec.split(":")
+
+    def span(text):
+        lo, _, hi = text.partition("-")
+        return range(int(lo), int(hi or lo) + 1)
+
+    return [MT_TILE_URL.format(z=int(z), x=x, y=y) for y in span(ys) for x in span(xs)]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 單位為 KB，macOS 為 bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main(argv=None):
+    from mt_stub_server import add_fault_arguments
+
+    ap = argparse.ArgumentParser(description="fetch_data 端到端效能量測")
+    ap.add_argument("--fleet", type=int, default=100000, help="合成船隊大小")
+    ap.add_argument("--rows-per-tile", type=int, default=None)
+    ap.add_argument("--archive", nargs="*", help="改用 tile_archive 錄製檔作為資料來源")
+    ap.add_argument("--grid", action="append", default=[], help="z:x0-x1:y0-y1，可重複；預設為 fetcher.urls")
+    ap.add_argument("--cycles", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=None)
+    ap.add_argument("--fetch-timeout", type=float, default=None)
+    ap.add_argument("--base-url", default=None, help="使用外部替身伺服器，不在本程序內啟動")
+    ap.add_argument("--db-dir", default=None, help="DB 存放位置（預設為暫存資料夾）")
+    ap.add_argument("--tracemalloc", action="store_true", help="量測每輪 Python heap 峰值（較慢）")
+    ap.add_argument("--seed", type=int, default=0)
+    add_fault_arguments(ap)
+    args = ap.parse_args(argv)
+
+    # 必須在匯入 config 之前設定
+    work_dir = args.db_dir or tempfile.mkdtemp(prefix="ais_bench_")
+    os.environ["AIS_DB_DIR"] = work_dir
+    os.environ["AIS_FAILED_LOG"] = os.path.join(work_dir, "failed_records.json")
+    if args.fetch_timeout is not None:
+        os.environ["FETCH_TIMEOUT"] = str(args.fetch_timeout)
+
+    from mt_stub_server import StubServer, build_source, faults_from_args
+    from mt_client import MarineTrafficClient
+    from app import app
+    import fetcher
+    from pipeline import LAST_CYCLE_STATS
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = StubServer(("127.0.0.1", 0), build_source(args),
+                            faults_from_args(args), args.rows_per_tile)
+        server.start_background()
+        base_url = server.base_url
+
+    tile_urls = [u for spec in args.grid for u in parse_grid(spec)] or list(fetcher.urls)
+    client = MarineTrafficClient(base_url=base_url, session_file=None)
+    print(f"[bench] {len(tile_urls)} tiles → {base_url}，DB: {work_dir}")
+
+    results = []
+    with app.app_context():
+        for cycle in range(args.cycles):
+            if args.tracemalloc:
+                tracemalloc.start()
+            t0 = time.perf_counter()
+            fetcher.fetch_data(client=client, tile_urls=tile_urls, concurrency=args.concurrency,
+                               send_alerts=False, record=False)
+            wall = time.perf_counter() - t0
+            heap_peak = None
+            if args.tracemalloc:
+                heap_peak = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+                tracemalloc.stop()
+
+            stages = LAST_CYCLE_STATS.get("stages", {})
+            rows = stages.get("parse", {}).get("items_out", 0)
+            results.append({
+                "cycle": cycle + 1,
+                "wall_s": round(wall, 3),
+                "tiles_ok": stages.get("fetch", {}).get("items_out", 0),
+                "rows": rows,
+                "rows_per_s": round(rows / wall, 1) if wall else None,
+                "commit_s": LAST_CYCLE_STATS.get("commit_seconds"),
+                "heap_peak_mb": heap_peak,
+                "rss_peak_mb": peak_rss_mb(),
+            })
+
+    print()
+    print(" cycle   wall_s  tiles_ok     rows   rows/s  commit_s  heap_mb  rss_mb")
+    for r in results:
+        print(f" {r['cycle']:5d} {r['wall_s']:8.3f} {r['tiles_ok']:9d} {r['rows']:8d} "
+              f"{r['rows_per_s'] or 0:8.0f} {r['commit_s'] or 0:9.3f} "
+              f"{r['heap_peak_mb'] if r['heap_peak_mb'] is not None else '-':>8} "
+              f"{r['rss_peak_mb'] if r['rss_peak_mb'] is not None else '-':>7}")
+    if server is not None:
+        print(f"\n[bench] stub server: {server.counters}")
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+歷史表寫入 benchmark：逐筆 ORM add（舊寫法）vs 整輪 executemany（fetcher.persist_history / persist_appends）
+
+    python bench_persist.py --ships 20000 --cycles 3
+
+只量測 ship_ais / chinaboat / boat / boat_check12 / boat_check24 五個只新增的歷史表，
+使用暫存資料夾，不會動到正式資料。
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+
+
+def synthetic_rows(n, seed=0):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        ccg = rnd.random() < 0.05
+        rows.append({
+            "SHIP_ID": str(100000 + i),
+            "SHIPNAME": f"CHINACOASTGUARD{i}" if ccg else f"SHIP{i}",
+            # 台灣周邊，部分海警船落在 12 / 24nm 內
+            "LAT": str(round(rnd.uniform(21.5, 26.5), 5)),
+            "LON": str(round(rnd.uniform(118.5, 122.5), 5)),
+            "SPEED": str(rnd.randint(0, 200)),
+            "COURSE": str(rnd.randint(0, 359)),
+            "HEADING": str(rnd.randint(0, 359)),
+            "ROT": "0",
+            "FLAG": "CN" if ccg or rnd.random() < 0.3 else "TW",
+            "SHIPTYPE": "7",
+            "ELAPSED": "1",
+        })
+    return rows
+
+
+def persist_orm(batch, records):
+    """改版前 fetch_data 的寫法：每筆建立 ORM 物件再 add"""
+    from models import (db, ShipAIS, ChinaBoatAIS, BoatShipAIS, BoatCheck12AIS, BoatCheck24AIS,
+                        ChinaBoatSession, BoatSession, BoatCheck12Session, BoatCheck24Session)
+
+    for record_kwargs, meta in zip(records, batch.metas()):
+        db.session.add(ShipAIS(**record_kwargs))
+        if meta["is_cn"]:
+            ChinaBoatSession.add(ChinaBoatAIS(**record_kwargs))
+        if not meta["is_ccg"]:
+            continue
+        BoatSession.add(BoatShipAIS(**record_kwargs))
+        if meta["zone"] == "12nm":
+            BoatCheck12Session.add(BoatCheck12AIS(**record_kwargs))
+        elif meta["zone"] == "24nm":
+            BoatCheck24Session.add(BoatCheck24AIS(**record_kwargs))
+
+
+def persist_bulk(batch, records):
+    from fetcher import persist_history, persist_appends
+
+    persist_history(batch, records, batch.timestamp)
+    persist_appends(batch, records)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="歷史表寫入方式比較")
+    ap.add_argument("--ships", type=int, default=20000)
+    ap.add_argument("--cycles", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    # 必須在匯入 config 之前設定
+    work_dir = tempfile.mkdtemp(prefix="ais_bench_persist_")
+    os.environ["AIS_DB_DIR"] = work_dir
+    os.environ["AIS_FAILED_LOG"] = os.path.join(work_dir, "failed_records.json")
+
+    from app import app
+    from fetcher import commit_all
+    from ingest import ShipBatch, classify_batch
+
+    base = datetime(2025, 1, 1)
+    rows = synthetic_rows(args.ships, args.seed)
+    modes = {"orm": persist_orm, "bulk": persist_bulk}
+    results = []
+    with app.app_context():
+        for cycle in range(args.cycles):
+            for name, persist in modes.items():
+                timestamp = base + timedelta(minutes=10 * len(results))
+                batch = classify_batch(ShipBatch.from_rows(rows, "bench", timestamp))
+                records = batch.records()
+                written = len(records) + int(batch["is_cn"].sum() + batch["is_ccg"].sum()
+                                             + (batch["zone"] != 0).sum())
+
+                t0 = time.perf_counter()
+                persist(batch, records)
+                t1 = time.perf_counter()
+                commit_all()
+                t2 = time.perf_counter()
+                results.append((cycle + 1, name, written, t1 - t0, t2 - t1))
+
+    print()
+    print(" cycle  mode     rows  persist_s  commit_s   rows/s")
+    for cycle, name, written, persist_s, commit_s in results:
+        total = persist_s + commit_s
+        print(f" {cycle:5d}  {name:<5} {written:7d} {persist_s:10.3f} {commit_s:9.3f} {written / total:8.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+API 讀取延遲 benchmark：ingest（fetch_data）持續寫入的同時量測 /api/* 回應時間
+
+    python bench_read_latency.py --profile tuned
+    python bench_read_latency.py --profile legacy      # SQLite 預設值（rollback journal）
+    python bench_read_latency.py --writer-process      # ingest 在另一個 process（排除 GIL 影響）
+
+ingest 以本機替身伺服器餵資料，使用暫存資料夾，不會動到正式資料。
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+import multiprocessing
+
+# /api/ais/latest 會把整個 ship_ais 讀進 Python，延遲主要是 CPU，預設不列入
+DEFAULT_PATHS = [
+    "/api/ais/history?min_lat=23&max_lat=24&min_lon=119&max_lon=120",
+    "/api/ccg_data",
+    "/api/chinaboat/latest",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def _ingest_loop(base_url, grid, stop, cycles, max_cycles=None):
+    """ingest 寫入端（--writer-process 時在另一個 process 執行）；cycles 為共享計數"""
+    from bench_ingest import parse_grid
+    from mt_client import MarineTrafficClient
+    from app import app
+    import fetcher
+
+    client = MarineTrafficClient(base_url=base_url, session_file=None)
+    tile_urls = parse_grid(grid)
+    done = 0
+    while not stop.is_set() and (max_cycles is None or done < max_cycles):
+        with app.app_context():
+            fetcher.fetch_data(client=client, tile_urls=tile_urls, send_alerts=False, record=False)
+        done += 1
+        cycles.value += 1
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ingest 寫入期間的 API 讀取延遲")
+    ap.add_argument("--profile", choices=["tuned", "legacy"], default="tuned")
+    ap.add_argument("--fleet", type=int, default=60000)
+    ap.add_argument("--grid", default="10:426-429:221-224", help="z:x0-x1:y0-y1")
+    ap.add_argument("--warmup-cycles", type=int, default=2, help="量測前先寫入幾輪")
+    ap.add_argument("--seconds", type=float, default=20, help="量測時間")
+    ap.add_argument("--readers", type=int, default=4, help="同時查詢的 thread 數")
+    ap.add_argument("--path", action="append", default=[], help="要查詢的 API（可重複）")
+    ap.add_argument("--writer-process", action="store_true", help="ingest 在另一個 process 執行")
+    args = ap.parse_args(argv)
+
+    # 必須在匯入 config 之前設定（--writer-process 的子 process 也會繼承）
+    work_dir = tempfile.mkdtemp(prefix="ais_bench_read_")
+    os.environ["AIS_DB_DIR"] = work_dir
+    os.environ["AIS_FAILED_LOG"] = os.path.join(work_dir, "failed_records.json")
+    os.environ["SQLITE_PROFILE"] = args.profile
+
+    from mt_stub_server import StubServer, SyntheticFleet, FaultProfile
+    from app import app
+
+    server = StubServer(("127.0.0.1", 0), SyntheticFleet(args.fleet), FaultProfile())
+    server.start_background()
+
+    print(f"[bench] profile={args.profile}，先寫入 {args.warmup_cycles} 輪 ...")
+    ctx = multiprocessing.get_context("spawn")
+    cycles = ctx.Value("i", 0)
+    _ingest_loop(server.base_url, args.grid, threading.Event(), cycles, args.warmup_cycles)
+    cycles.value = 0
+
+    if args.writer_process:
+        stop = ctx.Event()
+        writer = ctx.Process(target=_ingest_loop, args=(server.base_url, args.grid, stop, cycles))
+    else:
+        stop = threading.Event()
+        writer = threading.Thread(target=_ingest_loop, args=(server.base_url, args.grid, stop, cycles),
+                                  daemon=True)
+
+    paths = args.path or DEFAULT_PATHS
+    latencies = {path: [] for path in paths}
+    errors = [0]
+
+    def reader(offset):
+        http = app.test_client()
+        i = offset
+        while not stop.is_set():
+            path = paths[i % len(paths)]
+            i += 1
+            t0 = time.perf_counter()
+            status = http.get(path).status_code
+            elapsed = (time.perf_counter() - t0) * 1000
+            if status == 200:
+                latencies[path].append(elapsed)
+            else:
+                errors[0] += 1
+
+    threads = [writer] + [threading.Thread(target=reader, args=(n,), daemon=True)
+                          for n in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    server.shutdown()
+
+    print()
+    mode = "process" if args.writer_process else "thread"
+    print(f" profile={args.profile}  writer={mode}  ingest cycles={cycles.value}  errors={errors[0]}")
+    print(f" {'path':<62} {'n':>5} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'max_ms':>8}")
+    for path, values in latencies.items():
+        print(f" {path:<62} {len(values):5d} {percentile(values, 50):8.1f} {percentile(values, 95):8.1f} "
+              f"{percentile(values, 99):8.1f} {max(values or [0]):8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+海域範圍分類 microbenchmark：逐點 Point.within（原本的作法）vs geo_zones（prepared + contains_xy）
+vs 查表網格（邊界格才精確判斷）；距離門檻：每點精確計算 vs 距離場（geo_distance）
+
+    python bench_zones.py --points 50000
+    python bench_zones.py --points 200000 --legacy-points 20000
+
+點隨機分布在 24nm 範圍外擴 --margin 度的矩形內；各作法的分類結果需一致，距離引擎的距離
+不可比逐點作法遠，距離場判斷的門檻區間需與每點精確計算相同。
+逐點作法很慢，只跑前 --legacy-points 點，吞吐量以每秒點數比較。
+"""
+import sys
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import shapely
+from shapely.geometry import Point
+from shapely.ops import nearest_points
+
+
+def legacy_classify(polygon_12nm, polygon_24nm, lons, lats):
+    """原本 classify_batch 內的逐點判斷"""
+    from utils import haversine
+    from geo_zones import ZONE_12NM, ZONE_24NM
+
+    zone = np.zeros(len(lons), dtype=np.int8)
+    distance_km = np.full(len(lons), np.nan)
+    for i in range(len(lons)):
+        p = Point(lons[i], lats[i])
+        if p.within(polygon_12nm):
+            zone[i] = ZONE_12NM
+        elif p.within(polygon_24nm):
+            zone[i] = ZONE_24NM
+            p_12nm, _ = nearest_points(polygon_12nm, p)
+            distance_km[i] = haversine(p.y, p.x, p_12nm.y, p_12nm.x)
+    return zone, distance_km
+
+
+def engine_classify(classifier, engine, lons, lats):
+    from geo_zones import ZONE_24NM
+
+    zone = classifier.classify(lons, lats)
+    distance_km = np.full(len(lons), np.nan)
+    between = np.flatnonzero(zone == ZONE_24NM)
+    distance_km[between] = engine.distance_km("12nm", lons, lats, between)
+    return zone, distance_km
+
+
+def best_of(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="海域範圍分類：逐點 within vs prepared + contains_xy；距離門檻")
+    ap.add_argument("--points", type=int, default=50000)
+    ap.add_argument("--legacy-points", type=int, default=10000, help="逐點作法只跑前幾點")
+    ap.add_argument("--margin", type=float, default=0.5, help="24nm 範圍外擴（度）")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--cell-deg", type=float, default=0.01, help="查表網格格子大小（度）")
+    ap.add_argument("--field-cell-deg", type=float, default=0.05, help="距離場格點間距（度）")
+    ap.add_argument("--thresholds", default="6,30", help="距離門檻（海浬，逗號分隔）")
+    args = ap.parse_args(argv)
+
+    from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON
+    from geo_zones import ZoneClassifier, ZONE_12NM, ZONE_24NM, BOUNDARY
+    from geo_distance import DistanceEngine
+
+    if TAIWAN_12NM_POLYGON is None or TAIWAN_24NM_POLYGON is None:
+        print("[bench] ❌ 找不到 12nm / 24nm GeoJSON")
+        return 1
+
+    # 逐點作法使用未 prepare 的複本（與原本載入後直接使用相同）
+    raw_12nm = shapely.from_wkb(shapely.to_wkb(TAIWAN_12NM_POLYGON))
+    raw_24nm = shapely.from_wkb(shapely.to_wkb(TAIWAN_24NM_POLYGON))
+
+    t0 = time.perf_counter()
+    classifier = ZoneClassifier([(ZONE_12NM, shapely.from_wkb(shapely.to_wkb(TAIWAN_12NM_POLYGON))),
+                                 (ZONE_24NM, shapely.from_wkb(shapely.to_wkb(TAIWAN_24NM_POLYGON)))])
+    prepare_ms = (time.perf_counter() - t0) * 1000
+
+    # 網格建在暫存資料夾，量到的是第一次建立（之後啟動直接載入快取）
+    t0 = time.perf_counter()
+    gridded = ZoneClassifier([(ZONE_12NM, shapely.from_wkb(shapely.to_wkb(TAIWAN_12NM_POLYGON))),
+                              (ZONE_24NM, shapely.from_wkb(shapely.to_wkb(TAIWAN_24NM_POLYGON)))],
+                             grid_cell_deg=args.cell_deg, cache_dir=tempfile.mkdtemp(prefix="ais_bench_grid_"))
+    grid_ms = (time.perf_counter() - t0) * 1000
+
+    thresholds = [float(v) for v in args.thresholds.split(",")]
+    lines = {"12nm": TAIWAN_12NM_POLYGON, "24nm": TAIWAN_24NM_POLYGON}
+    engine = DistanceEngine(lines)
+    t0 = time.perf_counter()
+    fielded = DistanceEngine(lines, field_cell_deg=args.field_cell_deg, field_margin_nm=max(thresholds),
+                             cache_dir=tempfile.mkdtemp(prefix="ais_bench_field_"))
+    fielded.field("12nm")   # 距離場在第一次判斷門檻時才建立，這裡先建好
+    field_ms = (time.perf_counter() - t0) * 1000
+
+    rnd = np.random.default_rng(args.seed)
+    minx, miny, maxx, maxy = TAIWAN_24NM_POLYGON.bounds
+    lons = rnd.uniform(minx - args.margin, maxx + args.margin, args.points)
+    lats = rnd.uniform(miny - args.margin, maxy + args.margin, args.points)
+    k = min(args.legacy_points, args.points)
+
+    legacy_s, (legacy_zone, legacy_dist) = best_of(
+        lambda: legacy_classify(raw_12nm, raw_24nm, lons[:k], lats[:k]), 1)
+    engine_s, (zone, dist) = best_of(lambda: engine_classify(classifier, engine, lons, lats), args.repeat)
+    classify_s, _ = best_of(lambda: classifier.classify(lons, lats), args.repeat)
+    grid_s, grid_zone = best_of(lambda: gridded.classify(lons, lats), args.repeat)
+    boundary = float(np.mean(gridded.grid.lookup(lons, lats) == BOUNDARY))
+    # 門檻判斷：每點精確計算（只跑前 k 點）vs 距離場
+    exact_s, exact_band = best_of(lambda: engine.bands("12nm", lons[:k], lats[:k], thresholds), 1)
+    field_s, field_band = best_of(lambda: fielded.bands("12nm", lons, lats, thresholds), args.repeat)
+
+    mismatched = (int((zone[:k] != legacy_zone).sum()) + int((grid_zone != zone).sum())
+                  + int((field_band[:k] != exact_band).sum()))
+    # 逐點作法取經緯度平面上的最近點，不一定是球面上最近的點：引擎的距離只會更近，不會更遠
+    both = ~np.isnan(legacy_dist)
+    diff_m = (dist[:k][both] - legacy_dist[both]) * 1000
+    farther = int((diff_m > 1).sum())
+    closer_m = float(-diff_m.min()) if both.any() else 0.0
+    counts = {name: int((zone == code).sum()) for name, code in
+              (("12nm", ZONE_12NM), ("12-24nm", ZONE_24NM), ("outside", 0))}
+
+    print(f"點數 {args.points}（逐點作法 {k}）：{counts}")
+    print(f"prepare（含建索引）       {prepare_ms:8.1f} ms")
+    print(f"逐點 within + nearest    {k / legacy_s:12.0f} 點/s  （{legacy_s * 1000:.1f} ms / {k} 點）")
+    print(f"prepared + contains_xy   {args.points / engine_s:12.0f} 點/s  （{engine_s * 1000:.1f} ms / {args.points} 點）")
+    print(f"  其中 contains_xy 分類   {args.points / classify_s:12.0f} 點/s  （{classify_s * 1000:.1f} ms，其餘為到 12nm 的距離）")
+    print(f"查表網格 {args.cell_deg}°          {args.points / grid_s:12.0f} 點/s  （{grid_s * 1000:.1f} ms，"
+          f"{boundary:.1%} 的點落在邊界格；建立網格 {grid_ms:.0f} ms）")
+    print(f"門檻 {thresholds} nm 每點精確 {k / exact_s:12.0f} 點/s  （{exact_s * 1000:.1f} ms / {k} 點）")
+    print(f"  距離場 {args.field_cell_deg}°          {args.points / field_s:12.0f} 點/s  （{field_s * 1000:.1f} ms，"
+          f"建立距離場 {field_ms:.0f} ms）")
+    print(f"加速 {legacy_s / k / (engine_s / args.points):.1f}x；分類 / 門檻不一致 {mismatched} 點；"
+          f"距離比逐點作法遠 {farther} 點，最多近 {closer_m:.1f} m")
+    return 0 if mismatched == 0 and farther == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+歷史資料欄式封存（分析用，不經過 ORM、不讀正式的 SQLite 檔）
+
+已結束的每一期（分割區檔案，或未分割的表依月份）匯出成一個資料夾：
+    COLUMNAR_ARCHIVE_DIR/{store}/{key}/           分割區（ais_data@2025-01 → ais_data/2025-01）
+    COLUMNAR_ARCHIVE_DIR/{store}/main_{key}/      原本的表（每月一個）
+      manifest.json        期間、筆數、欄位型別
+      {欄位}.npy           數值 / 時間欄位（datetime64[us]，NULL = NaN / NaT；points 的 NULL 存成 0）
+      {欄位}.codes.npy     字串欄位的字典編號（int32）
+      {欄位}.dict.json     字串欄位的字典
+      ship_offsets.npy     資料依 (ship_id, timestamp) 排序，第 i 艘船為 [offsets[i], offsets[i+1])
+同一期重新匯出（--force）會整個資料夾替換；匯出後才壓縮（compaction.py）的資料需重新匯出。
+
+查詢（只需要 numpy）：
+    for part, rows in scan("ais_data", start, end, ship_id="416000001"):
+        lat = part.column("lat")[rows]          # memory-map，有 ship_id 時為 view（不複製）
+        names = part.decode("shipname", rows)
+    data = read("chinaboat", ["timestamp", "lat", "lon"], start, end)   # 合併成一般陣列
+
+    python columnar_archive.py export [--store ais_data] [--force]
+    python columnar_archive.py list
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from config import COLUMNAR_ARCHIVE_DIR
+
+FORMAT_VERSION = 1
+_TIME = "datetime64[us]"
+_FETCH_ROWS = 100_000
+
+
+# =========================================
+# 匯出（需要 app context）
+# =========================================
+def _columns(store):
+    """(名稱, SQL 欄位, 種類, dtype)；ship_ais 另外帶出差異寫入的 last_seen"""
+    from sqlalchemy import Integer, Float, DateTime
+    from models import ShipAIS, ShipAISRun
+
+    columns = []
+    for c in store.model.__table__.columns:
+        if c.name == "id":
+            continue
+        if isinstance(c.type, DateTime):
+            columns.append((c.name, c, "time", _TIME))
+        elif isinstance(c.type, Float):
+            columns.append((c.name, c, "float", "float64"))
+        elif isinstance(c.type, Integer):
+            columns.append((c.name, c, "int", "int32"))
+        else:
+            columns.append((c.name, c, "dict", "int32"))
+    if store.model is ShipAIS:
+        columns.append(("last_seen", ShipAISRun.__table__.c.last_seen, "time", _TIME))
+    return columns
+
+
+def _to_array(values, kind, dtype):
+    if kind == "time":
+        return np.array(values, dtype=dtype)   # None → NaT
+    if kind == "int":
+        return np.array([0 if v is None else v for v in values], dtype=dtype)
+    return np.array(values, dtype=dtype)       # None → NaN
+
+
+def export_period(store, start, end, dest, force=False):
+    """store 中 [start, end) 的資料匯出到 dest；回傳筆數（已匯出且未指定 force 時為 None）"""
+    from sqlalchemy import select, func
+    from models import ShipAIS, ShipAISRun
+
+    if os.path.exists(os.path.join(dest, "manifest.json")) and not force:
+        return None
+
+    table = store.model.__table__
+    columns = _columns(store)
+    period = (table.c.timestamp >= start, table.c.timestamp < end)
+    query = select(*[c for _, c, _, _ in columns])
+    if store.model is ShipAIS:
+        runs = ShipAISRun.__table__
+        query = query.select_from(table.outerjoin(runs, runs.c.row_id == table.c.id))
+    query = query.where(*period).order_by(table.c.ship_id, table.c.timestamp)
+
+    tmp = dest + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    # count 與讀取在同一個讀取交易內（WAL snapshot），筆數一致
+    with store.engine.connect() as conn, conn.begin():
+        n = conn.execute(select(func.count()).select_from(table).where(*period)).scalar()
+        if n == 0:
+            shutil.rmtree(tmp)
+            return 0
+        arrays, dictionaries = {}, {}
+        for name, _, kind, dtype in columns:
+            path = os.path.join(tmp, f"{name}.codes.npy" if kind == "dict" else f"{name}.npy")
+            arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n,))
+            if kind == "dict":
+                dictionaries[name] = {}
+
+        offset = 0
+        for chunk in conn.execute(query).partitions(_FETCH_ROWS):
+            values = list(zip(*chunk))
+            size = len(chunk)
+            for (name, _, kind, dtype), column in zip(columns, values):
+                if kind == "dict":
+                    codes = dictionaries[name]
+                    column = [codes.setdefault(v, len(codes)) for v in column]
+                    arrays[name][offset:offset + size] = column
+                else:
+                    arrays[name][offset:offset + size] = _to_array(column, kind, dtype)
+            offset += size
+
+    # ship_id 依出現順序編號，資料已依 ship_id 排序 → 編號遞增，可直接求每艘船的起點
+    ship_codes = arrays["ship_id"]
+    offsets = np.searchsorted(ship_codes, np.arange(len(dictionaries["ship_id"]) + 1))
+    np.save(os.path.join(tmp, "ship_offsets.npy"), offsets.astype(np.int64))
+
+    timestamp = arrays["timestamp"]
+    segment = (arrays["end_time"] - timestamp) if "end_time" in arrays else np.array([], dtype="m8[us]")
+    segment = segment[~np.isnat(segment)]
+    for name, values in dictionaries.items():
+        with open(os.path.join(tmp, f"{name}.dict.json"), "w", encoding="utf-8") as f:
+            json.dump(list(values), f, ensure_ascii=False)
+    manifest = {
+        "format": FORMAT_VERSION,
+        "store": store.name,
+        "table": store.table,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rows": int(n),
+        "ships": len(dictionaries["ship_id"]),
+        # 壓縮後一段軌跡最長多久：時間區間查詢往前多看的範圍
+        "max_segment_seconds": float(segment.max() / np.timedelta64(1, "s")) if len(segment) else 0.0,
+        "exported_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "columns": {name: {"kind": kind, "dtype": dtype} for name, _, kind, dtype in columns},
+    }
+    for array in arrays.values():
+        array.flush()
+    del arrays
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    os.replace(tmp, dest)
+    return n
+
+
+def _closed_periods(store, now):
+    """(key, start, end, 資料夾名)：分割區整期；原本的表依月份，只取已結束的"""
+    from sqlalchemy import select, func
+    from partitions import partition_key, partition_range
+
+    if "@" in store.name:
+        key = store.name.split("@", 1)[1]
+        start, end = partition_range(key)
+        return [(key, start, end, key)] if end <= now else []
+
+    table = store.model.__table__
+    with store.engine.connect() as conn:
+        lo, hi = conn.execute(select(func.min(table.c.timestamp), func.max(table.c.timestamp))).one()
+    periods = []
+    while lo is not None and lo <= hi:
+        key = partition_key(lo, "month")
+        start, end = partition_range(key)
+        if end > now:
+            break
+        periods.append((key, start, end, f"main_{key}"))
+        lo = end
+    return periods
+
+
+def export_all(store_name=None, force=False, now=None):
+    """所有歷史表（含分割區）已結束的期間；回傳 {資料夾: 筆數}"""
+    from migrations import all_stores, HISTORY
+
+    now = now or datetime.utcnow()
+    exported = {}
+    for store in all_stores():
+        base = store.name.split("@")[0]
+        if store.kind != HISTORY or (store_name and base != store_name):
+            continue
+        for key, start, end, folder in _closed_periods(store, now):
+            dest = os.path.join(COLUMNAR_ARCHIVE_DIR, base, folder)
+            try:
+                n = export_period(store, start, end, dest, force)
+            except Exception as e:
+                shutil.rmtree(dest + ".tmp", ignore_errors=True)
+                print(f"[columnar] ❌ {store.name} {key} 匯出失敗: {e}")
+                continue
+            if n:
+                exported[f"{base}/{folder}"] = n
+                print(f"📦 {base}/{folder}: {n} 筆")
+    return exported
+
+
+# =========================================
+# 讀取（只需要 numpy，可在 app 以外的分析環境使用）
+# =========================================
+class ArchivePartition:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.start = datetime.fromisoformat(self.manifest["start"])
+        self.end = datetime.fromisoformat(self.manifest["end"])
+        self.rows = self.manifest["rows"]
+        self._arrays = {}
+        self._values = {}
+        self._ships = None
+
+    @property
+    def columns(self):
+        return list(self.manifest["columns"])
+
+    def overlaps(self, start=None, end=None):
+        max_segment = np.timedelta64(int(self.manifest["max_segment_seconds"]), "s").item()
+        return (start is None or self.end + max_segment > start) and (end is None or self.start <= end)
+
+    def column(self, name):
+        """memory-map 的欄位（字串欄位為字典編號）"""
+        if name not in self._arrays:
+            kind = self.manifest["columns"][name]["kind"]
+            filename = f"{name}.codes.npy" if kind == "dict" else f"{name}.npy"
+            self._arrays[name] = np.load(os.path.join(self.path, filename), mmap_mode="r")
+        return self._arrays[name]
+
+    def values(self, name):
+        """字串欄位的字典（object 陣列，以編號索引）"""
+        if name not in self._values:
+            with open(os.path.join(self.path, f"{name}.dict.json"), encoding="utf-8") as f:
+                self._values[name] = np.array(json.load(f), dtype=object)
+        return self._values[name]
+
+    def decode(self, name, rows=slice(None)):
+        return self.values(name)[self.column(name)[rows]]
+
+    def ship_rows(self, ship_id):
+        if self._ships is None:
+            self._ships = {v: i for i, v in enumerate(self.values("ship_id"))}
+            self._offsets = np.load(os.path.join(self.path, "ship_offsets.npy"))
+        code = self._ships.get(ship_id)
+        if code is None:
+            return slice(0, 0)
+        return slice(int(self._offsets[code]), int(self._offsets[code + 1]))
+
+    def select(self, start=None, end=None, ship_id=None):
+        """
+        符合條件的列：slice（可直接取 view）或 index 陣列。
+        時間條件與 API 相同：timestamp <= end 且 (end_time 或 timestamp) >= start。
+        """
+        rows = self.ship_rows(ship_id) if ship_id is not None else slice(0, self.rows)
+        if (start is None or start <= self.start) and (end is None or end >= self.end):
+            return rows
+
+        ts = self.column("timestamp")[rows]
+        has_segments = self.manifest["max_segment_seconds"] > 0
+        lo = np.datetime64(start, "us") if start is not None else None
+        hi = np.datetime64(end, "us") if end is not None else None
+        if ship_id is not None:
+            # 同一艘船的資料依時間排序：先以 searchsorted 縮小範圍
+            a = 0 if lo is None else int(np.searchsorted(
+                ts, lo - np.timedelta64(int(self.manifest["max_segment_seconds"]), "s")))
+            b = len(ts) if hi is None else int(np.searchsorted(ts, hi, side="right"))
+            if not has_segments or lo is None:
+                return slice(rows.start + a, rows.start + b)
+            until = self.column("end_time")[rows][a:b]
+            until = np.where(np.isnat(until), ts[a:b], until)
+            return rows.start + a + np.flatnonzero(until >= lo)
+
+        mask = np.ones(len(ts), dtype=bool)
+        if hi is not None:
+            mask &= ts <= hi
+        if lo is not None:
+            until = ts
+            if has_segments:
+                end_time = self.column("end_time")
+                until = np.where(np.isnat(end_time), ts, end_time)
+            mask &= until >= lo
+        return np.flatnonzero(mask)
+
+
+def partitions(name, start=None, end=None, root=None):
+    """COLUMNAR_ARCHIVE_DIR/{name} 下與 [start, end] 重疊的期間（依時間排序）"""
+    folder = os.path.join(root or COLUMNAR_ARCHIVE_DIR, name)
+    if not os.path.isdir(folder):
+        return []
+    found = [ArchivePartition(os.path.join(folder, d)) for d in sorted(os.listdir(folder))
+             if os.path.exists(os.path.join(folder, d, "manifest.json"))]
+    return sorted((p for p in found if p.overlaps(start, end)), key=lambda p: p.start)
+
+
+def scan(name, start=None, end=None, ship_id=None, root=None):
+    """依時間排序逐期回傳 (ArchivePartition, rows)；rows 用於 part.column(欄位)[rows]"""
+    for part in partitions(name, start, end, root):
+        rows = part.select(start, end, ship_id)
+        if (rows.stop - rows.start if isinstance(rows, slice) else len(rows)) > 0:
+            yield part, rows
+
+
+def read(name, columns=None, start=None, end=None, ship_id=None, root=None):
+    """合併成 {欄位: 陣列}（會複製資料；字串欄位解碼為 object 陣列）"""
+    chunks = {}
+    for part, rows in scan(name, start, end, ship_id, root):
+        for column in columns or part.columns:
+            if part.manifest["columns"][column]["kind"] == "dict":
+                values = part.decode(column, rows)
+            else:
+                values = part.column(column)[rows]
+            chunks.setdefault(column, []).append(values)
+    return {column: np.concatenate(values) for column, values in chunks.items()}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="歷史資料欄式封存")
+    ap.add_argument("command", choices=["export", "list"])
+    ap.add_argument("--store", default=None, help="只處理此歷史表（ais_data / boat_test / chinaboat ...）")
+    ap.add_argument("--force", action="store_true", help="已匯出的期間重新匯出")
+    args = ap.parse_args(argv)
+
+    if args.command == "list":
+        if not os.path.isdir(COLUMNAR_ARCHIVE_DIR):
+            return 0
+        for name in sorted(os.listdir(COLUMNAR_ARCHIVE_DIR)):
+            if args.store and name != args.store:
+                continue
+            for part in partitions(name):
+                size = sum(os.path.getsize(os.path.join(part.path, f)) for f in os.listdir(part.path))
+                print(f"{name:14} {os.path.basename(part.path):16} rows={part.rows:<10} "
+                      f"ships={part.manifest['ships']:<7} {size / 1024 / 1024:.1f} MB")
+        return 0
+
+    from app import app
+    with app.app_context():
+        export_all(args.store, args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
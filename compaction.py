@@ -0,0 +1,237 @@
+"""
+舊歷史軌跡壓縮（COMPACTION_ENABLED=1 時由排程每 COMPACTION_INTERVAL_MINUTES 執行）
+
+ship_ais / boat_test / chinaboat 超過 COMPACTION_AGE_DAYS 的資料，依船以 Douglas-Peucker 簡化
+（距離採同步歐氏距離：與「依時間內插的位置」比較，速度變化也會保留轉折點）：
+  - 保留下來的每一筆代表一段軌跡：timestamp = 開始時間，end_time = 該段最後一筆原始資料的時間，
+    speed_min / speed_max = 該段原始資料的速度範圍，points = 合併的原始筆數
+  - 其餘原始資料刪除（R*Tree 由 trigger 同步；差異寫入的 ship_ais_run 一併刪除）
+  - 每段不超過 COMPACTION_MAX_SEGMENT_MINUTES，時間區間查詢只需往前多看固定長度（time_window）
+以 COMPACTION_CHUNK_HOURS 為單位分批並記錄進度（compaction_state）：
+讀取與計算不持有鎖，只有寫回時取得 WRITE_LOCK，ingest 最多等一批的寫回時間。
+
+    python compaction.py            # 立即壓縮到期的資料
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, text, and_, or_, func, bindparam, DateTime
+
+from config import (
+    COMPACTION_AGE_DAYS, COMPACTION_TOLERANCE_M, COMPACTION_MAX_SEGMENT_MINUTES, COMPACTION_CHUNK_HOURS
+)
+from database import WRITE_LOCK
+from models import ShipAIS, ShipAISRun, BoatShipAIS, ChinaBoatAIS
+
+MAX_SEGMENT = timedelta(minutes=COMPACTION_MAX_SEGMENT_MINUTES)
+COMPACTED_MODELS = (ShipAIS, BoatShipAIS, ChinaBoatAIS)
+_M_PER_DEG = 111_320.0
+
+
+# =========================================
+# 查詢：原始資料與壓縮後的軌跡一起讀
+# =========================================
+def time_window(Model, start, end):
+    """
+    與 [start, end] 重疊的資料：原始資料看 timestamp，壓縮後的一段看 [timestamp, end_time]。
+    段長有上限，timestamp 仍是範圍條件（可用索引）。
+    """
+    return and_(Model.timestamp.between(start - MAX_SEGMENT, end),
+                func.coalesce(Model.end_time, Model.timestamp) >= start)
+
+
+# =========================================
+# 軌跡簡化
+# =========================================
+def simplify_track(seconds, lat, lon, tolerance_m=COMPACTION_TOLERANCE_M,
+                   max_segment_s=COMPACTION_MAX_SEGMENT_MINUTES * 60):
+    """
+    單艘船依時間排序的軌跡 → 要保留的 mask（頭尾一定保留）。
+    兩個保留點之間的原始資料與「依時間內插的位置」相差不超過 tolerance_m，
+    且相隔不超過 max_segment_s（除非中間沒有資料可保留）。
+    """
+    n = len(seconds)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if n <= 2:
+        return keep
+
+    # 局部範圍以等距圓柱投影換算成公尺
+    y = lat * _M_PER_DEG
+    x = lon * _M_PER_DEG * np.cos(np.radians(np.nanmean(lat)))
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        span = seconds[j] - seconds[i]
+        inner = slice(i + 1, j)
+        f = (seconds[inner] - seconds[i]) / span if span > 0 else np.full(j - i - 1, 0.5)
+        d = np.hypot(x[inner] - (x[i] + f * (x[j] - x[i])), y[inner] - (y[i] + f * (y[j] - y[i])))
+        m = int(np.argmax(d))
+        if d[m] > tolerance_m:
+            k = i + 1 + m
+        elif span > max_segment_s:
+            # 位置都在容許範圍內但時間太長：從中間切開
+            k = min(max(int(np.searchsorted(seconds, seconds[i] + span / 2)), i + 1), j - 1)
+        else:
+            continue
+        keep[k] = True
+        stack.append((i, k))
+        stack.append((k, j))
+    return keep
+
+
+def compact_rows(ids, ship_ids, timestamps, lat, lon, speed, until=None):
+    """
+    一批依 (ship_id, timestamp) 排序的原始資料 → (要更新的段, 要刪除的 id)
+    until: 每筆資料延續到的時間（差異寫入的 last_seen），預設為 timestamp
+    """
+    until = timestamps if until is None else until
+    seconds = np.array([(t - timestamps[0]).total_seconds() for t in timestamps]) if len(timestamps) else np.array([])
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    speed = np.asarray(speed, dtype=float)
+
+    segments, dropped = [], []
+    bounds = np.flatnonzero(np.r_[True, ship_ids[1:] != ship_ids[:-1], True])
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        keep = np.ones(b - a, dtype=bool)
+        valid = np.flatnonzero(~(np.isnan(lat[a:b]) | np.isnan(lon[a:b])))
+        if len(valid) > 2:
+            # 缺經緯度的資料各自成一段
+            keep[valid] = simplify_track(seconds[a:b][valid], lat[a:b][valid], lon[a:b][valid])
+        starts = np.flatnonzero(keep)
+        for s, e in zip(starts, np.r_[starts[1:], b - a]):
+            rows = slice(a + s, a + e)
+            speeds = speed[rows][~np.isnan(speed[rows])]
+            segments.append({
+                "row_id": int(ids[a + s]),
+                "seg_end": max(until[rows]),
+                "seg_speed_min": float(speeds.min()) if len(speeds) else None,
+                "seg_speed_max": float(speeds.max()) if len(speeds) else None,
+                "seg_points": int(e - s),
+            })
+        dropped.extend(int(i) for i in ids[a:b][~keep])
+    return segments, dropped
+
+
+# =========================================
+# 壓縮一個 store（分庫 / 分割區 / 單一檔案內的一張表）
+# =========================================
+_SAVE_STATE = text("INSERT OR REPLACE INTO compaction_state (table_name, compacted_until) VALUES (:t, :until)") \
+    .bindparams(bindparam("until", type_=DateTime))
+
+
+def _compacted_until(conn, table):
+    return conn.execute(text("SELECT compacted_until FROM compaction_state WHERE table_name = :t"),
+                        {"t": table}).scalar()
+
+
+def compact_store(store, cutoff, chunk=timedelta(hours=COMPACTION_CHUNK_HOURS)):
+    """cutoff 之前尚未壓縮的資料，每 chunk 一個交易；回傳 (原始筆數, 壓縮後筆數, 持有鎖的秒數)"""
+    Model = store.model
+    table = Model.__table__
+    runs = ShipAISRun.__table__ if Model is ShipAIS else None
+    engine = store.engine
+    total_in = total_out = locked = 0
+
+    with engine.connect() as conn:
+        watermark = _compacted_until(conn, store.table)
+        if watermark is None:
+            watermark = conn.execute(select(func.min(table.c.timestamp))).scalar()
+        if isinstance(watermark, str):
+            watermark = datetime.fromisoformat(watermark)
+    if watermark is None:
+        return 0, 0, 0.0
+
+    limit = cutoff
+    if runs is not None:
+        # 狀態仍在延續（差異寫入持續更新 last_seen）的資料先不壓縮；進度停在其中最早的一筆，
+        # 該段結束後下次從這裡繼續，不會因為進度已越過而永遠留著原始資料
+        with engine.connect() as conn:
+            open_from = conn.execute(
+                select(func.min(table.c.timestamp))
+                .select_from(table.join(runs, runs.c.row_id == table.c.id))
+                .where(table.c.timestamp >= watermark, table.c.timestamp < cutoff,
+                       table.c.points.is_(None), runs.c.last_seen >= cutoff)).scalar()
+        if open_from is not None:
+            limit = min(limit, open_from)
+
+    while watermark < limit:
+        chunk_end = min(watermark + chunk, limit)
+
+        # 讀取與計算不持有 WRITE_LOCK（WAL 下不影響 ingest）
+        columns = [table.c.id, table.c.ship_id, table.c.timestamp, table.c.lat, table.c.lon, table.c.speed]
+        query = select(*columns)
+        if runs is not None:
+            query = select(*columns, runs.c.last_seen).outerjoin(runs, runs.c.row_id == table.c.id) \
+                .where(or_(runs.c.last_seen.is_(None), runs.c.last_seen < cutoff))
+        query = query.where(table.c.timestamp >= watermark, table.c.timestamp < chunk_end,
+                            table.c.points.is_(None)).order_by(table.c.ship_id, table.c.timestamp)
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+
+        segments, dropped = [], []
+        if rows:
+            values = list(zip(*rows))
+            until = None
+            if runs is not None:
+                until = np.array([max(t, s) if s is not None else t for t, s in zip(values[2], values[6])])
+            segments, dropped = compact_rows(
+                np.array(values[0]), np.array(values[1], dtype=object), np.array(values[2]),
+                np.array(values[3], dtype=float), np.array(values[4], dtype=float),
+                np.array(values[5], dtype=float), until)
+
+        started = time.perf_counter()
+        with WRITE_LOCK, engine.begin() as conn:
+            if segments:
+                conn.execute(table.update().where(table.c.id == bindparam("row_id")).values(
+                    end_time=bindparam("seg_end"), speed_min=bindparam("seg_speed_min"),
+                    speed_max=bindparam("seg_speed_max"), points=bindparam("seg_points")), segments)
+            if dropped:
+                params = [{"row_id": i} for i in dropped]
+                conn.execute(text(f"DELETE FROM {store.table} WHERE id = :row_id"), params)
+                if runs is not None:
+                    conn.execute(text(f"DELETE FROM {runs.name} WHERE row_id = :row_id"), params)
+            conn.execute(_SAVE_STATE, {"t": store.table, "until": chunk_end})
+        locked += time.perf_counter() - started
+        total_in += len(rows)
+        total_out += len(segments)
+        watermark = chunk_end
+    return total_in, total_out, locked
+
+
+def compact_all(now=None):
+    """所有可壓縮的 store（含分割區）；回傳 {store: (原始筆數, 壓縮後筆數, 持有鎖秒數)}"""
+    from migrations import all_stores
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=COMPACTION_AGE_DAYS)
+    results = {}
+    for store in all_stores():
+        if store.model not in COMPACTED_MODELS:
+            continue
+        try:
+            rows_in, rows_out, locked = compact_store(store, cutoff)
+        except Exception as e:
+            print(f"[compaction] ❌ {store.name} 壓縮失敗（下次從上次進度繼續）: {e}")
+            continue
+        results[store.name] = (rows_in, rows_out, locked)
+        if rows_in:
+            print(f"🗜️ {store.name}: {rows_in} 筆 → {rows_out} 段（寫回持有鎖 {locked:.2f}s）")
+    return results
+
+
+def main(argv=None):
+    from app import app
+    with app.app_context():
+        compact_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -116,10 +116,7 @@
 import os
 import json
 from dotenv import load_dotenv, find_dotenv
-from shapely.geometry import Polygon
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.ext.declarative import declarative_base
+from shapely.geometry import Polygon, MultiLineString
 
 # =========================================
 # 載入環境變數
@@ -139,7 +136,7 @@ GMAIL_PASS = os.getenv("GMAIL_PASS", "")
 # 資料庫路徑設定（統一使用絕對路徑 + 小寫命名）
 # =========================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_DIR = os.path.join(BASE_DIR, "db")
+DB_DIR = os.getenv("AIS_DB_DIR", os.path.join(BASE_DIR, "db"))  # benchmark / 重建時可改到別處
 os.makedirs(DB_DIR, exist_ok=True)  # 確保 db 資料夾存在
 
 # ✅ 所有 DB 路徑一致採用小寫命名，避免跨系統錯誤
@@ -153,7 +150,12 @@ CCG_CHECK12_DB_PATH = os.path.join(DB_DIR, "ccg_check12.db")
 CCG_CHECK24_DB_PATH = os.path.join(DB_DIR, "ccg_check24.db")
 CHINA_BOAT_DB_PATH = os.path.join(DB_DIR, "chinaboat.db")
 
-FAILED_LOG_FILE = os.path.join(BASE_DIR, "failed_records.json")
+# 單一檔案模式（AIS_UNIFIED_STORE=1）：上面九個 DB 的資料表都放進同一個檔案，
+# 每輪抓取只 commit 一次（一次 fsync，全部成功或全部失敗）
+UNIFIED_STORE = os.getenv("AIS_UNIFIED_STORE", "0") == "1"
+UNIFIED_DB_PATH = os.path.join(DB_DIR, "ais_unified.db")
+
+FAILED_LOG_FILE = os.getenv("AIS_FAILED_LOG", os.path.join(BASE_DIR, "failed_records.json"))
 
 # =========================================
 # GeoJSON 載入函式
@@ -215,6 +217,40 @@ def load_geojson_polygon(filename):
         return None
 
 
+def load_geojson_lines(filename):
+    """
+    載入 GeoJSON 的線（不封成 Polygon），回傳 shapely MultiLineString；
+    Polygon / MultiPolygon 取其外環與內環。
+    """
+    path = os.path.join(BASE_DIR, filename)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        lines = []
+        for feature in data.get("features", []):
+            geom = feature.get("geometry", {})
+            geom_type = geom.get("type")
+            geom_coords = geom.get("coordinates", [])
+            if geom_type == "LineString":
+                lines.append(geom_coords)
+            elif geom_type in ("MultiLineString", "Polygon"):
+                lines.extend(geom_coords)
+            elif geom_type == "MultiPolygon":
+                lines.extend(ring for poly in geom_coords for ring in poly)
+
+        lines = [line for line in lines if len(line) > 1]
+        if not lines:
+            print(f"[config] ⚠️ {filename} 沒有可用的線")
+            return None
+        print(f"[config] ✅ 載入 {filename} 成功，共 {len(lines)} 條線")
+        return MultiLineString(lines)
+
+    except Exception as e:
+        print(f"[config] ⚠️ 載入 {filename} 失敗: {e}")
+        return None
+
+
 # =========================================
 # 載入台灣海域範圍 (12nm / 24nm)
 # =========================================
@@ -224,29 +260,155 @@ TAIWAN_24NM_POLYGON = load_geojson_polygon("static/taiwan_24nm.geojson")
 # 舊版程式相容性
 TAIWAN_POLYGON = TAIWAN_12NM_POLYGON
 
+# 12nm / 24nm 查表網格：格子大小（度，約 0.01° ≈ 1.1 km；0 = 不使用網格，每點精確判斷）
+ZONE_GRID_CELL_DEG = float(os.getenv("ZONE_GRID_CELL_DEG", "0.01"))
+ZONE_GRID_DIR = os.getenv("ZONE_GRID_DIR", os.path.join(DB_DIR, "zone_grid"))
+
+# 領海基線（選用，LineString / MultiLineString GeoJSON）：有此檔案時距離引擎另可計算到基線的距離
+TAIWAN_BASELINE_GEOJSON = os.getenv("TAIWAN_BASELINE_GEOJSON", "static/taiwan_baseline.geojson")
+TAIWAN_BASELINE = (load_geojson_lines(TAIWAN_BASELINE_GEOJSON)
+                   if os.path.exists(os.path.join(BASE_DIR, TAIWAN_BASELINE_GEOJSON)) else None)
+
+# 距離門檻（海浬；/api/fleet/distance 未指定 thresholds 時使用）
+DISTANCE_THRESHOLDS_NM = [float(v) for v in os.getenv("DISTANCE_THRESHOLDS_NM", "6,30").split(",") if v.strip()]
+# 距離場格點間距（度，約 0.05° ≈ 5.5 km；0 = 不使用距離場，門檻判斷每點精確計算）
+DISTANCE_FIELD_CELL_DEG = float(os.getenv("DISTANCE_FIELD_CELL_DEG", "0.05"))
+
 # =========================================
 # 啟用設定
 # =========================================
 ENABLE_LINE_PUSH = False   # 改成 True 就會重新啟用 LINE 推播
 
 # =========================================
-# ✅ 通用工具函式：建立 engine + session + Base
+# 抓取設定
 # =========================================
-def make_engine_and_session(db_path: str):
-    """
-    建立一個獨立的 SQLAlchemy engine、session、Base，
-    用來管理多個 SQLite 資料庫（非 Flask 綁定的）。
-    """
-    abs_path = os.path.abspath(db_path)
-    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-
-    engine = create_engine(
-        f"sqlite:///{abs_path}",
-        connect_args={"check_same_thread": False},
-        echo=False,
-    )
-    session_factory = sessionmaker(bind=engine)
-    Session = scoped_session(session_factory)
-    Base = declarative_base()
-
-    return engine, Session, Base
+# 同時抓取的 tile 數量上限（1 = 逐一抓取）
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "20"))
+
+# MarineTraffic 連線設定（MT_BASE_URL 可指向本機替身伺服器）
+MT_ORIGIN = "https://www.marinetraffic.com"
+MT_BASE_URL = os.getenv("MT_BASE_URL", MT_ORIGIN)
+MT_SESSION_FILE = os.path.join(DB_DIR, "mt_session.json")  # Cloudflare cookie / UA
+MT_POOL_SIZE = int(os.getenv("MT_POOL_SIZE", "4"))          # 保留連線池的 host 數
+MT_PER_HOST_LIMIT = int(os.getenv("MT_PER_HOST_LIMIT", "4"))  # 每個 host 同時連線上限
+
+# 暫時性錯誤（429 / 5xx / 逾時）的重試次數與基準等待秒數（指數退避 + jitter）
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "2"))
+FETCH_RETRY_BASE = float(os.getenv("FETCH_RETRY_BASE", "1.0"))
+FETCH_RETRY_MAX = float(os.getenv("FETCH_RETRY_MAX", "30"))
+
+# 各 tile 的 circuit breaker（狀態存檔，重啟後沿用）
+TILE_HEALTH_FILE = os.path.join(DB_DIR, "tile_health.json")
+BREAKER_TRANSIENT_THRESHOLD = int(os.getenv("BREAKER_TRANSIENT_THRESHOLD", "3"))  # 連續幾次暫時性錯誤開路
+BREAKER_PERMANENT_THRESHOLD = int(os.getenv("BREAKER_PERMANENT_THRESHOLD", "2"))  # 連續幾次 400 類錯誤開路
+BREAKER_TRANSIENT_OPEN_S = float(os.getenv("BREAKER_TRANSIENT_OPEN_S", "300"))
+BREAKER_PERMANENT_OPEN_S = float(os.getenv("BREAKER_PERMANENT_OPEN_S", "3600"))
+BREAKER_MAX_OPEN_S = float(os.getenv("BREAKER_MAX_OPEN_S", "86400"))
+
+# ingest pipeline 各階段之間的 Queue 上限（以 tile 為單位）
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+# 寫入改由背景 writer thread 執行（WRITE_BEHIND=1 啟用）：分類 / 推播不等 commit
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "4"))    # 以輪為單位，滿了抓取端會等待
+WRITE_BEHIND_MAX_GROUP = int(os.getenv("WRITE_BEHIND_MAX_GROUP", "8"))      # 落後時最多幾輪合併成一次 commit
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))  # commit 失敗的輪次在執行中重試幾次
+# 尚未 commit 的輪次先寫到這裡，程式中斷後重啟時補寫
+WRITE_BEHIND_JOURNAL_DIR = os.getenv("WRITE_BEHIND_JOURNAL_DIR", os.path.join(DB_DIR, "journal"))
+
+# 原始 tile 回應錄製（TILE_ARCHIVE=1 啟用，供重播 / 重建 / 效能量測）
+TILE_ARCHIVE_ENABLED = os.getenv("TILE_ARCHIVE", "0") == "1"
+TILE_ARCHIVE_DIR = os.path.join(DB_DIR, "tile_archive")
+
+# =========================================
+# 歷史資料差異寫入（DELTA_HISTORY=1 啟用）
+# =========================================
+# 船隻位置 / 速度 / 航向沒有超過容許值時，ship_ais 不新增整筆資料，只更新 last_seen
+DELTA_HISTORY = os.getenv("DELTA_HISTORY", "0") == "1"
+DELTA_POSITION_TOLERANCE_M = float(os.getenv("DELTA_POSITION_TOLERANCE_M", "50"))
+DELTA_SPEED_TOLERANCE_KN = float(os.getenv("DELTA_SPEED_TOLERANCE_KN", "0.5"))
+DELTA_COURSE_TOLERANCE_DEG = float(os.getenv("DELTA_COURSE_TOLERANCE_DEG", "10"))
+# 即使沒有變化，每隔多久仍寫一筆完整資料（讓時間區間查詢不展開也查得到）
+DELTA_KEYFRAME_MINUTES = float(os.getenv("DELTA_KEYFRAME_MINUTES", "360"))
+# 船隻消失超過此時間後再出現，一律新增一筆（不把中間的空窗當成「狀態不變」）
+DELTA_MAX_GAP_MINUTES = float(os.getenv("DELTA_MAX_GAP_MINUTES", "60"))
+
+# =========================================
+# 歷史表依時間分割（HISTORY_PARTITION=month / day；none = 維持單一表）
+# =========================================
+# ship_ais / chinaboat 每一期一個 SQLite 檔（db/partitions/ais_data_2025-01.db），
+# 新的一期第一次寫入時自動建立；單一檔案模式（AIS_UNIFIED_STORE=1）不分割
+HISTORY_PARTITION = os.getenv("HISTORY_PARTITION", "none")
+PARTITION_DIR = os.path.join(DB_DIR, "partitions")
+# 保留天數（0 = 永久保留）：整期都超過期限的分割區，archive = 移到 PARTITION_ARCHIVE_DIR，drop = 刪除
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+HISTORY_RETENTION_ACTION = os.getenv("HISTORY_RETENTION_ACTION", "archive")
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", os.path.join(DB_DIR, "archive"))
+
+# =========================================
+# 舊歷史軌跡壓縮（COMPACTION_ENABLED=1 時由排程定期執行）
+# =========================================
+# ship_ais / boat_test / chinaboat 超過 COMPACTION_AGE_DAYS 的資料，依船簡化成一段一段的軌跡
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "0") == "1"
+COMPACTION_AGE_DAYS = float(os.getenv("COMPACTION_AGE_DAYS", "30"))
+COMPACTION_TOLERANCE_M = float(os.getenv("COMPACTION_TOLERANCE_M", "200"))   # 與原始軌跡的最大偏差
+# 每段最長時間（時間區間查詢只需往前多看這麼久）
+COMPACTION_MAX_SEGMENT_MINUTES = float(os.getenv("COMPACTION_MAX_SEGMENT_MINUTES", "360"))
+COMPACTION_CHUNK_HOURS = float(os.getenv("COMPACTION_CHUNK_HOURS", "6"))     # 每個交易處理的時間範圍
+COMPACTION_INTERVAL_MINUTES = int(os.getenv("COMPACTION_INTERVAL_MINUTES", "60"))
+
+# =========================================
+# 歷史資料欄式封存（分析用，python columnar_archive.py export）
+# =========================================
+# 已結束的每一期匯出成一個資料夾：數值欄位為 .npy（memory-map 讀取），字串欄位以字典編碼
+COLUMNAR_ARCHIVE_DIR = os.getenv("COLUMNAR_ARCHIVE_DIR", os.path.join(DB_DIR, "columnar"))
+
+# =========================================
+# 歷史表精簡列（VESSEL_REGISTRY=1 啟用，背景 migration 轉換既有資料）
+# =========================================
+# 船名等靜態資料與 source 改存在 vessel_static / ais_sources，位置列只留 id / 時間 / 數值欄位，
+# 原表名改為 view（查詢不變）；轉換後關閉此設定會拒絕啟動，
+# 需先以 VESSEL_REGISTRY=1 執行 python migrations.py downgrade 7 還原為一般表
+VESSEL_REGISTRY = os.getenv("VESSEL_REGISTRY", "0") == "1"
+
+# =========================================
+# 最新船隊狀態（記憶體快照，/api/fleet/latest 直接讀取）
+# =========================================
+# 快照同步寫回 data_test.db（只寫變動的船），供重啟後載入與外部工具讀取；0 = 只存在記憶體
+FLEET_SNAPSHOT_PERSIST = os.getenv("FLEET_SNAPSHOT_PERSIST", "1") == "1"
+# 寫回間隔（0 = 每輪）；期間的變動累積到下次一起寫入
+FLEET_SNAPSHOT_PERSIST_MINUTES = float(os.getenv("FLEET_SNAPSHOT_PERSIST_MINUTES", "0"))
+
+# =========================================
+# 排程設定（依 tile 活動程度調整輪詢頻率）
+# =========================================
+ADAPTIVE_SCHEDULING = os.getenv("ADAPTIVE_SCHEDULING", "0") == "1"  # 預設每 10 分鐘抓全部；1 = 依活動調整
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", "60"))
+TILE_MIN_INTERVAL = int(os.getenv("TILE_MIN_INTERVAL", "120"))     # 有海警船靠近時
+TILE_BASE_INTERVAL = int(os.getenv("TILE_BASE_INTERVAL", "600"))   # 原本的 10 分鐘
+TILE_MAX_INTERVAL = int(os.getenv("TILE_MAX_INTERVAL", "1800"))    # 安靜 tile 的上限
+TILE_BACKOFF = float(os.getenv("TILE_BACKOFF", "1.5"))
+TILE_NEAR_NM = float(os.getenv("TILE_NEAR_NM", "12"))              # 24nm 線外多少海浬算「附近」
+# 每小時請求上限（未設定 = tile 數 × 每小時 6 次，與固定排程相同）
+TILE_REQUEST_BUDGET_PER_HOUR = float(os.getenv("TILE_REQUEST_BUDGET_PER_HOUR", "0")) or None
+# 只抓部分 tile 時的推播間隔（秒）：海警船名單不變時至少間隔這麼久才再推播，名單有變化時立即推播
+ALERT_MIN_INTERVAL = int(os.getenv("ALERT_MIN_INTERVAL", str(TILE_BASE_INTERVAL)))
+# 每個 tile 一輪內重試（含等待）的總秒數上限，預設為排程週期的 1/10；
+# 用完就放棄這一輪、交給 circuit breaker，不在 fetch worker 內一直等
+FETCH_RETRY_BUDGET = float(os.getenv(
+    "FETCH_RETRY_BUDGET", str((SCHEDULER_TICK_SECONDS if ADAPTIVE_SCHEDULING else TILE_BASE_INTERVAL) / 10)))
+
+# =========================================
+# SQLite 效能設定（SQLITE_PROFILE=legacy 則完全使用 SQLite 預設值）
+# =========================================
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")     # 讀取不會被寫入 block
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")    # WAL 下 NORMAL 不會損壞 DB
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# API 專用唯讀連線池大小（每個 DB）
+API_READ_POOL_SIZE = int(os.getenv("API_READ_POOL_SIZE", "4"))
+# 啟動時大表建索引改在背景執行（0 = 啟動時全部做完才繼續）
+MIGRATIONS_ONLINE = os.getenv("MIGRATIONS_ONLINE", "1") == "1"
@@ -1,14 +1,57 @@
 import os
-from sqlalchemy import create_engine
+import threading
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from flask_sqlalchemy import SQLAlchemy
 
+from config import (
+    SQLITE_PROFILE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT_MS,
+    API_READ_POOL_SIZE
+)
+
 # =========================================
 # Flask 綁定的主資料庫 (在 models.py 使用)
 # =========================================
 db = SQLAlchemy()
 
+# ingest 寫入與背景建索引（migrations）互斥：同一時間只有一個寫入者
+WRITE_LOCK = threading.RLock()
+
+
+# =========================================
+# SQLite 連線設定（每條新連線執行一次 PRAGMA）
+# =========================================
+def sqlite_pragmas(readonly=False):
+    pragmas = ["query_only=ON"] if readonly else []
+    if SQLITE_PROFILE == "legacy":
+        return pragmas
+    pragmas += [
+        f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"cache_size=-{SQLITE_CACHE_SIZE_KB}",   # 負值單位為 KB
+        f"mmap_size={SQLITE_MMAP_SIZE}",
+    ]
+    if not readonly:
+        # journal_mode 會寫入 DB 檔，由寫入端設定即可
+        pragmas += [f"journal_mode={SQLITE_JOURNAL_MODE}", f"synchronous={SQLITE_SYNCHRONOUS}"]
+    return pragmas
+
+
+def apply_sqlite_profile(engine, readonly=False):
+    pragmas = sqlite_pragmas(readonly)
+    if not pragmas:
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
+    return engine
+
 
 # =========================================
 # 建立 engine + session + Base 的工具函式
@@ -17,6 +60,7 @@ def make_engine_and_session(db_path: str):
     """
     建立一個獨立的 SQLAlchemy engine、session、Base
     用來管理多個 SQLite 資料庫（非 Flask 綁定的）
+    這是 ingest 的寫入端；API 查詢請用 make_read_session()
     """
 
     # 將路徑轉為絕對路徑，避免 Flask 與 Scheduler session 不一致
@@ -30,6 +74,7 @@ def make_engine_and_session(db_path: str):
         connect_args={"check_same_thread": False},
         echo=False,
     )
+    apply_sqlite_profile(engine)
 
     # 建立 scoped session（確保 thread 安全）
     Session = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
@@ -40,6 +85,22 @@ def make_engine_and_session(db_path: str):
     return engine, Session, Base
 
 
+def make_read_session(db_path: str):
+    """
+    API 專用的唯讀 engine（query_only + 連線池）與 scoped session。
+    WAL 模式下讀取不會等 ingest 寫入；請在 request 結束時 remove()。
+    """
+    engine = create_engine(
+        f"sqlite:///{os.path.abspath(db_path)}",
+        connect_args={"check_same_thread": False},
+        pool_size=API_READ_POOL_SIZE,
+        max_overflow=API_READ_POOL_SIZE,
+        echo=False,
+    )
+    apply_sqlite_profile(engine, readonly=True)
+    return engine, scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
+
+
 # =========================================
 # 初始化 Flask 的主資料庫
 # =========================================
@@ -49,5 +110,6 @@ def init_db(app):
     """
     db.init_app(app)
     with app.app_context():
+        apply_sqlite_profile(db.engine)
         db.create_all()
         print("✅ Flask 主資料庫初始化完成")
@@ -0,0 +1,231 @@
+"""
+ship_ais 差異寫入（DELTA_HISTORY=1）
+
+停泊 / 慢速的船每一輪回報幾乎一樣，原本每輪都新增一整筆 ship_ais。
+差異模式下：
+  - 與該船上一筆已寫入的狀態比較，位置 / 速度 / 航向超過容許值才新增 ship_ais
+  - 沒有變化時只更新 ship_ais_run 的 last_seen / repeats（心跳）
+  - 每隔 DELTA_KEYFRAME_MINUTES 仍寫一筆完整資料
+  - 每一輪的時間記在 ingest_cycle，expand_history() 可據此展開回完整時間解析度
+"""
+import bisect
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, insert, update
+
+from config import (
+    DELTA_POSITION_TOLERANCE_M, DELTA_SPEED_TOLERANCE_KN,
+    DELTA_COURSE_TOLERANCE_DEG, DELTA_KEYFRAME_MINUTES, DELTA_MAX_GAP_MINUTES
+)
+from models import db, ShipAIS, ShipAISRun, IngestCycle
+from vessel_registry import is_view, next_ids
+
+# SQLite 單一語句的參數上限（舊版為 999）
+_IN_CHUNK = 500
+_M_PER_DEG = 111_320.0
+
+
+def _chunks(values, size=_IN_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# =========================================
+# 每艘船最後一筆已寫入的狀態
+# =========================================
+class DeltaHistory:
+    def __init__(self, position_tolerance_m=DELTA_POSITION_TOLERANCE_M,
+                 speed_tolerance_kn=DELTA_SPEED_TOLERANCE_KN,
+                 course_tolerance_deg=DELTA_COURSE_TOLERANCE_DEG,
+                 keyframe_minutes=DELTA_KEYFRAME_MINUTES, max_gap_minutes=DELTA_MAX_GAP_MINUTES):
+        self.position_tolerance_m = position_tolerance_m
+        self.speed_tolerance_kn = speed_tolerance_kn
+        self.course_tolerance_deg = course_tolerance_deg
+        self.keyframe_seconds = keyframe_minutes * 60
+        self.max_gap_seconds = max_gap_minutes * 60
+        # ship_id -> (row_id, lat, lon, speed, course, stored_at, last_seen)
+        self._last = None
+        self._session = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _load(self, session):
+        """從 ship_ais_run 取每艘船目前的那一段（row_id 最大者）"""
+        current = (session.query(func.max(ShipAISRun.row_id).label("row_id"))
+                   .group_by(ShipAISRun.ship_id).subquery())
+        rows = (session.query(ShipAIS.id, ShipAIS.ship_id, ShipAIS.lat, ShipAIS.lon,
+                                 ShipAIS.speed, ShipAIS.course, ShipAIS.timestamp, ShipAISRun.last_seen)
+                .join(current, current.c.row_id == ShipAIS.id)
+                .join(ShipAISRun, ShipAISRun.row_id == ShipAIS.id))
+        self._last = {r.ship_id: (r.id, r.lat, r.lon, r.speed, r.course, r.timestamp, r.last_seen)
+                      for r in rows}
+        self._session = session
+        self._pending = {}
+        print(f"[delta_history] 載入 {len(self._last)} 艘船的最後狀態")
+
+    def _state(self, ship_id):
+        """已寫入但尚未 commit 的狀態優先"""
+        return self._pending.get(ship_id) or self._last.get(ship_id)
+
+    # -----------------------------------------
+    # 比較
+    # -----------------------------------------
+    def changed_mask(self, batch):
+        """
+        每筆是否需要新增 ship_ais：新船 / 位置、速度、航向有變化 /
+        距上一筆超過 keyframe 間隔 / 中間消失太久（避免展開時補出沒出現的期間）
+        """
+        n = len(batch)
+        prev = [self._state(s) for s in batch["ship_id"].tolist()]
+        known = np.fromiter((p is not None for p in prev), dtype=bool, count=n)
+        if not known.any():
+            return np.ones(n, dtype=bool)
+
+        def column(i):
+            return np.array([p[i] if p is not None and p[i] is not None else np.nan for p in prev],
+                            dtype=float)
+
+        lat, lon = batch["lat"], batch["lon"]
+        speed, course = batch["speed"], batch["course"]
+        p_lat, p_lon, p_speed, p_course = column(1), column(2), column(3), column(4)
+
+        # 短距離以等距圓柱投影近似即可
+        dy = (lat - p_lat) * _M_PER_DEG
+        dx = (lon - p_lon) * _M_PER_DEG * np.cos(np.radians(lat))
+        moved = np.hypot(dx, dy) > self.position_tolerance_m
+        speed_changed = np.abs(speed - p_speed) > self.speed_tolerance_kn
+
+        # 停泊時航向雜訊很大，只在有航速時比較
+        turn = np.abs(course - p_course) % 360
+        turn = np.minimum(turn, 360 - turn)
+        underway = np.fmax(speed, p_speed) > self.speed_tolerance_kn
+        turned = underway & (turn > self.course_tolerance_deg)
+
+        timestamp = batch.timestamp
+        stale = np.fromiter(
+            (p is not None and ((timestamp - p[5]).total_seconds() >= self.keyframe_seconds
+                                or (timestamp - p[6]).total_seconds() > self.max_gap_seconds)
+             for p in prev),
+            dtype=bool, count=n)
+
+        # 與 NaN 比較一律為 False：前一筆缺值時視為有變化
+        missing = np.isnan(p_lat) | np.isnan(p_lon) | np.isnan(p_speed)
+        return ~known | missing | moved | speed_changed | turned | stale
+
+    # -----------------------------------------
+    # 寫入（加入 session，由 commit_all 一起提交）
+    # -----------------------------------------
+    def persist(self, batch, records, timestamp, session=None):
+        """
+        session: ship_ais 所在的 session（預設 db.session；依時間分割時為本輪的分割區）。
+                 換到新的分割區時重新載入：新分割區的第一輪每艘船都寫一筆完整資料。
+        回傳 (新增筆數, 只更新心跳的筆數)
+        """
+        session = db.session if session is None else session
+        with self._lock:
+            if self._last is None or session is not self._session:
+                self._load(session)
+
+            mask = self.changed_mask(batch).tolist()
+            rows = [r for r, changed in zip(records, mask) if changed]
+            row_ids = []
+            if rows:
+                # RETURNING 依參數順序取回 ship_ais.id（精簡列的 view 不支援 RETURNING，先配號）
+                table = ShipAIS.__table__
+                if is_view(session, table.name):
+                    # max(id) + 1 配號：persist 只由 write_cycles 在 WRITE_LOCK 內呼叫，commit 前不會有其他寫入者
+                    row_ids = next_ids(session, table, len(rows))
+                    session.execute(insert(table), [dict(r, id=i) for r, i in zip(rows, row_ids)])
+                else:
+                    row_ids = session.execute(
+                        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+                session.execute(insert(ShipAISRun.__table__), [
+                    {"row_id": row_id, "ship_id": r["ship_id"], "last_seen": timestamp, "repeats": 0}
+                    for row_id, r in zip(row_ids, rows)])
+
+            unchanged = [r["ship_id"] for r, changed in zip(records, mask) if not changed]
+            for chunk in _chunks([self._state(s)[0] for s in unchanged]):
+                session.execute(
+                    update(ShipAISRun)
+                    .where(ShipAISRun.row_id.in_(chunk))
+                    .values(last_seen=timestamp, repeats=ShipAISRun.repeats + 1))
+            session.merge(IngestCycle(timestamp=timestamp))
+
+            # 尚未 commit 前可能再寫入下一輪（write-behind 的 group commit），以累積的結果比對
+            for ship_id in unchanged:
+                self._pending[ship_id] = self._state(ship_id)[:6] + (timestamp,)
+            self._pending.update({r["ship_id"]: (row_id, r["lat"], r["lon"], r["speed"], r["course"],
+                                                 timestamp, timestamp)
+                                  for row_id, r in zip(row_ids, rows)})
+            return len(rows), len(unchanged)
+
+    def confirm(self):
+        """commit 成功後才更新記憶體中的狀態"""
+        with self._lock:
+            if self._last is not None:
+                self._last.update(self._pending)
+            self._pending = {}
+
+    def discard(self):
+        """commit 失敗：下次從 DB 重新載入"""
+        with self._lock:
+            self._last = None
+            self._pending = {}
+
+
+_delta = None
+
+
+def get_delta_history():
+    global _delta
+    if _delta is None:
+        _delta = DeltaHistory()
+    return _delta
+
+
+# =========================================
+# 查詢：展開回完整時間解析度
+# =========================================
+def expand_history(rows, start=None, end=None, session=None):
+    """
+    rows: ShipAIS 查詢結果。每筆依 ship_ais_run 的 last_seen，
+          在 (timestamp, last_seen] 之間的每一輪各補一筆相同狀態的資料（expanded=True）。
+    只抓部分 tile 的輪次也會補上，內容即為該船當時最後已知的狀態。
+    session: 查詢用 session（API 傳入唯讀 session，預設 db.session）
+    """
+    session = session or db.session
+    rows = list(rows)
+    runs = {}
+    row_ids = [r.id for r in rows]
+    for chunk in _chunks(row_ids):
+        for run in session.query(ShipAISRun).filter(ShipAISRun.row_id.in_(chunk)):
+            runs[run.row_id] = run.last_seen
+
+    results = []
+    for r in rows:
+        d = r.to_dict()
+        d["expanded"] = False
+        results.append(d)
+
+    last_seen = [runs[r.id] for r in rows if runs.get(r.id) and r.timestamp and runs[r.id] > r.timestamp]
+    if last_seen:
+        lo = min(r.timestamp for r in rows if r.timestamp)
+        hi = max(last_seen)
+        cycles = [c.timestamp for c in session.query(IngestCycle)
+                  .filter(IngestCycle.timestamp > lo, IngestCycle.timestamp <= hi)
+                  .order_by(IngestCycle.timestamp)]
+        for r, d in zip(rows, results[:]):
+            seen = runs.get(r.id)
+            if not seen or not r.timestamp or seen <= r.timestamp:
+                continue
+            i = bisect.bisect_right(cycles, r.timestamp)
+            j = bisect.bisect_right(cycles, seen)
+            for ts in cycles[i:j]:
+                results.append({**d, "timestamp": ts, "expanded": True})
+
+    if start is not None and end is not None:
+        results = [d for d in results if d["timestamp"] and start <= d["timestamp"] <= end]
+    results.sort(key=lambda d: d["timestamp"] or datetime.min, reverse=True)
+    return results
@@ -1,19 +1,38 @@
 import json
+import atexit
+import random
+import time
 from datetime import datetime
-from shapely.geometry import Point
-from shapely.ops import nearest_points
-import cloudscraper
-from sqlalchemy import func
 
-from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON
-from utils import safe_float, haversine, log_failed_record
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from flask import current_app
+
+from config import (
+    FETCH_CONCURRENCY, FETCH_TIMEOUT, TILE_ARCHIVE_ENABLED,
+    FETCH_RETRIES, FETCH_RETRY_BASE, FETCH_RETRY_MAX, FETCH_RETRY_BUDGET, DELTA_HISTORY, WRITE_BEHIND,
+    ALERT_MIN_INTERVAL
+)
+from utils import log_failed_record
+from database import WRITE_LOCK
+from mt_client import get_client
+from ingest import tile_key, ShipBatch, classify_batch, dedup_batch, ZONE_12NM, ZONE_24NM
+from pipeline import IngestPipeline, Stage
+from tile_archive import get_recorder
+from tile_health import get_tile_health, is_transient, INVALID_BODY
+from delta_history import get_delta_history
+from fleet_snapshot import get_fleet_state
+from write_behind import CycleWrite, WriteBehindWriter
+from partitions import ship_ais_history, china_boat_history, partition_sessions
 from models import (
-    db, ShipAIS,
+    ShipAIS,
     TestShipAIS, BoatShipAIS,
     BoatCheck12AIS, BoatCheck24AIS,
     CCGShipAIS, CCGCheck12ShipAIS, CCGCheck24ShipAIS,
     TestSession, BoatSession, BoatCheck12Session, BoatCheck24Session,
-    CCGSession, CCGCheck12Session, CCGCheck24Session, ChinaBoatSession, ChinaBoatAIS
+    CCGSession, CCGCheck12Session, CCGCheck24Session, ChinaBoatAIS,
+    ALL_SESSIONS
 )
 
 # 這裡就是你的 line_push.py 檔案
@@ -70,155 +89,475 @@ urls = [
 ]
 
 
-# 建立爬蟲 client
-scraper = cloudscraper.create_scraper()
+# =========================================
+# 共用函式：有就更新，沒有就新增（整輪一個 INSERT ... ON CONFLICT）
+# =========================================
+def upsert_ships(session, Model, rows):
+    """Model 需為 LatestShipMixin（ship_id 唯一索引）；rows 內的 ship_id 不可重複"""
+    if not rows:
+        return
+    stmt = sqlite_insert(Model.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["ship_id"],
+        set_={name: stmt.excluded[name] for name in rows[0] if name != "ship_id"})
+    session.execute(stmt, rows)
+
+# =========================================
+# 抓取單一 tile（失敗時記錄並回傳 None）
+# =========================================
+def _retry_delay(attempt, response=None):
+    """指數退避 + jitter；429 有 Retry-After 時以它為準"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and str(retry_after).isdigit():
+        return min(FETCH_RETRY_MAX, float(retry_after))
+    return min(FETCH_RETRY_MAX, FETCH_RETRY_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def fetch_tile(client, url, health=None, retry_budget=FETCH_RETRY_BUDGET):
+    """
+    health: TileHealthTracker；開路中的 tile 直接略過，不發請求。
+    暫時性錯誤（429 / 5xx / 逾時）會在同一輪內重試 FETCH_RETRIES 次，
+    但從第一次請求起算超過 retry_budget 秒就不再等待，記為失敗交給 circuit breaker；
+    其他 HTTP 錯誤與 200 但內容不是 JSON（challenge 頁）不重試。
+    """
+    if health is not None and not health.allow(url):
+        return None
+
+    deadline = time.monotonic() + retry_budget
+    for attempt in range(FETCH_RETRIES + 1):
+        response = None
+        try:
+            response = client.get(url, timeout=FETCH_TIMEOUT)
+            response.raise_for_status()
+        except Exception as e:
+            if getattr(e, "response", None) is not None:
+                response = e.response
+            status = getattr(response, "status_code", None)
+            if is_transient(status) and attempt < FETCH_RETRIES:
+                delay = _retry_delay(attempt, response)
+                if time.monotonic() + delay <= deadline:
+                    time.sleep(delay)
+                    continue
+                e = f"{e} (retry budget {retry_budget:g}s exhausted)"
+            log_failed_record({"url": url}, f"Fetch error: {e}")
+            if health is not None:
+                health.record_failure(url, status, str(e))
+            return None
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            status = getattr(response, "status_code", None)
+            log_failed_record({"url": url}, f"Invalid JSON (status {status}): {e}")
+            if health is not None:
+                health.record_failure(url, status, str(e), kind=INVALID_BODY)
+            return None
+
+        if health is not None:
+            health.record_success(url)
+        return data
 
 
 # =========================================
-# 共用函式：有就更新，沒有就新增
+# pipeline 各階段
 # =========================================
-def upsert_ship(session, Model, ship_id, values_dict):
-    record = session.query(Model).filter_by(ship_id=ship_id).first()
-    if record:
-        for key, val in values_dict.items():
-            setattr(record, key, val)
-    else:
-        session.add(Model(**values_dict))
+def make_fetch_stage(client, timestamp, recorder=None, fetched=None, health=None):
+    """
+    (tile_index, url) → (tile_index, url, data)
+    有 recorder 時順便錄製原始回應；成功的 tile key 會加入 fetched。
+    """
+    def fetch(item):
+        tile_index, url = item
+        data = fetch_tile(client, url, health)
+        if data is None:
+            return None
+        if fetched is not None:
+            fetched.append(tile_key(url))
+        if recorder is not None:
+            recorder.record(url, data, cycle_at=timestamp)
+        return (tile_index, url, data)
+    return fetch
+
+
+def make_parse_stage(timestamp):
+    """(tile_index, url, data) → ShipBatch（整個 tile 一次轉成欄式資料）"""
+    def parse(item):
+        tile_index, url, data = item
+        rows = data.get("data", {}).get("rows", [])
+        return ShipBatch.from_rows(rows, tile_key(url), timestamp, tile_index)
+    return parse
+
+
+def classify_stage(batch):
+    """ShipBatch → 加上 is_cn / is_ccg / zone / distance_km 欄位"""
+    return classify_batch(batch)
+
+
+def build_pipeline(client, timestamp, concurrency=None, recorder=None, fetched=None, health=None):
+    if concurrency is None:
+        concurrency = FETCH_CONCURRENCY
+    return IngestPipeline([
+        Stage("fetch", make_fetch_stage(client, timestamp, recorder, fetched, health),
+              workers=concurrency),
+        Stage("parse", make_parse_stage(timestamp)),
+        Stage("classify", classify_stage),
+    ])
+
 
 # =========================================
-# 主函式：抓取 + 儲存 + 分類
+# 只新增不修改的歷史表：整輪一次 executemany，不建立 ORM 物件
 # =========================================
+def bulk_insert(session, Model, rows):
+    if rows:
+        session.execute(insert(Model.__table__), rows)
+
+
+def savepoint(session):
+    """
+    SAVEPOINT：失敗時只退回這一段，同一個 session 先前寫入的輪次（group commit）
+    與其他資料表（AIS_UNIFIED_STORE 共用一個 session）不受影響。
+    pysqlite 在第一個 DML 前不會 BEGIN，此時的 SAVEPOINT 會成為最外層交易（RELEASE 即 commit），先自行 BEGIN。
+    """
+    connection = session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+    return session.begin_nested()
+
+
+def persist_history(batch, records, timestamp, delta=None):
+    """所有船隻歷史資料（ship_ais）；delta 不為 None 時只寫入有變化的船"""
+    # 依時間分割時寫入本輪所屬的分割區（新的一期第一次寫入時建立）
+    session = ship_ais_history.write_session(timestamp)
+    if delta is None:
+        bulk_insert(session, ShipAIS, records)
+        return
+    try:
+        with savepoint(session):
+            written, heartbeats = delta.persist(batch, records, timestamp, session)
+        print(f"📝 ship_ais 差異寫入：新增 {written} 筆，{heartbeats} 艘僅更新 last_seen")
+    except Exception as e:
+        # 差異狀態下次重新載入；這一輪改寫完整資料，不記 ingest_cycle（每艘船都有實際資料，不需展開）
+        delta.discard()
+        log_failed_record({"url": "N/A - ship_ais delta"}, f"Delta history write failed, writing full rows: {e}")
+        bulk_insert(session, ShipAIS, records)
+
+
+def _pick(records, mask):
+    return [records[i] for i in np.flatnonzero(mask)]
+
+
+def persist_appends(batch, records):
+    """中國籍 / 海警船 / 12nm / 12–24nm 的歷史表，依 classify_batch 的欄位分流"""
+    is_ccg = batch["is_ccg"]
+    china_boat_session = china_boat_history.write_session(batch.timestamp)
+    bulk_insert(china_boat_session, ChinaBoatAIS, _pick(records, batch["is_cn"]))
+    bulk_insert(BoatSession, BoatShipAIS, _pick(records, is_ccg))
+    bulk_insert(BoatCheck12Session, BoatCheck12AIS, _pick(records, is_ccg & (batch["zone"] == ZONE_12NM)))
+    bulk_insert(BoatCheck24Session, BoatCheck24AIS, _pick(records, is_ccg & (batch["zone"] == ZONE_24NM)))
+
+
+def persist_latest(batch, records):
+    """海警船的最新狀態（CCG / ccg_check12 / ccg_check24）"""
+    is_ccg = batch["is_ccg"]
+    upsert_ships(CCGSession, CCGShipAIS, _pick(records, is_ccg))
+    upsert_ships(CCGCheck12Session, CCGCheck12ShipAIS, _pick(records, is_ccg & (batch["zone"] == ZONE_12NM)))
+    upsert_ships(CCGCheck24Session, CCGCheck24ShipAIS, _pick(records, is_ccg & (batch["zone"] == ZONE_24NM)))
+
+
+def persist_fleet(fleet, snapshot):
+    """
+    data_test.db：最新船隊快照的持久化副本，只寫入有變動的船、刪除已消失的船；
+    與其他 DB 一起 commit，不再有清空後重寫的空窗。回傳是否有寫入（未到持久化時間為 False）
+    """
+    changes = fleet.pending_changes(snapshot)
+    if changes is None:
+        return False
+    changed, removed = changes
+    for i in range(0, len(removed), 500):
+        TestSession.query(TestShipAIS).filter(
+            TestShipAIS.ship_id.in_(removed[i:i + 500])).delete(synchronize_session=False)
+    upsert_ships(TestSession, TestShipAIS, changed)
+    return True
 
 
-def fetch_data(force_push=False):
-    timestamp = datetime.utcnow()
-    print(f"[{timestamp}] 🚢 Fetching AIS data...")
+# =========================================
+# 單艘船的推播資料（不需推播時回傳 None）
+# =========================================
+def ship_alert(record_kwargs, meta, timestamp):
+    shipname = record_kwargs["shipname"]
+
+    # === 若為海警船 ===
+    if not meta["is_ccg"]:
+        return None
+
+    # line_push 函式需要的是字串
+    time_str = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    alert = {
+        'shipname': shipname,
+        'lat': record_kwargs['lat'],
+        'lon': record_kwargs['lon'],
+        'course': record_kwargs['course'],
+        'speed': record_kwargs['speed'],
+        'timestamp': time_str
+    }
+
+    # ✅ 12nm 內
+    if meta["zone"] == "12nm":
+        print(f"🚨 {shipname} 進入 12nm")
+        return alert
+
+    # ✅ 12–24nm 間（在 24nm 內但不在 12nm 內）
+    if meta["zone"] == "24nm":
+        print(f"⚠️ {shipname} 在 12–24nm 之間")
+        # 到 12nm 邊界的距離 (推播函式需要的額外欄位)
+        alert['distance_km'] = meta["distance_km"]
+        return alert
+
+    return None
+
 
-    # *** 新增 ***
-    # 建立兩個列表，用來收集要推播的船隻
-    ships_inside_list = []
-    ships_outside_list = []
-    # ************
+# =========================================
+# 推播名單：只抓部分 tile 時，沿用其他 tile 上一次的結果
+# =========================================
+# source key -> {ship_id: (zone, alert)}
+_alerts_by_tile = {}
+
+
+def merge_alert_state(cycle_alerts, seen_tiles, polled_keys, partial):
+    """
+    cycle_alerts: 本輪在 12 / 24nm 內的海警船 {ship_id: (zone, alert)}
+    seen_tiles  : 本輪每艘船出現過的 tile
+    polled_keys : 本輪成功抓到的 tile
+    partial     : True 表示只抓了部分 tile（排程依活動程度分批抓）
+
+    回傳 (ships_inside_list, ships_outside_list)，涵蓋所有 tile 的最新已知狀態，
+    避免沒被抓到的 tile 上的海警船被誤判為「離開」。
+    """
+    if not partial:
+        _alerts_by_tile.clear()
+    for key in polled_keys:
+        _alerts_by_tile[key] = {}
+    # 本輪看到的船以本輪結果為準
+    for ships in _alerts_by_tile.values():
+        for ship_id in [sid for sid in ships if sid in seen_tiles]:
+            del ships[ship_id]
+    for ship_id, entry in cycle_alerts.items():
+        for key in seen_tiles[ship_id]:
+            _alerts_by_tile.setdefault(key, {})[ship_id] = entry
+
+    merged = {}
+    for ships in _alerts_by_tile.values():
+        for ship_id, entry in ships.items():
+            merged.setdefault(ship_id, entry)
+
+    ships_inside_list = [alert for zone, alert in merged.values() if zone == "12nm"]
+    ships_outside_list = [alert for zone, alert in merged.values() if zone == "24nm"]
+    return ships_inside_list, ships_outside_list
+
+
+# 上一次推播的時間與名單（船名, 範圍）
+_last_alert = {"time": None, "ships": None}
+
+
+def alerts_due(ships_inside, ships_outside, timestamp, partial, force=False, min_interval=ALERT_MIN_INTERVAL):
+    """
+    推播頻率與輪詢頻率脫鉤：hot tile 每 1–2 分鐘輪詢一次，但每次的時間與座標都不同，
+    line_push2 的 hash 永遠不同、冷卻時間不會生效。
+    整輪抓取與 force 一律推播（與原本每 10 分鐘一次相同）；只抓部分 tile 時，
+    名單有變化（進入 / 離開 / 換範圍）立即推播，名單不變則至少間隔 min_interval 秒。
+    """
+    ships = frozenset([(a["shipname"], "12nm") for a in ships_inside] +
+                      [(a["shipname"], "24nm") for a in ships_outside])
+    last = _last_alert
+    due = (force or not partial or ships != last["ships"] or last["time"] is None
+           or (timestamp - last["time"]).total_seconds() >= min_interval)
+    if due:
+        last.update(time=timestamp, ships=ships)
+    return due
 
-    # === 每次重抓前，清空 data_test.db ===
+
+# =========================================
+# 提交各 DB
+# =========================================
+def commit_all():
+    """分庫模式依序提交九個 DB（加上寫入過的歷史分割區）；單一檔案模式只有一個交易"""
+    sessions = ALL_SESSIONS + partition_sessions()
     try:
-        TestSession.query(TestShipAIS).delete()
-        TestSession.commit()
-        print("🧹 Cleared data_test.db")
+        for session in sessions:
+            session.commit()
+        return True
+
     except Exception as e:
-        TestSession.rollback()
-        log_failed_record({}, f"Clear data_test failed: {e}")
+        rollback_all(sessions)
+        log_failed_record({"url": "N/A - DB Commit"}, f"DB commit error: {e}")
+        return False
+
 
-    scraper = cloudscraper.create_scraper()
+def rollback_all(sessions=None):
+    for session in sessions if sessions is not None else ALL_SESSIONS + partition_sessions():
+        session.rollback()
 
-    for url in urls:
+
+# =========================================
+# 寫入一或多輪並提交（同步寫入 / write-behind 共用）
+# =========================================
+def write_cycles(cycles):
+    """
+    write-behind 落後時多輪合併成一個交易（group commit）；最新船隊快照以最後一個有快照的輪次為準
+    （journal 補寫的輪次沒有快照，只寫歷史）。
+    回傳 (是否 commit 成功, 寫入秒數, commit 秒數)
+    """
+    delta = get_delta_history() if DELTA_HISTORY else None
+    fleet = get_fleet_state()
+    with WRITE_LOCK:
+        persist_started = time.perf_counter()
+        snapshot = next((c.snapshot for c in reversed(cycles) if c.snapshot is not None), None)
         try:
-            response = scraper.get(url, timeout=20)
-            response.raise_for_status()
-            data = response.json()
+            for cycle in cycles:
+                if cycle.records:
+                    persist_history(cycle.batch, cycle.records, cycle.timestamp, delta)
+                    persist_appends(cycle.batch, cycle.records)
+                    persist_latest(cycle.batch, cycle.records)
+            fleet_persisted = snapshot is not None and persist_fleet(fleet, snapshot)
         except Exception as e:
-            log_failed_record({"url": url}, f"Fetch error: {e}")
-            continue
+            # 寫到一半失敗：丟掉 session 中已加入的資料，重試時才不會連同這次的殘留一起提交
+            rollback_all()
+            if delta is not None:
+                delta.discard()
+            log_failed_record({"url": "N/A - DB Write"}, f"DB write error: {e}")
+            return False, time.perf_counter() - persist_started, 0.0
+        persist_seconds = time.perf_counter() - persist_started
+
+        commit_started = time.perf_counter()
+        committed = commit_all()
+        if delta is not None and committed:
+            delta.confirm()
+        elif delta is not None:
+            delta.discard()
+        # commit 失敗時 data_test.db 下次重新比對快照
+        if fleet_persisted and committed:
+            fleet.confirm(snapshot)
+        return committed, persist_seconds, time.perf_counter() - commit_started
+
+
+def prepare_cycle(cycle, publish=True):
+    """
+    補上寫入需要的 records；publish=True 時建立並發佈本輪的最新船隊快照。
+    journal 補寫的舊輪次用 publish=False，只寫歷史、不動線上快照
+    """
+    if publish:
+        cycle.snapshot = get_fleet_state().advance(cycle.batch, cycle.drop_sources)
+    if cycle.records is None:
+        cycle.records = cycle.batch.records() if cycle.batch is not None else []
+    return cycle
+
+
+_writer = None
+
+
+def get_writer():
+    """write-behind writer（第一次使用時先補寫上次中斷前留在 journal 的輪次）"""
+    global _writer
+    if _writer is None:
+        writer = WriteBehindWriter(lambda cycles: write_cycles(cycles)[0], current_app._get_current_object())
+        for cycle in writer.journal.pending():
+            print(f"♻️ 補寫 journal 中的輪次 {cycle.timestamp}")
+            try:
+                committed = write_cycles([prepare_cycle(cycle, publish=False)])[0]
+            except Exception as e:
+                log_failed_record({"url": "N/A - write-behind journal"}, f"Journal replay error: {e}")
+                committed = False
+            # 補寫失敗時保留 journal，下次重啟再試；其餘輪次與 writer 照常啟動
+            if committed:
+                writer.journal.remove(cycle.journal_path)
+            else:
+                print(f"⚠️ journal 輪次 {cycle.timestamp} 補寫失敗，保留至下次重啟")
+        writer.start()
+        atexit.register(writer.close)
+        _writer = writer
+    return _writer
 
-        key = url.replace("https://www.marinetraffic.com/getData/",
-                          "").replace("/", "_").replace(":", "_")
-        rows = data.get("data", {}).get("rows", [])
-        if not rows:
-            continue
-
-        for row in rows:
-            lat = safe_float(row.get("LAT"))
-            lon = safe_float(row.get("LON"))
-            shipname = row.get("SHIPNAME") or ""
-            ship_id = row.get("SHIP_ID")
-
-            if not (lat and lon and ship_id):
-                continue
-
-            record_kwargs = {
-                "timestamp": timestamp,  # 這裡的 timestamp 是 datetime 物件
-                "source": key,
-                "ship_id": ship_id,
-                "shipname": shipname,
-                "lat": lat,
-                "lon": lon,
-                "speed": safe_float(row.get("SPEED")) / 10,
-                "course": safe_float(row.get("COURSE")),
-                "heading": safe_float(row.get("HEADING")),
-                "rot": safe_float(row.get("ROT")),
-                "destination": row.get("DESTINATION"),
-                "dwt": row.get("DWT"),
-                "flag": row.get("FLAG"),
-                "shiptype": row.get("SHIPTYPE"),
-                "gt_shiptype": row.get("GT_SHIPTYPE"),
-                "length": row.get("LENGTH"),
-                "width": row.get("WIDTH"),
-            }
-
-            # === 所有船隻歷史資料 ===
-            db.session.add(ShipAIS(**record_kwargs))
-            # === 最新資料（覆蓋寫入）===
-            upsert_ship(TestSession, TestShipAIS, ship_id, record_kwargs)
-
-            # === 若為中國籍船舶 (flag == "CN") ===
-            if record_kwargs.get("flag") == "CN":
-                ChinaBoatSession.add(ChinaBoatAIS(**record_kwargs))
-
-            # === 若為海警船 ===
-            if shipname.startswith("CHINACOASTGUARD"):
-                BoatSession.add(BoatShipAIS(**record_kwargs))
-                upsert_ship(CCGSession, CCGShipAIS, ship_id, record_kwargs)
-
-                p = Point(lon, lat)
-                in_12nm = p.within(TAIWAN_12NM_POLYGON)
-                in_24nm = p.within(TAIWAN_24NM_POLYGON)
-
-                # *** 修改：將 timestamp 轉為字串 ***
-                # line_push 函式需要的是字串
-                time_str = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-
-                # ✅ 12nm 內
-                if in_12nm:
-                    BoatCheck12Session.add(BoatCheck12AIS(**record_kwargs))
-                    upsert_ship(CCGCheck12Session, CCGCheck12ShipAIS,
-                                ship_id, record_kwargs)
-                    print(f"🚨 {shipname} 進入 12nm")
-
-                    # *** 新增 ***
-                    # 加入到 12 海浬推播列表
-                    ships_inside_list.append({
-                        'shipname': shipname,
-                        'lat': lat,
-                        'lon': lon,
-                        'course': record_kwargs['course'],
-                        'speed': record_kwargs['speed'],
-                        'timestamp': time_str
-                    })
-
-                # ✅ 12–24nm 間（在 24nm 內但不在 12nm 內）
-                elif in_24nm and not in_12nm:
-                    BoatCheck24Session.add(BoatCheck24AIS(**record_kwargs))
-                    upsert_ship(CCGCheck24Session, CCGCheck24ShipAIS,
-                                ship_id, record_kwargs)
-                    print(f"⚠️ {shipname} 在 12–24nm 之間")
-
-                    # *** 新增 ***
-                    # 計算到 12nm 邊界的距離 (line_push 函式需要這個)
-                    p_12nm, _ = nearest_points(TAIWAN_12NM_POLYGON, p)
-                    distance_km = haversine(p.y, p.x, p_12nm.y, p_12nm.x)
-
-                    # 加入到 12-24 海浬推播列表
-                    ships_outside_list.append({
-                        'shipname': shipname,
-                        'lat': lat,
-                        'lon': lon,
-                        'course': record_kwargs['course'],
-                        'speed': record_kwargs['speed'],
-                        'timestamp': time_str,
-                        'distance_km': distance_km  # 推播函式需要的額外欄位
-                    })
-
-    # === *** 新增：觸發 LINE 推播 *** ===
+
+# =========================================
+# 主函式：抓取 + 儲存 + 分類
+# =========================================
+def fetch_data(force_push=False, concurrency=None, client=None, tile_urls=None,
+               timestamp=None, send_alerts=True, record=TILE_ARCHIVE_ENABLED,
+               track_health=True):
+    """
+    client     : 任何具備 get(url, timeout=...) 的物件，
+                 預設使用 mt_client 的全域長期 client（測試時可注入替身）。
+    tile_urls  : 要抓的 tile（預設為 urls）；只抓部分 tile 時，
+                 最新船隊快照（data_test.db）與推播名單只更新這些 tile 的部分
+    timestamp  : 本輪時間（重播錄製資料時沿用原始時間）
+    send_alerts: False 時不觸發 LINE 推播（重播 / 重建用）
+    record     : 是否把原始 tile 回應寫入 tile_archive
+    track_health: 是否套用各 tile 的 circuit breaker（重播時關閉）
+    """
+    timestamp = timestamp or datetime.utcnow()
+    started = time.perf_counter()
+    print(f"[{timestamp}] 🚢 Fetching AIS data...")
+
+    partial = tile_urls is not None
+    tile_urls = urls if tile_urls is None else tile_urls
+
+    if client is None:
+        client = get_client()
+
+    # 上次中斷前留在 journal 的輪次要在本輪建立快照之前補寫完
+    writer = get_writer() if WRITE_BEHIND else None
+
+    # === 下載 / 解析 / 幾何分類以 pipeline 重疊執行，結果在此 thread 去重 ===
+    recorder = get_recorder() if record else None
+    health = get_tile_health() if track_health else None
+    fetched = []
+    pipeline = build_pipeline(client, timestamp, concurrency, recorder, fetched, health)
+    cycle_batch = ShipBatch.concat(list(pipeline.run(enumerate(tile_urls))))
+    total_rows = len(cycle_batch) if cycle_batch is not None else 0
+    cycle_batch, seen_tiles = dedup_batch(cycle_batch)
+
+    print(f"🔁 去重：{total_rows} 筆 → {len(seen_tiles)} 艘")
+    if health is not None:
+        health.save()
+
+    # === 最新船隊快照：整輪重抓時整份換新，只抓部分 tile 時只換掉這些 tile 的船 ===
+    cycle = prepare_cycle(CycleWrite(
+        timestamp, cycle_batch, [tile_key(u) for u in tile_urls] if partial else None))
+    records = cycle.records
+
+    # === 每艘船只寫入 / 分類一次（寫入到 commit 之間持有 WRITE_LOCK）===
+    # write-behind 時交給 writer thread，只在佇列滿時等待
+    if WRITE_BEHIND:
+        submit_started = time.perf_counter()
+        writer.submit(cycle)
+        pipeline.record_persist_time(time.perf_counter() - submit_started)
+        commit_seconds = 0.0
+    else:
+        _, persist_seconds, commit_seconds = write_cycles([cycle])
+        pipeline.record_persist_time(persist_seconds)
+        pipeline.record_persist_time(commit_seconds)
+
+    cycle_alerts = {}
+    ccg_by_tile = {}
+    cycle_items = zip(records, cycle_batch.metas()) if records else ()
+    for record_kwargs, meta in cycle_items:
+        alert = ship_alert(record_kwargs, meta, timestamp)
+        ship_id = record_kwargs["ship_id"]
+        if alert:
+            cycle_alerts[ship_id] = (meta["zone"], alert)
+        if meta["is_ccg"]:
+            for key in seen_tiles[ship_id]:
+                ccg_by_tile.setdefault(key, []).append({
+                    "lat": record_kwargs["lat"], "lon": record_kwargs["lon"], "zone": meta["zone"]})
+
+    if send_alerts:
+        ships_inside_list, ships_outside_list = merge_alert_state(
+            cycle_alerts, seen_tiles, fetched, partial)
+    else:
+        ships_inside_list = [a for zone, a in cycle_alerts.values() if zone == "12nm"]
+        ships_outside_list = [a for zone, a in cycle_alerts.values() if zone == "24nm"]
+
+    # === 觸發 LINE 推播 ===
     # 在所有 URL 都爬完後，整理一次並發送
     print(
         f"📊 抓取完成. 12nm 內: {len(ships_inside_list)} 艘, 12-24nm: {len(ships_outside_list)} 艘")
@@ -226,7 +565,11 @@ def fetch_data(force_push=False):
     # 判斷是否要推播：
     # 1. 有找到任何船 (inside 或 outside)
     # 2. 或是 app.py 啟動時傳來的 force_push=True (這時就算沒船也會報平安)
-    if ships_inside_list or ships_outside_list or force_push:
+    if not send_alerts:
+        print("ℹ️ send_alerts=False，本次不推播。")
+    elif not alerts_due(ships_inside_list, ships_outside_list, timestamp, partial, force_push):
+        print(f"ℹ️ 海警船名單未變，距上次推播未滿 {ALERT_MIN_INTERVAL} 秒，本次跳過推播。")
+    elif ships_inside_list or ships_outside_list or force_push:
         print("🚀 正在觸發 LINE 推播...")
         try:
             send_line_alert(
@@ -242,28 +585,16 @@ def fetch_data(force_push=False):
                 ships_inside_list)}, f"LINE push failed in fetcher: {e}")
     else:
         print("ℹ️ 無海警船可通報，且非 force_push，本次跳過推播。")
-    # === *** 推播區塊結束 *** ===
-
-    # === 提交各 DB ===
-    try:
-        db.session.commit()
-        TestSession.commit()
-        BoatSession.commit()
-        BoatCheck12Session.commit()
-        BoatCheck24Session.commit()
-        CCGSession.commit()
-        CCGCheck12Session.commit()
-        CCGCheck24Session.commit()
-        ChinaBoatSession.commit()
-
-    except Exception as e:
-        db.session.rollback()
-        TestSession.rollback()
-        BoatSession.rollback()
-        BoatCheck12Session.rollback()
-        BoatCheck24Session.rollback()
-        CCGSession.rollback()
-        CCGCheck12Session.rollback()
-        CCGCheck24Session.rollback()
-        ChinaBoatSession.rollback()
-        log_failed_record({"url": "N/A - DB Commit"}, f"DB commit error: {e}")
+    # === 推播區塊結束 ===
+
+    extra = {"write_behind": writer.stats()} if writer is not None else {}
+    pipeline.publish_stats(timestamp, time.perf_counter() - started,
+                           commit_seconds=round(commit_seconds, 4), **extra)
+    print(f"⏱️ pipeline: {pipeline.stats()}")
+
+    # 給排程器使用：哪些 tile 抓取成功、各 tile 上的海警船位置
+    return {
+        "timestamp": timestamp,
+        "tiles_ok": fetched,
+        "ccg_by_tile": ccg_by_tile,
+    }
@@ -2,11 +2,11 @@ import json
 from datetime import datetime
 from shapely.geometry import Point, Polygon
 from shapely.ops import nearest_points
-import cloudscraper
 from sqlalchemy import func
 
 from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON
 from utils import safe_float, haversine, log_failed_record
+from mt_client import get_client
 from models import (
     db, ShipAIS,
     TestShipAIS, BoatShipAIS,
@@ -35,10 +35,6 @@ urls = [
     "https://www.marinetraffic.com/getData/get_data_json_4/z:8/X:107/Y:54/station:0",
 ]
 
-# 建立爬蟲 client
-scraper = cloudscraper.create_scraper()
-
-
 # =========================================
 # 共用函式：有就更新，沒有就新增
 # =========================================
@@ -54,13 +50,14 @@ def upsert_ship(session, Model, ship_id, values_dict):
 # =========================================
 # 主函式：抓取 + 儲存 + 分類 + 警戒檢查
 # =========================================
-def fetch_data(force_push=False):
+def fetch_data(force_push=False, client=None):
     timestamp = datetime.utcnow()
     print(f"[{timestamp}] 🚢 Fetching AIS data...")
 
     ships_inside_list = []
     ships_outside_list = []
-    scraper = cloudscraper.create_scraper()
+    if client is None:
+        client = get_client()
 
     # === 清空 test db ===
     try:
@@ -73,7 +70,7 @@ def fetch_data(force_push=False):
 
     for url in urls:
         try:
-            response = scraper.get(url, timeout=20)
+            response = client.get(url, timeout=20)
             response.raise_for_status()
             data = response.json()
         except Exception as e:
@@ -0,0 +1,200 @@
+"""
+最新船隊狀態：記憶體內的欄式快照（取代每輪清空再重寫 data_test.db）
+
+每輪以去重 / 分類後的 ShipBatch 建立新的 FleetSnapshot，建立完成才整個替換（atomic swap）：
+  - 讀取端（API）直接拿 current()，永遠是完整的一輪，不需查詢 DB、不需加鎖
+  - 快照建立後不再修改；ship_id / source（tile）索引在建立時一併完成
+  - 只抓部分 tile 時，沿用上一份快照中其他 tile 的船（與原本只清除這些 tile 的行為相同）
+data_test.db 改為快照的持久化副本（FLEET_SNAPSHOT_PERSIST）：只寫入有變動的船、刪除消失的船，
+與其他 DB 在同一輪 commit；啟動時由 data_test.db 載入，重啟後 API 立即有資料。
+"""
+import threading
+
+import numpy as np
+
+from config import FLEET_SNAPSHOT_PERSIST, FLEET_SNAPSHOT_PERSIST_MINUTES
+from ingest import RECORD_FIELDS, ShipBatch, classify_batch, ZONE_NAMES
+
+META_FIELDS = ShipBatch.META_COLUMNS
+_EMPTY = {
+    **{name: np.array([], dtype=object) for name in RECORD_FIELDS},
+    "is_cn": np.array([], dtype=bool), "is_ccg": np.array([], dtype=bool),
+    "zone": np.array([], dtype=np.int8), "distance_km": np.array([], dtype=float),
+    "version": np.array([], dtype=np.int64),
+}
+
+
+def _empty_snapshot():
+    return FleetSnapshot(None, {name: col.copy() for name, col in _EMPTY.items()}, 0)
+
+
+# =========================================
+# 不可變快照
+# =========================================
+class FleetSnapshot:
+    """
+    columns: RECORD_FIELDS + 分類欄位 + version（該列寫入時的快照版本，持久化時找出變動的列）
+    timestamp 欄位為各船最後一次出現的時間；self.timestamp 為最近一輪的時間
+    """
+
+    def __init__(self, timestamp, columns, version):
+        self.timestamp = timestamp
+        self.columns = columns
+        self.version = version
+        self.by_ship = {ship_id: i for i, ship_id in enumerate(columns["ship_id"].tolist())}
+        self.by_source = {}
+        sources = columns["source"]
+        if len(sources):
+            keys, inverse = np.unique(sources.astype(str), return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+            self.by_source = {key: order[a:b] for key, a, b in zip(keys.tolist(), bounds[:-1], bounds[1:])}
+
+    def __len__(self):
+        return len(self.columns["ship_id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows_for(self, ship_id=None, source=None):
+        """ship_id / source 的列號（未指定 = 全部）"""
+        if ship_id is not None:
+            i = self.by_ship.get(ship_id)
+            rows = np.array([], dtype=np.int64) if i is None else np.array([i])
+            if source is not None and len(rows) and self.columns["source"][i] != source:
+                rows = rows[:0]
+            return rows
+        if source is not None:
+            return self.by_source.get(source, np.array([], dtype=np.int64))
+        return np.arange(len(self))
+
+    def records(self, rows=None, meta=False):
+        """轉成 dict 列表（欄位與 ShipBaseMixin 相同；meta=True 另附分類結果）"""
+        rows = np.arange(len(self)) if rows is None else rows
+        names = RECORD_FIELDS + (META_FIELDS if meta else ())
+        cols = [self.columns[name][rows].tolist() for name in names]
+        result = [dict(zip(names, values)) for values in zip(*cols)]
+        if meta:
+            for r in result:
+                r["zone"] = ZONE_NAMES[r["zone"]]
+                r["distance_km"] = None if r["distance_km"] != r["distance_km"] else r["distance_km"]
+        return result
+
+    def build(self, batch, drop_sources=None):
+        """
+        batch       : 本輪去重 + 分類後的 ShipBatch（可為 None）
+        drop_sources: None = 整輪重抓，上一份快照全部捨棄；
+                      否則只捨棄這些 tile 的船，其他 tile 的船保留
+        """
+        version = self.version + 1
+        keep = np.zeros(len(self), dtype=bool)
+        if drop_sources is not None and len(self):
+            keep = ~np.isin(self.columns["source"].astype(str), list(drop_sources))
+        if batch is not None and len(batch) and keep.any():
+            keep &= ~np.isin(self.columns["ship_id"].astype(str), batch["ship_id"].astype(str))
+
+        parts = [{name: col[keep] for name, col in self.columns.items()}]
+        if batch is not None and len(batch):
+            n = len(batch)
+            fresh = {name: batch[name] for name in RECORD_FIELDS[1:] + META_FIELDS}
+            fresh["timestamp"] = np.full(n, batch.timestamp, dtype=object)
+            fresh["version"] = np.full(n, version, dtype=np.int64)
+            parts.append(fresh)
+        columns = {name: np.concatenate([p[name] for p in parts]) for name in self.columns}
+        timestamp = batch.timestamp if batch is not None else self.timestamp
+        return FleetSnapshot(timestamp, columns, version)
+
+
+# =========================================
+# 目前的快照 + data_test.db 持久化
+# =========================================
+class FleetState:
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._persisted_version = 0
+        self._persisted_ids = set()
+        self._persisted_at = None
+
+    def current(self):
+        """最新發佈的快照（第一次呼叫時由 data_test.db 載入）"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def publish(self, snapshot):
+        # 單一參考替換：讀取端拿到的不是舊的一份就是新的一份
+        self._snapshot = snapshot
+
+    def advance(self, batch, drop_sources=None):
+        """以本輪建立新快照並發佈；回傳新快照（持久化時使用）"""
+        with self._build_lock:
+            snapshot = self.current().build(batch, drop_sources)
+            self.publish(snapshot)
+        return snapshot
+
+    def _load(self):
+        from models import TestSession, TestShipAIS
+
+        try:
+            rows = TestSession.query(*[getattr(TestShipAIS, name) for name in RECORD_FIELDS]).all()
+        except Exception as e:
+            print(f"[fleet] ⚠️ 無法由 data_test.db 載入最新狀態: {e}")
+            rows = []
+        finally:
+            TestSession.remove()
+        if not rows:
+            return _empty_snapshot()
+
+        values = dict(zip(RECORD_FIELDS, (list(v) for v in zip(*rows))))
+        self._persisted_ids = set(values["ship_id"])
+        timestamp = max((t for t in values["timestamp"] if t is not None), default=None)
+        if timestamp is None:
+            # 沒有可用的時間：從空的快照開始，這些列在下次持久化時刪除
+            print(f"[fleet] ⚠️ data_test.db 的 {len(rows)} 筆資料都沒有 timestamp，不載入")
+            return _empty_snapshot()
+        columns = {name: np.array(values[name], dtype=object) for name in RECORD_FIELDS}
+        for name in ("lat", "lon", "speed", "course", "heading", "rot"):
+            columns[name] = np.array([0.0 if v is None else v for v in values[name]], dtype=float)
+        columns["shipname"] = np.array([v or "" for v in values["shipname"]], dtype=object)
+        columns = classify_batch(ShipBatch(None, columns)).columns
+        columns["version"] = np.zeros(len(rows), dtype=np.int64)
+        print(f"🛳️ 由 data_test.db 載入 {len(rows)} 艘船的最新狀態")
+        return FleetSnapshot(timestamp, columns, 0)
+
+    def pending_changes(self, snapshot):
+        """
+        需寫入 data_test.db 的 (變動的列, 消失的 ship_id)；未到持久化時間時回傳 None
+        commit 成功後呼叫 confirm(snapshot)，失敗時下次重新比對即可
+        """
+        if not FLEET_SNAPSHOT_PERSIST:
+            return None
+        if (self._persisted_at is not None and snapshot.timestamp is not None
+                and (snapshot.timestamp - self._persisted_at).total_seconds() < FLEET_SNAPSHOT_PERSIST_MINUTES * 60):
+            return None
+        changed = snapshot.records(np.flatnonzero(snapshot["version"] > self._persisted_version))
+        removed = list(self._persisted_ids.difference(snapshot.by_ship))
+        return changed, removed
+
+    def confirm(self, snapshot):
+        self._persisted_version = snapshot.version
+        self._persisted_ids = set(snapshot.by_ship)
+        self._persisted_at = snapshot.timestamp
+
+
+_fleet = None
+_fleet_lock = threading.Lock()
+
+
+def get_fleet_state():
+    global _fleet
+    if _fleet is None:
+        with _fleet_lock:
+            if _fleet is None:
+                _fleet = FleetState()
+    return _fleet
@@ -0,0 +1,307 @@
+"""
+到 12nm / 24nm 線與領海基線的距離引擎（整批計算，球面距離）
+
+每條線拆成線段，每 32 段一組、以 Mercator 投影建 STRtree：
+  1. 線段起點中找出投影上最近者，算出實際距離 d1（最近距離的上界）
+  2. 實際距離可能小於 d1 的線段一併取出（投影比例隨緯度變化，半徑取該範圍內最保守者）
+  3. 每個候選線段在投影上求最近點，再以 haversine 算距離取最小值
+取代逐點 nearest_points(多邊形, 點)；任何船、任意海浬門檻（6nm、30nm…）都可整批判斷。
+
+門檻判斷另有距離場（DISTANCE_FIELD_CELL_DEG > 0）：事先算好格點到線的距離，
+查表得到每點距離的上下界，只有上下界跨過門檻的點才精確計算。距離場依線段與格點間距
+算 hash，與海域網格一起存在 ZONE_GRID_DIR。
+基線需另外提供 GeoJSON（TAIWAN_BASELINE_GEOJSON），沒有時只有 12nm / 24nm 線。
+"""
+import os
+import hashlib
+import threading
+
+import numpy as np
+import shapely
+
+from config import (
+    TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON, TAIWAN_BASELINE,
+    DISTANCE_THRESHOLDS_NM, DISTANCE_FIELD_CELL_DEG, TILE_NEAR_NM, ZONE_GRID_DIR
+)
+from geo_zones import segment_coords
+from utils import km_to_nm
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """utils.haversine 的陣列版本"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+# =========================================
+# 一條線（或一組線）的線段索引
+# =========================================
+def mercator(lon, lat):
+    """Mercator 投影（弧度）：局部各方向比例相同，投影距離 × R × cos(緯度) ≈ 實際距離"""
+    return np.radians(lon), np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def unmercator(x, y):
+    return np.degrees(x), np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+class LineDistance:
+    """
+    線段每 CHUNK 段一組建 STRtree（12nm / 24nm 線的線段只有數十公尺、非常密，
+    逐段建索引時候選線段太多），樹只負責找出候選的組，組內的線段以 numpy 一次計算。
+    """
+
+    CHUNK = 32
+    MAX_SEGMENT_DEG = 0.01   # 長線段先切成不超過約 1 km 的小段
+
+    def __init__(self, segments):
+        """segments: segment_coords() 的 (n, 2, 2) 陣列（lon, lat）"""
+        self.segments = self._split(segments, self.MAX_SEGMENT_DEG)
+        self.projected = np.stack(mercator(self.segments[:, :, 0], self.segments[:, :, 1]), axis=-1)
+        chunk_of = np.arange(len(self.segments)) // self.CHUNK
+        self.tree = shapely.STRtree(shapely.multilinestrings(shapely.linestrings(self.projected),
+                                                             indices=chunk_of))
+        # 線段起點另建點的索引：點對點的 query_nearest 比點對線快很多
+        self.sample_tree = shapely.STRtree(shapely.points(self.projected[:, 0]))
+
+    @staticmethod
+    def _split(segments, max_deg):
+        """
+        GeoJSON 的邊在經緯度上是直線，投影後不是；數百公里的長邊（外環的封閉邊等）
+        先在經緯度上切短，投影上的直線與原本的邊才幾乎重合
+        """
+        start, delta = segments[:, 0], segments[:, 1] - segments[:, 0]
+        count = np.maximum(1, np.ceil(np.abs(delta).max(axis=1) / max_deg)).astype(int)
+        owner = np.repeat(np.arange(len(segments)), count)
+        step = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        t0 = (step / count[owner])[:, None]
+        t1 = ((step + 1) / count[owner])[:, None]
+        return np.stack([start[owner] + delta[owner] * t0, start[owner] + delta[owner] * t1], axis=1)
+
+    def _chunk_pairs(self, rows, chunks):
+        """(點, 組) → (點, 線段)：每組展開成組內所有線段"""
+        segments = (chunks[:, None] * self.CHUNK + np.arange(self.CHUNK)).ravel()
+        rows = np.repeat(rows, self.CHUNK)
+        valid = segments < len(self.segments)
+        return rows[valid], segments[valid]
+
+    def _min_km(self, lon, lat, x, y, rows, segments, count):
+        """每點在候選線段中的最小距離（km）"""
+        near_lon, near_lat = self._nearest_on_segment(x[rows], y[rows], segments)
+        best = np.full(count, np.inf)
+        np.minimum.at(best, rows, haversine_km(lat[rows], lon[rows], near_lat, near_lon))
+        return best
+
+    def distance_km(self, lon, lat):
+        """每點到最近線段的距離（km）；座標無效的點為 NaN"""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        result = np.full(len(lon), np.nan)
+        rows = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat) & (np.abs(lat) < 85))
+        if not len(rows) or not len(self.segments):
+            return result
+        lon, lat = lon[rows], lat[rows]
+        x, y = mercator(lon, lat)
+        points = shapely.points(x, y)
+
+        # 投影上最近的線段起點 → 實際距離 d1（起點在線上，真正的最近距離 ≤ d1）
+        pair_rows, nearest = self.sample_tree.query_nearest(points)
+        d1 = np.full(len(rows), np.inf)
+        np.minimum.at(d1, pair_rows, haversine_km(lat[pair_rows], lon[pair_rows],
+                                                  self.segments[nearest, 0, 1], self.segments[nearest, 0, 0]))
+        # 距離 < d1 的線段都在以該點為中心、半徑 d1 的範圍內，該範圍內投影比例最小處
+        # （緯度最高處）換算的投影半徑內一定包含它們
+        reach = np.minimum(np.abs(lat) + np.degrees(d1 / EARTH_RADIUS_KM), 89.0)
+        radius = d1 / (EARTH_RADIUS_KM * np.cos(np.radians(reach)))
+        pair_rows, pair_segments = self._chunk_pairs(*self.tree.query(
+            points, predicate="dwithin", distance=radius * (1 + 1e-9) + 1e-12))
+        result[rows] = self._min_km(lon, lat, x, y, pair_rows, pair_segments, len(rows))
+        return result
+
+    def _nearest_on_segment(self, x, y, segments):
+        """投影上點到線段的最近點（Mercator 局部各方向比例相同，最近點即局部最近點），回傳 (lon, lat)"""
+        ax, ay = self.projected[segments, 0, 0] - x, self.projected[segments, 0, 1] - y
+        dx = self.projected[segments, 1, 0] - self.projected[segments, 0, 0]
+        dy = self.projected[segments, 1, 1] - self.projected[segments, 0, 1]
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, -(ax * dx + ay * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        return unmercator(x + ax + t * dx, y + ay + t * dy)
+
+
+# =========================================
+# 距離場（門檻判斷用）
+# =========================================
+class DistanceField:
+    """
+    nodes[iy, ix]：格點 (x0 + ix * cell_deg, y0 + iy * cell_deg) 到線的距離（km）。
+    任一點到線的距離與最近格點相差不超過兩點間的距離（三角不等式），
+    因此查表即得每點距離的上下界；上下界之間沒有門檻的點不必精確計算。
+    格點涵蓋線外至少 margin_km，範圍外的點距離一定超過 margin_km。
+    """
+
+    SLACK = 1.005, 0.01   # 上下界額外放寬（比例, km）：涵蓋投影最近點與球面最近點的微小差異
+
+    def __init__(self, x0, y0, cell_deg, nodes, margin_km):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell_deg = cell_deg
+        self.nodes = nodes
+        self.margin_km = margin_km
+
+    @classmethod
+    def build(cls, line, cell_deg, margin_km):
+        lon, lat = line.segments[:, :, 0], line.segments[:, :, 1]
+        # 緯度差 Δφ → 距離 ≥ R·Δφ；經度差 Δλ → 距離 ≥ 2R·asin(cos(最高緯度)·sin(Δλ/2))
+        margin_lat = np.degrees(margin_km / EARTH_RADIUS_KM) + cell_deg
+        top = np.radians(min(np.abs(lat).max() + margin_lat, 89.0))
+        margin_lon = np.degrees(2 * np.arcsin(min(np.sin(margin_km / EARTH_RADIUS_KM / 2) / np.cos(top), 1.0))) \
+            + cell_deg
+        x0 = np.floor((lon.min() - margin_lon) / cell_deg) * cell_deg
+        y0 = np.floor((lat.min() - margin_lat) / cell_deg) * cell_deg
+        nx = int(np.ceil((lon.max() + margin_lon - x0) / cell_deg)) + 1
+        ny = int(np.ceil((lat.max() + margin_lat - y0) / cell_deg)) + 1
+        ix, iy = np.meshgrid(np.arange(nx), np.arange(ny))
+        nodes = line.distance_km(x0 + ix.ravel() * cell_deg, y0 + iy.ravel() * cell_deg)
+        return cls(x0, y0, cell_deg, nodes.reshape(ny, nx), margin_km)
+
+    @classmethod
+    def load_or_build(cls, name, line, cell_deg, margin_km, cache_dir=ZONE_GRID_DIR):
+        digest = hashlib.sha1(repr((cell_deg, margin_km)).encode())
+        digest.update(line.segments.tobytes())
+        path = os.path.join(cache_dir, f"distance_field_{name}_{digest.hexdigest()[:16]}.npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return cls(float(data["x0"]), float(data["y0"]), cell_deg, data["nodes"], margin_km)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[geo_distance] ⚠️ 距離場快取 {path} 無法讀取，重新建立: {e}")
+
+        field = cls.build(line, cell_deg, margin_km)
+        print(f"[geo_distance] 🗺️ 建立 {name} 距離場 {field.nodes.shape[1]}x{field.nodes.shape[0]}")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, x0=field.x0, y0=field.y0, nodes=field.nodes)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[geo_distance] ⚠️ 距離場快取寫入失敗: {e}")
+        return field
+
+    def bounds_km(self, lon, lat):
+        """每點距離的 (下界, 上界)；距離場範圍外為 (margin_km, inf)"""
+        ny, nx = self.nodes.shape
+        fx = np.rint((lon - self.x0) / self.cell_deg)
+        fy = np.rint((lat - self.y0) / self.cell_deg)
+        inside = (fx >= 0) & (fx < nx) & (fy >= 0) & (fy < ny)
+        ratio, extra = self.SLACK
+        # 範圍外的下界是球面距離的嚴格下界（引擎算的距離是到線上某點的距離，不會更小）
+        lower = np.full(len(lon), self.margin_km)
+        upper = np.full(len(lon), np.inf)
+        ix, iy = fx[inside].astype(np.intp), fy[inside].astype(np.intp)
+        node = self.nodes[iy, ix]
+        gap = haversine_km(lat[inside], lon[inside], self.y0 + iy * self.cell_deg, self.x0 + ix * self.cell_deg)
+        lower[inside] = (node - gap) / ratio - extra
+        upper[inside] = (node + gap) * ratio + extra
+        return lower, upper
+
+
+# =========================================
+# 距離引擎
+# =========================================
+class DistanceEngine:
+    """
+    lines: {名稱: 多邊形或線}；多邊形以其邊界計算（範圍內外都是到邊界的距離）
+    field_cell_deg: 距離場格點間距（度）；0 / None = 不使用距離場，門檻判斷一律精確計算
+    field_margin_nm: 距離場涵蓋線外多遠（海浬）；應不小於常用的門檻，範圍外的點即可直接判定超過
+    距離場在第一次做門檻判斷時才建立（或載入快取），只算距離的流程（classify_batch）不需等待
+    """
+
+    def __init__(self, lines, field_cell_deg=None, field_margin_nm=None, cache_dir=ZONE_GRID_DIR):
+        self.lines = {name: LineDistance(segment_coords(geometry))
+                      for name, geometry in lines.items() if geometry is not None}
+        self.field_cell_deg = field_cell_deg
+        # 多留 1 海浬：範圍外的點在門檻剛好等於 field_margin_nm 時也能直接判定
+        self.field_margin_km = ((field_margin_nm or 0) + 1) / km_to_nm(1.0)
+        self.cache_dir = cache_dir
+        self.fields = {}
+        self._fields_lock = threading.Lock()
+
+    def field(self, name):
+        """name 線的距離場（不使用距離場或線沒有線段時為 None）"""
+        line = self.lines.get(name)
+        if not self.field_cell_deg or line is None or not len(line.segments):
+            return None
+        if name not in self.fields:
+            with self._fields_lock:
+                if name not in self.fields:
+                    self.fields[name] = DistanceField.load_or_build(
+                        name, line, self.field_cell_deg, self.field_margin_km, self.cache_dir)
+        return self.fields[name]
+
+    def names(self):
+        return list(self.lines)
+
+    def distance_km(self, name, lon, lat, rows=None):
+        """到 name 線的距離（km）；rows 指定時只計算並回傳這些列"""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        if rows is not None:
+            lon, lat = lon[rows], lat[rows]
+        line = self.lines.get(name)
+        if line is None:
+            return np.full(len(lon), np.nan)
+        return line.distance_km(lon, lat)
+
+    def distance_nm(self, name, lon, lat, rows=None):
+        return km_to_nm(self.distance_km(name, lon, lat, rows))
+
+    def bands(self, name, lon, lat, thresholds):
+        """
+        每點所屬的門檻區間：thresholds（海浬，由小到大）中第一個 ≥ 距離者的索引，
+        超過全部門檻、座標無效或沒有這條線時為 len(thresholds)。
+        距離場的上下界已能決定區間的點直接查表，其餘才精確計算。
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        thresholds = np.sort(np.asarray(thresholds, dtype=float))
+        band = np.full(len(lon), len(thresholds), dtype=np.intp)
+        if name not in self.lines:
+            return band
+        pending = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        field = self.field(name) if len(pending) else None
+        if field is not None:
+            lower, upper = field.bounds_km(lon[pending], lat[pending])
+            low = np.searchsorted(thresholds, km_to_nm(lower), side="left")
+            high = np.searchsorted(thresholds, km_to_nm(upper), side="left")
+            known = low == high
+            band[pending[known]] = low[known]
+            pending = pending[~known]
+        if len(pending):
+            nm = self.distance_nm(name, lon, lat, pending)
+            band[pending] = np.searchsorted(thresholds, nm, side="left")
+        return band
+
+    def within_nm(self, name, lon, lat, nm):
+        """是否在 name 線 nm 海浬內（沒有這條線時一律 False）"""
+        return self.bands(name, lon, lat, [nm]) == 0
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_distance_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DistanceEngine({"12nm": TAIWAN_12NM_POLYGON, "24nm": TAIWAN_24NM_POLYGON,
+                                          "baseline": TAIWAN_BASELINE},
+                                         field_cell_deg=DISTANCE_FIELD_CELL_DEG,
+                                         field_margin_nm=max(DISTANCE_THRESHOLDS_NM + [TILE_NEAR_NM]))
+    return _engine
@@ -0,0 +1,181 @@
+"""
+海域範圍分類引擎（12nm / 12–24nm / 範圍外）
+
+多邊形先 prepare（GEOS 建立點在多邊形內的索引），整批座標以 shapely 2.0 的
+contains_xy 一次判斷，不再逐點建立 Point 呼叫 within。
+不限海警船：classify(lon, lat, mask) 只判斷 mask 為 True 的列，任何船種都可使用。
+
+查表網格（ZONE_GRID_CELL_DEG > 0）：把所有範圍的外框切成固定大小的格子，事先標記每格為
+12nm 內 / 12–24nm / 範圍外 / 邊界。大部分船所在的格子完全落在某個範圍內外，查表即可；
+只有邊界格的點才做精確的 contains_xy。網格依多邊形內容與格子大小算 hash，存在
+ZONE_GRID_DIR，多邊形沒變時啟動直接載入。
+"""
+import os
+import hashlib
+import threading
+
+import numpy as np
+import shapely
+
+from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON, ZONE_GRID_CELL_DEG, ZONE_GRID_DIR
+
+ZONE_NONE, ZONE_12NM, ZONE_24NM = 0, 12, 24
+BOUNDARY = -1   # 網格中跨越範圍邊界的格子
+
+
+def segment_coords(geometry):
+    """
+    多邊形的所有邊界（外環與內環）或線（基線）拆成線段，回傳 (n, 2, 2) 陣列：
+    [線段, 起點 / 終點, (lon, lat)]
+    """
+    parts = shapely.get_parts(geometry)
+    polygonal = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    lines = np.concatenate([shapely.get_rings(parts[polygonal]), parts[~polygonal]])
+    segments = []
+    for line in lines:
+        coords = shapely.get_coordinates(line)
+        if len(coords) > 1:
+            segments.append(np.stack([coords[:-1], coords[1:]], axis=1))
+    return np.concatenate(segments) if segments else np.empty((0, 2, 2))
+
+
+def boundary_segments(polygon):
+    """多邊形所有邊界拆成兩點一段的 LineString 陣列"""
+    return shapely.linestrings(segment_coords(polygon))
+
+
+# =========================================
+# 查表網格
+# =========================================
+class ZoneGrid:
+    """cells[iy, ix]：該格的 zone 代碼，或 BOUNDARY（需精確判斷）；網格外一律 ZONE_NONE"""
+
+    def __init__(self, x0, y0, cell_deg, cells):
+        self.x0 = x0
+        self.y0 = y0
+        self.cell_deg = cell_deg
+        self.cells = cells
+
+    @classmethod
+    def build(cls, classifier, cell_deg):
+        bounds = np.array([polygon.bounds for _, polygon in classifier.zones])
+        # 格線對齊 cell_deg 的整數倍，外框多留一格
+        x0 = (np.floor(bounds[:, 0].min() / cell_deg) - 1) * cell_deg
+        y0 = (np.floor(bounds[:, 1].min() / cell_deg) - 1) * cell_deg
+        nx = int(np.ceil((bounds[:, 2].max() - x0) / cell_deg)) + 1
+        ny = int(np.ceil((bounds[:, 3].max() - y0) / cell_deg)) + 1
+
+        ix, iy = np.meshgrid(np.arange(nx), np.arange(ny))
+        xmin, ymin = x0 + ix.ravel() * cell_deg, y0 + iy.ravel() * cell_deg
+        # 不碰到任何邊界的格子整格同一範圍，以中心點判斷即可
+        cells = classifier.classify_exact(xmin + cell_deg / 2, ymin + cell_deg / 2)
+        tree = shapely.STRtree(shapely.box(xmin, ymin, xmin + cell_deg, ymin + cell_deg))
+        for _, polygon in classifier.zones:
+            _, hits = tree.query(boundary_segments(polygon), predicate="intersects")
+            cells[hits] = BOUNDARY
+        return cls(x0, y0, cell_deg, cells.reshape(ny, nx))
+
+    @classmethod
+    def load_or_build(cls, classifier, cell_deg, cache_dir=ZONE_GRID_DIR):
+        digest = hashlib.sha1(repr(cell_deg).encode())
+        for code, polygon in classifier.zones:
+            digest.update(str(code).encode())
+            digest.update(shapely.to_wkb(polygon))
+        path = os.path.join(cache_dir, f"zone_grid_{digest.hexdigest()[:16]}.npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return cls(float(data["x0"]), float(data["y0"]), cell_deg, data["cells"])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[geo_zones] ⚠️ 網格快取 {path} 無法讀取，重新建立: {e}")
+
+        grid = cls.build(classifier, cell_deg)
+        boundary = float((grid.cells == BOUNDARY).mean())
+        print(f"[geo_zones] 🗺️ 建立查表網格 {grid.cells.shape[1]}x{grid.cells.shape[0]}，"
+              f"邊界格 {boundary:.1%}")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, x0=grid.x0, y0=grid.y0, cells=grid.cells)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[geo_zones] ⚠️ 網格快取寫入失敗: {e}")
+        return grid
+
+    def lookup(self, lon, lat):
+        """每點所在格子的值（BOUNDARY 表示需精確判斷）"""
+        ny, nx = self.cells.shape
+        with np.errstate(invalid="ignore"):
+            fx = np.floor((lon - self.x0) / self.cell_deg)
+            fy = np.floor((lat - self.y0) / self.cell_deg)
+            inside = (fx >= 0) & (fx < nx) & (fy >= 0) & (fy < ny)
+        result = np.full(len(lon), ZONE_NONE, dtype=np.int8)
+        result[inside] = self.cells[fy[inside].astype(np.intp), fx[inside].astype(np.intp)]
+        return result
+
+
+# =========================================
+# 分類引擎
+# =========================================
+class ZoneClassifier:
+    """
+    zones: [(zone 代碼, polygon), ...]，由內而外；同時在多個範圍內時以前面的為準。
+           polygon 為 None（GeoJSON 載入失敗）的範圍略過。
+    grid_cell_deg: 查表網格的格子大小（度）；0 / None = 不使用網格，每點都精確判斷
+    """
+
+    def __init__(self, zones, grid_cell_deg=None, cache_dir=ZONE_GRID_DIR):
+        self.zones = [(code, polygon) for code, polygon in zones if polygon is not None]
+        for _, polygon in self.zones:
+            shapely.prepare(polygon)
+            # 先查詢一次，讓 GEOS 在這裡建好索引（之後多個 classify worker 同時查詢只讀取）
+            shapely.contains_xy(polygon, 0.0, 0.0)
+        self.grid = None
+        if grid_cell_deg and self.zones:
+            self.grid = ZoneGrid.load_or_build(self, grid_cell_deg, cache_dir)
+
+    def classify(self, lon, lat, mask=None):
+        """回傳每列的 zone 代碼（int8）；mask 為 False 的列一律 ZONE_NONE"""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        rows = np.arange(len(lon)) if mask is None else np.flatnonzero(mask)
+        if self.grid is None:
+            return self.classify_exact(lon, lat, rows)
+        zone = np.full(len(lon), ZONE_NONE, dtype=np.int8)
+        cell = self.grid.lookup(lon[rows], lat[rows])
+        known = cell != BOUNDARY
+        zone[rows[known]] = cell[known]
+        # 只有邊界格的點需要精確判斷
+        pending = rows[~known]
+        if len(pending):
+            zone[pending] = self.classify_exact(lon, lat, pending)[pending]
+        return zone
+
+    def classify_exact(self, lon, lat, rows=None):
+        """不經網格，每點以 contains_xy 判斷（rows 以外的列為 ZONE_NONE）"""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        zone = np.full(len(lon), ZONE_NONE, dtype=np.int8)
+        pending = np.arange(len(lon)) if rows is None else rows
+        for code, polygon in self.zones:
+            if not len(pending):
+                break
+            inside = shapely.contains_xy(polygon, lon[pending], lat[pending])
+            zone[pending[inside]] = code
+            pending = pending[~inside]
+        return zone
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_zone_classifier():
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = ZoneClassifier([(ZONE_12NM, TAIWAN_12NM_POLYGON),
+                                              (ZONE_24NM, TAIWAN_24NM_POLYGON)],
+                                             grid_cell_deg=ZONE_GRID_CELL_DEG)
+    return _classifier
@@ -0,0 +1,220 @@
+import sys
+
+import numpy as np
+
+from utils import safe_float
+from geo_zones import ZONE_NONE, ZONE_12NM, ZONE_24NM, get_zone_classifier
+from geo_distance import get_distance_engine
+
+# MarineTraffic 欄位 → DB 欄位
+NUMERIC_FIELDS = {
+    "lat": "LAT",
+    "lon": "LON",
+    "speed": "SPEED",
+    "course": "COURSE",
+    "heading": "HEADING",
+    "rot": "ROT",
+}
+STRING_FIELDS = {
+    "ship_id": "SHIP_ID",
+    "shipname": "SHIPNAME",
+    "destination": "DESTINATION",
+    "dwt": "DWT",
+    "flag": "FLAG",
+    "shiptype": "SHIPTYPE",
+    "gt_shiptype": "GT_SHIPTYPE",
+    "length": "LENGTH",
+    "width": "WIDTH",
+}
+# 與 ShipBaseMixin / 原本 record_kwargs 相同的欄位順序
+RECORD_FIELDS = ("timestamp", "source", "ship_id", "shipname", "lat", "lon",
+                 "speed", "course", "heading", "rot", "destination", "dwt",
+                 "flag", "shiptype", "gt_shiptype", "length", "width")
+
+ZONE_NAMES = {ZONE_NONE: None, ZONE_12NM: "12nm", ZONE_24NM: "24nm"}
+
+
+# =========================================
+# tile 網址 → source key
+# =========================================
+def tile_key(url):
+    return url.replace("https://www.marinetraffic.com/getData/",
+                       "").replace("/", "_").replace(":", "_")
+
+
+# =========================================
+# 欄位轉換
+# =========================================
+def _float_column(values):
+    """等同逐筆 safe_float：無法轉換 / None 一律為 0.0"""
+    try:
+        arr = np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        arr = np.array([safe_float(v) for v in values], dtype=float)
+    arr[np.isnan(arr)] = 0.0
+    return arr
+
+
+def _str_column(values):
+    """船名 / 旗籍等重複值很多，intern 後同一字串只存一份"""
+    return np.array([sys.intern(v) if isinstance(v, str) else v for v in values], dtype=object)
+
+
+# =========================================
+# 欄式批次：一個 tile（或一整輪）的船舶資料
+# =========================================
+class ShipBatch:
+    """
+    數值欄位（lat / lon / speed / course / heading / rot / elapsed）為 float ndarray，
+    字串欄位為 intern 過的 object ndarray。
+    tile_index / row_index 記錄原始位置，去重與輸出順序都以它為準。
+    classify_batch() 之後另有 is_cn / is_ccg / zone / distance_km 欄位。
+    """
+
+    COLUMNS = tuple(NUMERIC_FIELDS) + tuple(STRING_FIELDS) + ("source", "elapsed", "tile_index", "row_index")
+    META_COLUMNS = ("is_cn", "is_ccg", "zone", "distance_km")
+
+    def __init__(self, timestamp, columns):
+        self.timestamp = timestamp
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns["ship_id"])
+
+    @classmethod
+    def from_rows(cls, rows, key, timestamp, tile_index=0):
+        """tile 的 rows → 批次（已剔除無經緯度 / 無 SHIP_ID 的資料），沒有有效資料時回傳 None"""
+        n = len(rows)
+        if not n:
+            return None
+
+        columns = {}
+        for name, field in NUMERIC_FIELDS.items():
+            columns[name] = _float_column([r.get(field) for r in rows])
+        for name, field in STRING_FIELDS.items():
+            columns[name] = _str_column([r.get(field) for r in rows])
+        columns["shipname"] = _str_column([r.get("SHIPNAME") or "" for r in rows])
+        columns["speed"] /= 10
+
+        elapsed = np.array([safe_float(r.get("ELAPSED"), None) for r in rows], dtype=float)
+        elapsed[np.isnan(elapsed)] = np.inf   # 沒有 ELAPSED 視為最舊
+        columns["elapsed"] = elapsed
+        columns["source"] = np.full(n, sys.intern(key), dtype=object)
+        columns["tile_index"] = np.full(n, tile_index, dtype=np.int64)
+        columns["row_index"] = np.arange(n, dtype=np.int64)
+
+        valid = (columns["lat"] != 0) & (columns["lon"] != 0) \
+            & np.array([bool(v) for v in columns["ship_id"]], dtype=bool)
+        batch = cls(timestamp, columns)
+        if not valid.all():
+            batch = batch.take(np.flatnonzero(valid))
+        return batch if len(batch) else None
+
+    @classmethod
+    def concat(cls, batches):
+        batches = [b for b in batches if b is not None and len(b)]
+        if not batches:
+            return None
+        names = batches[0].columns.keys()
+        columns = {name: np.concatenate([b.columns[name] for b in batches]) for name in names}
+        return cls(batches[0].timestamp, columns)
+
+    def take(self, indices):
+        return ShipBatch(self.timestamp, {name: col[indices] for name, col in self.columns.items()})
+
+    def filled_counts(self):
+        """每筆非空欄位數（去重時判斷資料完整度）"""
+        counts = np.zeros(len(self), dtype=np.int64)
+        for name in NUMERIC_FIELDS:
+            counts += self.columns[name] != 0
+        for name in STRING_FIELDS:
+            counts += np.array([v not in (None, "") for v in self.columns[name]], dtype=np.int64)
+        return counts
+
+    def records(self):
+        """轉成寫入 DB 用的 dict 列表（欄位與 ShipBaseMixin 相同）"""
+        cols = [self.columns[name].tolist() for name in RECORD_FIELDS[1:]]
+        timestamp = self.timestamp
+        return [dict(zip(RECORD_FIELDS, (timestamp,) + values)) for values in zip(*cols)]
+
+    def metas(self):
+        """每筆的分類結果 dict（需先 classify_batch）"""
+        is_cn = self.columns["is_cn"].tolist()
+        is_ccg = self.columns["is_ccg"].tolist()
+        zone = self.columns["zone"].tolist()
+        distance = self.columns["distance_km"].tolist()
+        return [
+            {"is_cn": c, "is_ccg": g, "zone": ZONE_NAMES[z], "distance_km": None if d != d else d}
+            for c, g, z, d in zip(is_cn, is_ccg, zone, distance)
+        ]
+
+
+# =========================================
+# 幾何分類：旗籍 / 海警船 / 12nm、12–24nm
+# =========================================
+def classify_batch(batch):
+    """
+    新增分類欄位：
+      is_cn       : 中國籍船舶 (flag == "CN")
+      is_ccg      : 海警船（船名以 CHINACOASTGUARD 開頭）
+      zone        : 海警船所在範圍 ZONE_12NM / ZONE_24NM（12–24nm 之間）/ ZONE_NONE
+      distance_km : 12–24nm 海警船到 12nm 邊界的距離（其他為 NaN）
+    """
+    n = len(batch)
+    is_cn = batch["flag"] == "CN"
+    is_ccg = np.fromiter((name.startswith("CHINACOASTGUARD") for name in batch["shipname"]),
+                         dtype=bool, count=n)
+    distance_km = np.full(n, np.nan)
+
+    # 整批座標一次判斷（geo_zones）
+    classifier = get_zone_classifier()
+    lats, lons = batch["lat"], batch["lon"]
+    zone = classifier.classify(lons, lats, mask=is_ccg)
+    between = np.flatnonzero(zone == ZONE_24NM)
+    distance_km[between] = get_distance_engine().distance_km("12nm", lons, lats, between)
+
+    batch.columns.update({"is_cn": np.asarray(is_cn, dtype=bool), "is_ccg": is_ccg,
+                          "zone": zone, "distance_km": distance_km})
+    return batch
+
+
+# =========================================
+# 跨 tile 去重（同一輪抓取）
+# =========================================
+def dedup_batch(batch):
+    """
+    z8 / z9 / z10 的 tile 大量重疊，同一艘船會在一輪中出現多次。
+    以 ship_id 為 key 只保留一筆：
+      1. ELAPSED（距上次回報的分鐘數）較小者較新
+      2. 一樣新時，非空欄位較多者較完整
+      3. 仍相同時保留 (tile_index, row_index) 較小者
+    輸出依每艘船第一次出現的位置排序，與 tile 下載完成的先後無關。
+
+    回傳 (去重後的批次, seen_tiles)；seen_tiles 為 {ship_id: [source key, ...]}。
+    """
+    if batch is None or not len(batch):
+        return batch, {}
+
+    # 先依原始位置排序，ship 編號即為第一次出現的順序
+    batch = batch.take(np.lexsort((batch["row_index"], batch["tile_index"])))
+    index = {}
+    codes = np.fromiter((index.setdefault(s, len(index)) for s in batch["ship_id"]),
+                        dtype=np.int64, count=len(batch))
+
+    # 每艘船排序後第一筆即為最佳（lexsort 以最後一個 key 為主）
+    order = np.lexsort((batch["row_index"], batch["tile_index"],
+                        -batch.filled_counts(), batch["elapsed"], codes))
+    sorted_codes = codes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    best = batch.take(order[first])
+
+    seen_tiles = {}
+    for ship_id, source in zip(batch["ship_id"].tolist(), batch["source"].tolist()):
+        tiles = seen_tiles.setdefault(ship_id, [])
+        if source not in tiles:
+            tiles.append(source)
+    return best, seen_tiles
@@ -0,0 +1,409 @@
+"""
+九個資料庫（或單一檔案模式）的版本化 schema migration 與索引管理
+
+每個邏輯資料庫（store）各自記錄已套用的版本（schema_migrations 表），
+init_models 建表後呼叫 upgrade()：
+  - 一般 migration 立即執行
+  - online=True 的 migration（大表建索引）交給背景 thread，
+    以 WRITE_LOCK 與 ingest 寫入錯開；WAL 模式下 API 讀取不受影響
+
+    python migrations.py status            # 各 store 版本 / 索引 / 筆數
+    python migrations.py upgrade           # 立即套用全部（含建索引）
+    python migrations.py explain           # API 查詢的 EXPLAIN QUERY PLAN
+    python migrations.py reindex [store]   # 重建索引
+    VESSEL_REGISTRY=1 python migrations.py downgrade 7 [store]
+                                           # 精簡列還原為一般表，之後才能關閉 VESSEL_REGISTRY
+
+已套用的版本同時記錄 schema 的格式：套用過 compact_position_rows（7）的 store 是精簡列，
+VESSEL_REGISTRY 與此不一致時啟動會失敗（check_layout），不會在兩種格式之間混用。
+"""
+import sys
+import time
+import threading
+from datetime import datetime
+
+from sqlalchemy import text, inspect
+
+from database import db, WRITE_LOCK
+from config import VESSEL_REGISTRY
+from spatial_index import create_rtree, rtree_name
+from vessel_registry import compact_table, expand_table, is_view, pos_name
+from partitions import HISTORIES
+from models import (
+    ShipAIS, TestShipAIS, BoatShipAIS, BoatCheck12AIS, BoatCheck24AIS,
+    CCGShipAIS, CCGCheck12ShipAIS, CCGCheck24ShipAIS, ChinaBoatAIS,
+    test_engine, boat_engine, boat_check12_engine, boat_check24_engine,
+    ccg_engine, ccg_check12_engine, ccg_check24_engine, china_boat_engine
+)
+
+HISTORY = "history"   # 只新增的歷史表
+LATEST = "latest"     # 每艘船一筆的最新狀態表
+
+
+# =========================================
+# store：一個邏輯資料庫（分庫模式 = 一個檔案）
+# =========================================
+class Store:
+    def __init__(self, name, engine, model, kind):
+        self.name = name
+        self._engine = engine
+        self.model = model
+        self.kind = kind
+
+    @property
+    def engine(self):
+        # 主 DB 的 engine 由 Flask-SQLAlchemy 建立，需在 app context 內取得
+        return self._engine() if callable(self._engine) else self._engine
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+
+STORES = [
+    Store("ais_data", lambda: db.engine, ShipAIS, HISTORY),
+    Store("data_test", test_engine, TestShipAIS, LATEST),
+    Store("boat_test", boat_engine, BoatShipAIS, HISTORY),
+    Store("boat_check12", boat_check12_engine, BoatCheck12AIS, HISTORY),
+    Store("boat_check24", boat_check24_engine, BoatCheck24AIS, HISTORY),
+    Store("ccg", ccg_engine, CCGShipAIS, LATEST),
+    Store("ccg_check12", ccg_check12_engine, CCGCheck12ShipAIS, LATEST),
+    Store("ccg_check24", ccg_check24_engine, CCGCheck24ShipAIS, LATEST),
+    Store("chinaboat", china_boat_engine, ChinaBoatAIS, HISTORY),
+]
+
+
+def _partition_store(history, partition):
+    return Store(f"{history.name}@{partition.key}", lambda: partition.engine, history.Model, HISTORY)
+
+
+def all_stores():
+    """STORES 加上 HISTORY_PARTITION 的各分割區檔案"""
+    return STORES + [_partition_store(history, partition)
+                     for history in HISTORIES for partition in history.partitions()]
+
+
+# =========================================
+# migration 定義（version 只能增加，已發佈的不要修改）
+# =========================================
+class Migration:
+    def __init__(self, version, name, targets, apply, online=False, revert=None):
+        self.version = version
+        self.name = name
+        self.targets = targets   # store 種類（HISTORY / LATEST）或 store 名稱
+        self.apply = apply       # apply(conn, store)
+        self.online = online
+        self.revert = revert     # revert(conn, store)；None = 不提供 downgrade
+
+    def applies_to(self, store):
+        # 分割區（ais_data@2025-01）套用與原本 store 相同的 migration
+        return store.kind in self.targets or store.name.split("@")[0] in self.targets
+
+
+def _dedup_latest(conn, store):
+    """同一艘船保留最新一筆（timestamp 最新，相同時保留 id 較大者），再補上 ship_id 唯一索引"""
+    table = store.table
+    removed = conn.execute(text(f"""
+        DELETE FROM {table} WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY ship_id ORDER BY timestamp DESC, id DESC) AS rn
+                FROM {table} WHERE ship_id IS NOT NULL
+            ) WHERE rn > 1
+        )""")).rowcount
+    for ix in store.model.__table__.indexes:
+        ix.create(conn, checkfirst=True)
+    if removed:
+        print(f"🔧 {store.name}: 移除 {removed} 筆重複 ship_id")
+
+
+def _create_index(suffix, *columns):
+    def apply(conn, store):
+        name = f"ix_{store.table}_{suffix}"
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {store.table} ({', '.join(columns)})"))
+    return apply
+
+
+def _history_rtree(conn, store):
+    backfilled = create_rtree(conn, store.table)
+    if backfilled:
+        print(f"🔧 {store.name}: R*Tree 回填 {backfilled} 筆")
+
+
+def _compact_position_rows(conn, store):
+    moved = compact_table(conn, store.table)
+    if moved:
+        print(f"🔧 {store.name}: {moved} 筆轉為精簡列")
+
+
+def _expand_position_rows(conn, store):
+    restored = expand_table(conn, store.table, store.model.__table__)
+    if restored:
+        print(f"🔧 {store.name}: {restored} 筆還原為一般表")
+
+
+def _track_segment_columns(conn, store):
+    """HistoryShipMixin 的壓縮欄位 + 壓縮進度（新建的表 create_all 時已有這些欄位）"""
+    existing = {c["name"] for c in inspect(conn).get_columns(store.table)}
+    for name, type_ in (("end_time", "DATETIME"), ("speed_min", "FLOAT"),
+                        ("speed_max", "FLOAT"), ("points", "INTEGER")):
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {store.table} ADD COLUMN {name} {type_}"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS compaction_state (
+            table_name VARCHAR(100) PRIMARY KEY,
+            compacted_until DATETIME
+        )"""))
+
+
+MIGRATIONS = [
+    Migration(1, "latest_ship_id_unique", (LATEST,), _dedup_latest),
+    # /api/ais/history 依船查軌跡、各 API 依時間排序 / 篩選
+    Migration(2, "ship_id_timestamp_index", (HISTORY,), _create_index("ship_id_timestamp", "ship_id", "timestamp"),
+              online=True),
+    Migration(3, "timestamp_index", (HISTORY, LATEST), _create_index("timestamp", "timestamp"), online=True),
+    # 只抓部分 tile 時依 source 清除 data_test
+    Migration(4, "source_index", ("data_test",), _create_index("source", "source"), online=True),
+    # /api/ais/history、/api/chinaboat/all 的經緯度（+ 時間）範圍查詢
+    Migration(5, "history_rtree", (HISTORY,), _history_rtree, online=True),
+    # compaction.py 壓縮後的一段軌跡（ALTER TABLE ADD COLUMN 不需改寫資料，可在啟動時執行）
+    Migration(6, "track_segment_columns", ("ais_data", "boat_test", "chinaboat"), _track_segment_columns),
+    # 靜態資料移到 vessel_static、原表改為 view（整表改寫，持有 WRITE_LOCK；未啟用時不列入待套用）
+    Migration(7, "compact_position_rows", (HISTORY,) if VESSEL_REGISTRY else (), _compact_position_rows,
+              online=True, revert=_expand_position_rows),
+]
+COMPACT_POSITION_ROWS = 7
+
+
+# =========================================
+# 版本紀錄
+# =========================================
+def _ensure_version_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            store VARCHAR(50) NOT NULL,
+            version INTEGER NOT NULL,
+            name VARCHAR(100),
+            applied_at DATETIME,
+            seconds FLOAT,
+            PRIMARY KEY (store, version)
+        )"""))
+
+
+def applied_versions(store):
+    with store.engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {r[0] for r in conn.execute(
+            text("SELECT version FROM schema_migrations WHERE store = :store"), {"store": store.name})}
+
+
+def pending(store, online=None):
+    done = applied_versions(store)
+    return [m for m in MIGRATIONS
+            if m.version not in done and m.applies_to(store) and (online is None or m.online == online)]
+
+
+def apply_migration(store, migration):
+    """單一 migration 在自己的交易內執行（失敗時整個 rollback，下次再試）"""
+    started = time.perf_counter()
+    with WRITE_LOCK, store.engine.begin() as conn:
+        _ensure_version_table(conn)
+        migration.apply(conn, store)
+        conn.execute(text("""
+            INSERT OR REPLACE INTO schema_migrations (store, version, name, applied_at, seconds)
+            VALUES (:store, :version, :name, :applied_at, :seconds)"""), {
+            "store": store.name, "version": migration.version, "name": migration.name,
+            "applied_at": datetime.utcnow(), "seconds": round(time.perf_counter() - started, 3)})
+    print(f"🔧 {store.name}: migration {migration.version} {migration.name} "
+          f"({time.perf_counter() - started:.2f}s)")
+
+
+def upgrade(online=None):
+    """
+    online=None : 全部立即套用
+    online=False: 只套用一般 migration（建索引留給 start_online_upgrade）
+    """
+    for store in all_stores():
+        for migration in pending(store, online):
+            apply_migration(store, migration)
+
+
+def check_layout():
+    """
+    VESSEL_REGISTRY=0 但已有 store 轉成精簡列時拒絕啟動：
+    轉換是整表改寫，關閉設定不會還原，需先 downgrade
+    """
+    if VESSEL_REGISTRY:
+        return
+    compacted = [store.name for store in all_stores() if COMPACT_POSITION_ROWS in applied_versions(store)]
+    if compacted:
+        raise RuntimeError(
+            f"{', '.join(compacted)} 已轉為精簡列（migration {COMPACT_POSITION_ROWS}），與 VESSEL_REGISTRY=0 不符；"
+            f"請設定 VESSEL_REGISTRY=1，或以 VESSEL_REGISTRY=1 執行 "
+            f"python migrations.py downgrade {COMPACT_POSITION_ROWS} 還原後再關閉")
+
+
+def downgrade(version, store_name=None):
+    """撤銷已套用的 migration（需提供 revert）；等背景 migration 結束後逐一 store 在各自的交易內還原"""
+    migration = next((m for m in MIGRATIONS if m.version == version), None)
+    if migration is None or migration.revert is None:
+        raise ValueError(f"migration {version} 無法 downgrade")
+    if _online_thread is not None:
+        _online_thread.join()
+    for store in all_stores():
+        if store_name and store.name != store_name:
+            continue
+        if version not in applied_versions(store):
+            continue
+        started = time.perf_counter()
+        with WRITE_LOCK, store.engine.begin() as conn:
+            migration.revert(conn, store)
+            conn.execute(text("DELETE FROM schema_migrations WHERE store = :store AND version = :version"),
+                         {"store": store.name, "version": version})
+        print(f"🔧 {store.name}: downgrade {migration.version} {migration.name} "
+              f"({time.perf_counter() - started:.2f}s)")
+
+
+def migrate_partition(history, partition):
+    """新建立的分割區（空表）：所有 migration 立即套用"""
+    store = _partition_store(history, partition)
+    for migration in pending(store):
+        apply_migration(store, migration)
+
+
+_online_thread = None
+
+
+def start_online_upgrade(app):
+    """背景套用建索引等 online migration；每個索引各自一個交易，期間 ingest 會等待"""
+    global _online_thread
+    if _online_thread is not None and _online_thread.is_alive():
+        return _online_thread
+
+    def run():
+        with app.app_context():
+            try:
+                upgrade(online=True)
+            except Exception as e:
+                print(f"[migrations] ❌ 背景建索引失敗（下次啟動重試）: {e}")
+
+    _online_thread = threading.Thread(target=run, name="online-migrations", daemon=True)
+    _online_thread.start()
+    return _online_thread
+
+
+# =========================================
+# 診斷
+# =========================================
+def _physical_table(conn, store):
+    """索引所在的表（精簡列的歷史表為 {table}_pos）"""
+    return pos_name(store.table) if is_view(conn, store.table) else store.table
+
+
+def status():
+    rows = []
+    for store in all_stores():
+        done = applied_versions(store)
+        with store.engine.connect() as conn:
+            count = conn.execute(text(f"SELECT COUNT(*) FROM {store.table}")).scalar()
+            indexes = [ix["name"] for ix in inspect(conn).get_indexes(_physical_table(conn, store))]
+        rows.append({
+            "store": store.name,
+            "table": store.table,
+            "rows": count,
+            "applied": sorted(done),
+            "pending": [m.version for m in pending(store)],
+            "indexes": indexes,
+        })
+    return rows
+
+
+def _queries(store, has_rtree=False):
+    """各 API 實際使用的查詢形態"""
+    t = store.table
+    queries = [
+        ("order by timestamp (latest / chinaboat/latest)", f"SELECT * FROM {t} ORDER BY timestamp DESC LIMIT 200"),
+        ("time range", f"SELECT * FROM {t} WHERE timestamp BETWEEN :a AND :b ORDER BY timestamp DESC"),
+    ]
+    if store.kind == HISTORY:
+        queries.append(("ship_id + time range (history)",
+                        f"SELECT * FROM {t} WHERE ship_id = :s AND timestamp BETWEEN :a AND :b "
+                        f"ORDER BY timestamp DESC"))
+        bbox = f"SELECT * FROM {t} WHERE lat BETWEEN :y0 AND :y1 AND lon BETWEEN :x0 AND :x1"
+        candidates = (f" AND id IN (SELECT id FROM {rtree_name(t)} WHERE max_lat >= :y0 AND min_lat <= :y1 "
+                      f"AND max_lon >= :x0 AND min_lon <= :x1")
+        if has_rtree:
+            # 與 spatial_index.bbox_filter 產生的查詢相同
+            queries.append(("bbox (R*Tree)", bbox + candidates + ")"))
+            queries.append(("bbox + time range (R*Tree)",
+                            bbox + " AND timestamp BETWEEN :a AND :b" + candidates
+                            + " AND max_t >= :t0 AND min_t <= :t1)"))
+        else:
+            queries.append(("bbox (lat/lon)", bbox))
+    else:
+        queries.append(("ship_id lookup (upsert)", f"SELECT * FROM {t} WHERE ship_id = :s"))
+    return queries
+
+
+def explain():
+    """回傳 [(store, 查詢說明, 使用索引?, plan)]"""
+    results = []
+    params = {"a": 0, "b": 0, "s": "", "y0": 0, "y1": 0, "x0": 0, "x1": 0, "t0": 0, "t1": 0}
+    for store in all_stores():
+        with store.engine.connect() as conn:
+            has_rtree = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                     {"name": rtree_name(store.table)}).first() is not None
+            for label, sql in _queries(store, has_rtree):
+                plan = [r[-1] for r in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+                # R*Tree 顯示為 SCAN ... VIRTUAL TABLE INDEX，也算有用到索引
+                uses_index = any("USING" in step or "VIRTUAL TABLE" in step for step in plan) and not any(
+                    step.startswith("SCAN") and "USING" not in step and "VIRTUAL TABLE" not in step
+                    for step in plan)
+                results.append((store.name, label, uses_index, plan))
+    return results
+
+
+def reindex(store_name=None):
+    for store in all_stores():
+        if store_name and store.name != store_name:
+            continue
+        started = time.perf_counter()
+        with WRITE_LOCK, store.engine.begin() as conn:
+            table = _physical_table(conn, store)
+            conn.execute(text(f"REINDEX {table}"))
+            conn.execute(text(f"ANALYZE {table}"))
+        print(f"🔧 {store.name}: REINDEX + ANALYZE ({time.perf_counter() - started:.2f}s)")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "status"
+
+    from app import app
+    with app.app_context():
+        if command == "upgrade":
+            upgrade()
+        elif command == "downgrade" and len(argv) > 1:
+            # 背景 migration thread 屬於 models 匯入的 migrations 模組（不是 __main__）
+            import migrations
+            migrations.downgrade(int(argv[1]), argv[2] if len(argv) > 2 else None)
+        elif command == "reindex":
+            reindex(argv[1] if len(argv) > 1 else None)
+        elif command == "explain":
+            for store, label, uses_index, plan in explain():
+                mark = "✅" if uses_index else "⚠️ SCAN"
+                print(f"{mark:8} {store:20} {label}")
+                for step in plan:
+                    print(f"{'':29} {step}")
+        elif command == "status":
+            for s in status():
+                print(f"{s['store']:20} rows={s['rows']:<9} applied={s['applied']} pending={s['pending']}")
+                print(f"{'':20} indexes={s['indexes']}")
+        else:
+            print(__doc__)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
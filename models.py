@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from sqlalchemy.orm import declared_attr, declarative_base
 from config import (
     MAIN_DB_PATH,
     TEST_DB_PATH,
@@ -9,9 +10,12 @@ from config import (
     CCG_DB_PATH,
     CCG_CHECK12_DB_PATH,
     CCG_CHECK24_DB_PATH,
-    CHINA_BOAT_DB_PATH
+    CHINA_BOAT_DB_PATH,
+    UNIFIED_STORE,
+    UNIFIED_DB_PATH,
+    MIGRATIONS_ONLINE
 )
-from database import db, make_engine_and_session  # ✅ 用 database.py 的 db
+from database import db, make_engine_and_session, make_read_session  # ✅ 用 database.py 的 db
 
 # =========================================
 # 共用欄位 Mixin
@@ -41,25 +45,117 @@ class ShipBaseMixin:
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+class LatestShipMixin(ShipBaseMixin):
+    """最新狀態表：每艘船只保留一筆（ship_id 唯一，供 ON CONFLICT upsert 使用）"""
+
+    @declared_attr
+    def __table_args__(cls):
+        return (Index(f"ux_{cls.__tablename__}_ship_id", "ship_id", unique=True),)
+
+
+class HistoryShipMixin(ShipBaseMixin):
+    """可壓縮的歷史表（compaction.py）：壓縮後一筆代表一段軌跡，原始資料這四欄為 NULL"""
+    end_time = Column(DateTime)      # 該段最後一筆原始資料的時間（timestamp 為開始時間）
+    speed_min = Column(Float)
+    speed_max = Column(Float)
+    points = Column(Integer)         # 合併的原始筆數
+
+    def to_dict(self):
+        data = super().to_dict()
+        if self.points is None:
+            for name in ("end_time", "speed_min", "speed_max", "points"):
+                data.pop(name)
+        return data
+
+
 # =========================================
 # 主資料庫（Flask 綁定的 SQLAlchemy）
 # =========================================
-class ShipAIS(db.Model, ShipBaseMixin):   # ✅ 用 database.py 的 db
+class ShipAIS(db.Model, HistoryShipMixin):   # ✅ 用 database.py 的 db
     __tablename__ = "ship_ais"
 
 
+# 差異寫入模式（DELTA_HISTORY）：每筆 ship_ais 代表一段「狀態不變」的期間，
+# 之後沒有明顯變化的抓取輪次只更新 last_seen / repeats，不再新增整筆資料
+class ShipAISRun(db.Model):
+    __tablename__ = "ship_ais_run"
+    row_id = Column(Integer, primary_key=True)     # = ship_ais.id
+    ship_id = Column(String(50), index=True)
+    last_seen = Column(DateTime)
+    repeats = Column(Integer, default=0)           # 之後又出現幾輪（狀態不變）
+
+
+# 每一輪抓取的時間（展開差異資料回完整時間解析度時使用）
+class IngestCycle(db.Model):
+    __tablename__ = "ingest_cycle"
+    timestamp = Column(DateTime, primary_key=True)
+
+
 # =========================================
 # 其他 SQLite 資料庫（非 Flask 綁定）
 # =========================================
+# 單一檔案模式：所有 engine 都指向 UNIFIED_DB_PATH（建表 / migration 用），
+# 所有 *Session 都是 db.session，整輪寫入在同一個交易內
+if UNIFIED_STORE:
+    unified_engine, _, _ = make_engine_and_session(UNIFIED_DB_PATH)
+
+    def _store(db_path):
+        return unified_engine, db.session, declarative_base()
+
+    def _tablename(prefix):
+        return f"{prefix}_ship_ais"
+else:
+    def _store(db_path):
+        return make_engine_and_session(db_path)
+
+    def _tablename(prefix):
+        return "ship_ais"
+
+
 # 各 DB 的 engine + session + Base
-test_engine, TestSession, TestBase = make_engine_and_session(TEST_DB_PATH)
-boat_engine, BoatSession, BoatBase = make_engine_and_session(BOAT_DB_PATH)
-boat_check12_engine, BoatCheck12Session, BoatCheck12Base = make_engine_and_session(BOAT_CHECK12_DB_PATH)
-boat_check24_engine, BoatCheck24Session, BoatCheck24Base = make_engine_and_session(BOAT_CHECK24_DB_PATH)
-ccg_engine, CCGSession, CCGBase = make_engine_and_session(CCG_DB_PATH)
-ccg_check12_engine, CCGCheck12Session, CCGCheck12Base = make_engine_and_session(CCG_CHECK12_DB_PATH)
-ccg_check24_engine, CCGCheck24Session, CCGCheck24Base = make_engine_and_session(CCG_CHECK24_DB_PATH)
-china_boat_engine, ChinaBoatSession, ChinaBoatBase = make_engine_and_session(CHINA_BOAT_DB_PATH)
+test_engine, TestSession, TestBase = _store(TEST_DB_PATH)
+boat_engine, BoatSession, BoatBase = _store(BOAT_DB_PATH)
+boat_check12_engine, BoatCheck12Session, BoatCheck12Base = _store(BOAT_CHECK12_DB_PATH)
+boat_check24_engine, BoatCheck24Session, BoatCheck24Base = _store(BOAT_CHECK24_DB_PATH)
+ccg_engine, CCGSession, CCGBase = _store(CCG_DB_PATH)
+ccg_check12_engine, CCGCheck12Session, CCGCheck12Base = _store(CCG_CHECK12_DB_PATH)
+ccg_check24_engine, CCGCheck24Session, CCGCheck24Base = _store(CCG_CHECK24_DB_PATH)
+china_boat_engine, ChinaBoatSession, ChinaBoatBase = _store(CHINA_BOAT_DB_PATH)
+
+# commit / rollback 時逐一處理（單一檔案模式下只有 db.session 一個）
+ALL_SESSIONS = tuple(dict.fromkeys((
+    db.session, TestSession, BoatSession, BoatCheck12Session, BoatCheck24Session,
+    CCGSession, CCGCheck12Session, CCGCheck24Session, ChinaBoatSession,
+)))
+
+
+# =========================================
+# API 專用唯讀 session（與 ingest 的寫入 engine 分開）
+# =========================================
+if UNIFIED_STORE:
+    _, _unified_read_session = make_read_session(UNIFIED_DB_PATH)
+
+    def _read_session(db_path):
+        return _unified_read_session
+else:
+    def _read_session(db_path):
+        return make_read_session(db_path)[1]
+
+
+MainReadSession = _read_session(MAIN_DB_PATH)
+TestReadSession = _read_session(TEST_DB_PATH)
+BoatReadSession = _read_session(BOAT_DB_PATH)
+BoatCheck12ReadSession = _read_session(BOAT_CHECK12_DB_PATH)
+BoatCheck24ReadSession = _read_session(BOAT_CHECK24_DB_PATH)
+CCGReadSession = _read_session(CCG_DB_PATH)
+CCGCheck12ReadSession = _read_session(CCG_CHECK12_DB_PATH)
+CCGCheck24ReadSession = _read_session(CCG_CHECK24_DB_PATH)
+ChinaBoatReadSession = _read_session(CHINA_BOAT_DB_PATH)
+
+READ_SESSIONS = tuple(dict.fromkeys((
+    MainReadSession, TestReadSession, BoatReadSession, BoatCheck12ReadSession, BoatCheck24ReadSession,
+    CCGReadSession, CCGCheck12ReadSession, CCGCheck24ReadSession, ChinaBoatReadSession,
+)))
 
 
 
@@ -68,36 +164,36 @@ china_boat_engine, ChinaBoatSession, ChinaBoatBase = make_engine_and_session(CHI
 # =========================================
 
 # 最新資料（data_test.db）
-class TestShipAIS(TestBase, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class TestShipAIS(TestBase, LatestShipMixin):
+    __tablename__ = _tablename("data_test")
 
 # 所有海警船歷史資料（boat_test.db）
-class BoatShipAIS(BoatBase, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class BoatShipAIS(BoatBase, HistoryShipMixin):
+    __tablename__ = _tablename("boat_test")
 
 # 進入 12 海里內的海警船歷史資料（boat_check12.db）
 class BoatCheck12AIS(BoatCheck12Base, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+    __tablename__ = _tablename("boat_check12")
 
 # 位於 12–24 海里範圍內的海警船歷史資料（boat_check24.db）
 class BoatCheck24AIS(BoatCheck24Base, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+    __tablename__ = _tablename("boat_check24")
 
 # 每艘海警船的最新狀態（CCG.db）
-class CCGShipAIS(CCGBase, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class CCGShipAIS(CCGBase, LatestShipMixin):
+    __tablename__ = _tablename("ccg")
 
 # 目前在 12 海里內的海警船最新狀態（ccg_check12.db）
-class CCGCheck12ShipAIS(CCGCheck12Base, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class CCGCheck12ShipAIS(CCGCheck12Base, LatestShipMixin):
+    __tablename__ = _tablename("ccg_check12")
 
 # 目前在 12–24 海里範圍內的海警船最新狀態（ccg_check24.db）
-class CCGCheck24ShipAIS(CCGCheck24Base, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class CCGCheck24ShipAIS(CCGCheck24Base, LatestShipMixin):
+    __tablename__ = _tablename("ccg_check24")
 
 # 所有中國籍船舶歷史資料（chinaboat.db, flag == "CN"）
-class ChinaBoatAIS(ChinaBoatBase, ShipBaseMixin):
-    __tablename__ = "ship_ais"
+class ChinaBoatAIS(ChinaBoatBase, HistoryShipMixin):
+    __tablename__ = _tablename("chinaboat")
 
 
 
@@ -120,5 +216,14 @@ def init_models(app):
     CCGCheck24Base.metadata.create_all(ccg_check24_engine)
     ChinaBoatBase.metadata.create_all(china_boat_engine)
 
+    # 索引等 schema 變更交給 migrations（大表建索引在背景執行）
+    from migrations import check_layout, upgrade, start_online_upgrade
+    with app.app_context():
+        check_layout()
+        if MIGRATIONS_ONLINE:
+            upgrade(online=False)
+            start_online_upgrade(app)
+        else:
+            upgrade()
 
     print("✅ 所有資料表初始化完成！")
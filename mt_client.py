@@ -0,0 +1,178 @@
+import os
+import json
+import threading
+from urllib.parse import urlsplit
+
+import cloudscraper
+from cloudscraper import CipherSuiteAdapter
+from requests.adapters import HTTPAdapter
+
+from config import (
+    MT_ORIGIN, MT_BASE_URL, MT_SESSION_FILE,
+    MT_POOL_SIZE, MT_PER_HOST_LIMIT, FETCH_TIMEOUT
+)
+from utils import log_failed_record
+
+
+# =========================================
+# 長期存活的 MarineTraffic 抓取 client
+# =========================================
+class MarineTrafficClient:
+    """
+    包一個長期共用的 cloudscraper session：
+    - keep-alive 連線池（每個 host 的連線數有上限）
+    - Cloudflare cookie / User-Agent 寫入 MT_SESSION_FILE，重啟後沿用
+    - base_url 可把 MarineTraffic 網址導向本機替身伺服器（測試 / benchmark 用）
+
+    只要有 get(url, timeout=...) 並回傳 requests.Response 類物件，
+    任何物件都可以取代它注入 fetch_data。
+    """
+
+    def __init__(self, base_url=MT_BASE_URL, session_file=MT_SESSION_FILE,
+                 pool_size=MT_POOL_SIZE, per_host_limit=MT_PER_HOST_LIMIT,
+                 timeout=FETCH_TIMEOUT):
+        self.base_url = (base_url or "").rstrip("/")
+        self.session_file = session_file
+        self.pool_size = pool_size
+        self.per_host_limit = max(1, per_host_limit)
+        self.timeout = timeout
+
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()   # 多個 fetch worker 同時存檔時依序寫入同一個暫存檔
+        self._cookie_fingerprint = None
+
+        self.scraper = self._create_scraper()
+
+    # -----------------------------------------
+    # 建立 scraper + 連線池
+    # -----------------------------------------
+    def _create_scraper(self):
+        saved = self._load_session()
+        if saved.get("cipher_suite"):
+            scraper = cloudscraper.create_scraper(cipherSuite=saved["cipher_suite"])
+        else:
+            scraper = cloudscraper.create_scraper()
+
+        # Cloudflare 的 cf_clearance 綁定 User-Agent，必須一起還原
+        if saved.get("headers"):
+            scraper.headers.update(saved["headers"])
+        for c in saved.get("cookies", []):
+            scraper.cookies.set(c["name"], c["value"], domain=c.get("domain", ""),
+                                path=c.get("path", "/"), expires=c.get("expires"),
+                                secure=c.get("secure", False))
+
+        # 以相同的 TLS 設定重新掛載 https adapter，只放大連線池
+        scraper.mount("https://", CipherSuiteAdapter(
+            cipherSuite=scraper.cipherSuite,
+            ecdhCurve=scraper.ecdhCurve,
+            server_hostname=scraper.server_hostname,
+            source_address=scraper.source_address,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.per_host_limit,
+        ))
+        scraper.mount("http://", HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.per_host_limit,
+        ))
+
+        self._cookie_fingerprint = self._fingerprint(scraper)
+        if saved:
+            print(f"[mt_client] ♻️ 沿用已儲存的 session（{len(saved.get('cookies', []))} 個 cookie）")
+        return scraper
+
+    # -----------------------------------------
+    # session 持久化
+    # -----------------------------------------
+    def _load_session(self):
+        if not self.session_file or not os.path.exists(self.session_file):
+            return {}
+        try:
+            with open(self.session_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[mt_client] ⚠️ 讀取 session 失敗，改用新 session: {e}")
+            return {}
+
+    @staticmethod
+    def _fingerprint(scraper):
+        return tuple(sorted((c.domain, c.name, c.value) for c in scraper.cookies))
+
+    def save_session(self):
+        if not self.session_file:
+            return
+        with self._save_lock:
+            self._write_session()
+
+    def _write_session(self):
+        state = {
+            "headers": dict(self.scraper.headers),
+            "cipher_suite": self.scraper.cipherSuite,
+            "cookies": [
+                {
+                    "name": c.name,
+                    "value": c.value,
+                    "domain": c.domain,
+                    "path": c.path,
+                    "expires": c.expires,
+                    "secure": c.secure,
+                }
+                for c in self.scraper.cookies
+            ],
+        }
+        tmp_path = self.session_file + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.session_file)
+        except Exception as e:
+            log_failed_record({"file": self.session_file}, f"Save MT session failed: {e}")
+
+    def _save_if_changed(self):
+        fingerprint = self._fingerprint(self.scraper)
+        with self._lock:
+            if fingerprint == self._cookie_fingerprint:
+                return
+            self._cookie_fingerprint = fingerprint
+        self.save_session()
+
+    # -----------------------------------------
+    # 發送請求
+    # -----------------------------------------
+    def resolve(self, url):
+        """把 MarineTraffic 網址改寫到 base_url（未設定則原樣回傳）"""
+        if self.base_url and self.base_url != MT_ORIGIN and url.startswith(MT_ORIGIN):
+            return self.base_url + url[len(MT_ORIGIN):]
+        return url
+
+    def _slot(self, host):
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def get(self, url, timeout=None):
+        target = self.resolve(url)
+        with self._slot(urlsplit(target).netloc):
+            response = self.scraper.get(target, timeout=timeout or self.timeout)
+        self._save_if_changed()
+        return response
+
+    def close(self):
+        self.save_session()
+        self.scraper.close()
+
+
+# =========================================
+# 全域共用 client（第一次使用時才建立）
+# =========================================
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MarineTrafficClient()
+        return _client
@@ -0,0 +1,301 @@
+"""
+本機 MarineTraffic 替身伺服器
+
+模擬 /getData/get_data_json_4/z:/X:/Y:/station: 端點，回傳合成船隊或錄製
+資料，並可注入延遲、400 / 429 / 5xx 與逾時，用來量測 fetch_data 的效能。
+
+    python mt_stub_server.py --port 8765 --fleet 200000 --latency-ms 150
+    MT_BASE_URL=http://127.0.0.1:8765 python app.py
+"""
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TILE_PATH = re.compile(r"^/getData/get_data_json_4/z:(\d+)/X:(\d+)/Y:(\d+)/station:(\d+)/?$")
+
+# 合成船隊分布範圍（台灣海峽周邊）
+REGION = (116.0, 20.0, 124.0, 28.0)   # min_lon, min_lat, max_lon, max_lat
+
+
+# =========================================
+# MarineTraffic tile → 經緯度範圍
+# （MarineTraffic 的 z 比 slippy map 多 1：一邊 2^(z-1) 格）
+# =========================================
+def tile_bounds(z, x, y):
+    n = 2 ** (z - 1)
+
+    def lat_of(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    return min_lon, lat_of(y + 1), max_lon, lat_of(y)
+
+
+# =========================================
+# 合成船隊：固定亂數種子，船隻隨時間等速移動
+# =========================================
+class SyntheticFleet:
+    def __init__(self, size, seed=0, ccg_ratio=0.002, cn_ratio=0.3, tick=1.0):
+        rnd = random.Random(seed)
+        min_lon, min_lat, max_lon, max_lat = REGION
+        self.tick = tick
+        self.started = time.time()
+        self.ships = []
+        for i in range(size):
+            kind = rnd.random()
+            ccg = kind < ccg_ratio
+            cn = ccg or kind < ccg_ratio + cn_ratio
+            self.ships.append({
+                "SHIP_ID": str(100000 + i),
+                "SHIPNAME": f"CHINACOASTGUARD{i}" if ccg else f"SYNTH {i}",
+                "FLAG": "CN" if cn else rnd.choice(["TW", "PA", "LR", "HK", "JP"]),
+                "lon0": rnd.uniform(min_lon, max_lon),
+                "lat0": rnd.uniform(min_lat, max_lat),
+                "speed": rnd.choice([0.0, 0.0, rnd.uniform(0.5, 22.0)]),  # 節
+                "course": rnd.uniform(0, 360),
+                "DESTINATION": rnd.choice(["KAOHSIUNG", "KEELUNG", "XIAMEN", "FUZHOU", ""]),
+                "SHIPTYPE": str(rnd.choice([3, 6, 7, 8])),
+                "LENGTH": str(rnd.randint(20, 300)),
+                "WIDTH": str(rnd.randint(5, 50)),
+            })
+        self._positions = None
+        self._positions_tick = None
+        self._lock = threading.Lock()
+
+    def positions(self):
+        """依經過時間推算目前位置；每 tick 秒重算一次"""
+        now_tick = int((time.time() - self.started) / self.tick)
+        with self._lock:
+            if self._positions_tick != now_tick:
+                hours = now_tick * self.tick / 3600.0
+                min_lon, min_lat, max_lon, max_lat = REGION
+                positions = []
+                for s in self.ships:
+                    dist_deg = s["speed"] * hours / 60.0
+                    rad = math.radians(s["course"])
+                    lon = min_lon + (s["lon0"] + dist_deg * math.sin(rad) - min_lon) % (max_lon - min_lon)
+                    lat = min_lat + (s["lat0"] + dist_deg * math.cos(rad) - min_lat) % (max_lat - min_lat)
+                    positions.append((lon, lat))
+                self._positions = positions
+                self._positions_tick = now_tick
+            return self._positions
+
+    def rows_in(self, bounds, limit=None):
+        min_lon, min_lat, max_lon, max_lat = bounds
+        rows = []
+        for s, (lon, lat) in zip(self.ships, self.positions()):
+            if min_lon <= lon < max_lon and min_lat <= lat < max_lat:
+                rows.append({
+                    "LAT": f"{lat:.5f}",
+                    "LON": f"{lon:.5f}",
+                    "SPEED": str(int(s["speed"] * 10)),
+                    "COURSE": str(int(s["course"])),
+                    "HEADING": str(int(s["course"])),
+                    "ROT": "0",
+                    "SHIPNAME": s["SHIPNAME"],
+                    "SHIPTYPE": s["SHIPTYPE"],
+                    "SHIP_ID": s["SHIP_ID"],
+                    "FLAG": s["FLAG"],
+                    "ELAPSED": "1",
+                    "DESTINATION": s["DESTINATION"],
+                    "LENGTH": s["LENGTH"],
+                    "WIDTH": s["WIDTH"],
+                    "DWT": None,
+                    "GT_SHIPTYPE": None,
+                })
+                if limit and len(rows) >= limit:
+                    break
+        return rows
+
+
+# =========================================
+# 錄製資料來源：依 tile 路徑輪流回放 tile_archive 的內容
+# =========================================
+class ArchiveRows:
+    def __init__(self, paths):
+        from tile_archive import iter_archive
+        self.by_path = {}
+        for entry in iter_archive(paths):
+            path = "/" + entry["url"].split("://", 1)[-1].split("/", 1)[-1]
+            self.by_path.setdefault(path, []).append(entry["data"].get("data", {}).get("rows", []))
+        self._cursor = {}
+        self._lock = threading.Lock()
+
+    def rows_for(self, path):
+        snapshots = self.by_path.get(path)
+        if not snapshots:
+            return []
+        with self._lock:
+            i = self._cursor.get(path, 0)
+            self._cursor[path] = i + 1
+        return snapshots[i % len(snapshots)]
+
+
+# =========================================
+# 錯誤 / 延遲注入設定
+# =========================================
+class FaultProfile:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_400=0.0, error_429=0.0,
+                 error_5xx=0.0, timeout_rate=0.0, timeout_s=30.0, dead_tiles=(), seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_400 = error_400
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.timeout_rate = timeout_rate
+        self.timeout_s = timeout_s
+        self.dead_tiles = set(dead_tiles)   # 例如 "10/426/222"，永遠回 400
+        self.rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def pick(self, tile):
+        """回傳 (延遲秒數, 狀態碼或 None, 是否逾時)"""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self.rnd.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+            if tile in self.dead_tiles:
+                return delay, 400, False
+            r = self.rnd.random()
+        if r < self.timeout_rate:
+            return self.timeout_s, None, True
+        r -= self.timeout_rate
+        for status, rate in ((400, self.error_400), (429, self.error_429),
+                             (self.rnd.choice([500, 502, 503]), self.error_5xx)):
+            if r < rate:
+                return delay, status, False
+            r -= rate
+        return delay, None, False
+
+
+# =========================================
+# HTTP server
+# =========================================
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, source, faults=None, rows_per_tile=None):
+        super().__init__(address, _Handler)
+        self.source = source
+        self.faults = faults or FaultProfile()
+        self.rows_per_tile = rows_per_tile
+        self.counters = {"requests": 0, "rows": 0, "errors": 0, "timeouts": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **kwargs):
+        with self._lock:
+            for k, v in kwargs.items():
+                self.counters[k] += v
+
+    def rows_for(self, path, z, x, y):
+        if isinstance(self.source, ArchiveRows):
+            return self.source.rows_for(path)
+        return self.source.rows_in(tile_bounds(z, x, y), self.rows_per_tile)
+
+    def start_background(self):
+        t = threading.Thread(target=self.serve_forever, name="mt-stub", daemon=True)
+        t.start()
+        return t
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive，與真實環境相同
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        m = TILE_PATH.match(self.path)
+        if not m:
+            self._send(404, '{"error": "not found"}')
+            return
+
+        z, x, y = (int(v) for v in m.groups()[:3])
+        delay, status, timed_out = server.faults.pick(f"{z}/{x}/{y}")
+        server.count(requests=1)
+        time.sleep(delay)
+
+        if timed_out:
+            server.count(timeouts=1)
+            self.close_connection = True
+            return
+        if status:
+            server.count(errors=1)
+            self._send(status, json.dumps({"error": status}))
+            return
+
+        rows = server.rows_for(self.path, z, x, y)
+        server.count(rows=len(rows))
+        self._send(200, json.dumps({"type": 1, "data": {"rows": rows, "areaShips": len(rows)}},
+                                   separators=(",", ":")))
+
+
+def add_fault_arguments(ap):
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-400", type=float, default=0.0, help="回 400 的比例 (0~1)")
+    ap.add_argument("--error-429", type=float, default=0.0)
+    ap.add_argument("--error-5xx", type=float, default=0.0)
+    ap.add_argument("--timeout-rate", type=float, default=0.0, help="不回應直到逾時的比例")
+    ap.add_argument("--timeout-s", type=float, default=30.0)
+    ap.add_argument("--dead-tile", action="append", default=[], help="永遠回 400 的 tile，如 10/426/222")
+
+
+def faults_from_args(args):
+    return FaultProfile(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_400=args.error_400, error_429=args.error_429, error_5xx=args.error_5xx,
+        timeout_rate=args.timeout_rate, timeout_s=args.timeout_s,
+        dead_tiles=args.dead_tile, seed=args.seed,
+    )
+
+
+def build_source(args):
+    if args.archive:
+        return ArchiveRows(args.archive)
+    return SyntheticFleet(args.fleet, seed=args.seed)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="本機 MarineTraffic 替身伺服器")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--fleet", type=int, default=100000, help="合成船隊大小")
+    ap.add_argument("--rows-per-tile", type=int, default=None, help="每個 tile 最多回傳幾筆")
+    ap.add_argument("--archive", nargs="*", help="改用 tile_archive 錄製檔回放")
+    ap.add_argument("--seed", type=int, default=0)
+    add_fault_arguments(ap)
+    args = ap.parse_args(argv)
+
+    server = StubServer((args.host, args.port), build_source(args),
+                        faults_from_args(args), args.rows_per_tile)
+    print(f"[mt_stub] 🚢 listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"[mt_stub] {server.counters}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+ship_ais / chinaboat 歷史表依時間分割（HISTORY_PARTITION=month / day）
+
+每一期一個 SQLite 檔：db/partitions/{name}_{key}.db（key = 2025-01 或 2025-01-01），
+檔內表名與原本相同，model 與查詢寫法不變，只是換一個 session：
+  - 寫入：write_session(timestamp) 依本輪時間取得該期的 session，新的一期第一次寫入時建立（rollover）
+  - 查詢：read_sessions(start, end) 只回傳與時間區間重疊的分割區（由新到舊）
+  - 保留期限：整期都過期的分割區整個檔案移到 archive 或刪除，不需要 DELETE / VACUUM
+啟用分割前寫入的資料留在原本的表（legacy），查詢時依其時間範圍一併納入，不受保留期限影響。
+
+    python partitions.py status
+    python partitions.py retention     # 立即套用保留期限
+"""
+import os
+import re
+import sys
+import glob
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from config import (
+    UNIFIED_STORE, HISTORY_PARTITION, PARTITION_DIR,
+    HISTORY_RETENTION_DAYS, HISTORY_RETENTION_ACTION, PARTITION_ARCHIVE_DIR
+)
+from database import make_engine_and_session, make_read_session
+from models import (
+    db, ShipAIS, ShipAISRun, IngestCycle, ChinaBoatAIS,
+    ChinaBoatSession, MainReadSession, ChinaBoatReadSession
+)
+
+_KEY = re.compile(r"^\d{4}-\d{2}(-\d{2})?$")
+
+
+def partition_key(timestamp, granularity=HISTORY_PARTITION):
+    return timestamp.strftime("%Y-%m-%d" if granularity == "day" else "%Y-%m")
+
+
+def partition_range(key):
+    """key → [start, end)；依 key 長度判斷，改過 HISTORY_PARTITION 後舊的分割區仍可查詢"""
+    if len(key) == 10:
+        start = datetime.strptime(key, "%Y-%m-%d")
+        return start, start + timedelta(days=1)
+    start = datetime.strptime(key, "%Y-%m")
+    return start, datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+# =========================================
+# 單一分割區（engine / session 用到才建立）
+# =========================================
+class Partition:
+    def __init__(self, name, key):
+        self.key = key
+        self.start, self.end = partition_range(key)
+        self.path = os.path.join(PARTITION_DIR, f"{name}_{key}.db")
+        self._engine = self._session = None
+        self._read_engine = self._read_session = None
+
+    def _open(self):
+        if self._engine is None:
+            self._engine, self._session, _ = make_engine_and_session(self.path)
+
+    @property
+    def engine(self):
+        self._open()
+        return self._engine
+
+    @property
+    def session(self):
+        self._open()
+        return self._session
+
+    @property
+    def read_session(self):
+        if self._read_session is None:
+            self._read_engine, self._read_session = make_read_session(self.path)
+        return self._read_session
+
+    def overlaps(self, start=None, end=None):
+        return (start is None or self.end > start) and (end is None or self.start <= end)
+
+    def close(self):
+        for session in (self._session, self._read_session):
+            if session is not None:
+                session.remove()
+        for engine in (self._engine, self._read_engine):
+            if engine is not None:
+                engine.dispose()
+        self._engine = self._session = self._read_engine = self._read_session = None
+
+
+# =========================================
+# 一個歷史表的所有分割區 + 分割前的 legacy 表
+# =========================================
+class PartitionedHistory:
+    def __init__(self, name, Model, tables, legacy_session, legacy_read_session, until_columns=()):
+        """
+        tables       : 每個分割區要建立的表（ship_ais 連同差異寫入的 ship_ais_run / ingest_cycle）
+        until_columns: legacy 表資料延續到的時間（差異寫入的 last_seen 會晚於 timestamp）
+        """
+        self.name = name
+        self.Model = Model
+        self.tables = tables
+        self.legacy_session = legacy_session
+        self.legacy_read_session = legacy_read_session
+        self.until_columns = until_columns
+        self.enabled = HISTORY_PARTITION in ("day", "month") and not UNIFIED_STORE
+        self._partitions = None
+        self._legacy_bounds = None
+        self._lock = threading.RLock()
+
+    def partitions(self):
+        """現有分割區（key 由舊到新）；第一次呼叫時掃描 PARTITION_DIR"""
+        with self._lock:
+            if self._partitions is None:
+                self._partitions = {}
+                for path in glob.glob(os.path.join(PARTITION_DIR, f"{self.name}_*.db")):
+                    key = os.path.basename(path)[len(self.name) + 1:-3]
+                    if _KEY.match(key):
+                        self._partitions[key] = Partition(self.name, key)
+            return [self._partitions[key] for key in sorted(self._partitions)]
+
+    # -----------------------------------------
+    # 寫入
+    # -----------------------------------------
+    def write_session(self, timestamp):
+        if not self.enabled:
+            return self.legacy_session
+        key = partition_key(timestamp)
+        with self._lock:
+            self.partitions()
+            partition = self._partitions.get(key) or self._create(key, timestamp)
+        return partition.session
+
+    def _create(self, key, timestamp):
+        from migrations import migrate_partition
+
+        os.makedirs(PARTITION_DIR, exist_ok=True)
+        partition = Partition(self.name, key)
+        self.Model.metadata.create_all(partition.engine, tables=self.tables)
+        migrate_partition(self, partition)
+        self._partitions[key] = partition
+        print(f"🗂️ {self.name}: 建立分割區 {key}")
+        self.apply_retention(timestamp)
+        return partition
+
+    def open_sessions(self):
+        """本 process 寫入過的分割區 session（commit_all 一併提交）"""
+        with self._lock:
+            return [p._session for p in (self._partitions or {}).values() if p._session is not None]
+
+    # -----------------------------------------
+    # 查詢：依時間區間挑選分割區
+    # -----------------------------------------
+    def legacy_bounds(self):
+        """legacy 表的 (最早, 最晚) 時間；啟用分割後不再寫入，算一次即可"""
+        if self.enabled and self._legacy_bounds is not None:
+            return self._legacy_bounds
+        session = self.legacy_read_session
+        lo, hi = session.query(func.min(self.Model.timestamp), func.max(self.Model.timestamp)).one()
+        for column in self.until_columns:
+            until = session.query(func.max(column)).scalar()
+            if until is not None and (hi is None or until > hi):
+                hi = until
+        self._legacy_bounds = (lo, hi)
+        return lo, hi
+
+    def read_sessions(self, start=None, end=None):
+        """與 [start, end] 重疊的唯讀 session，由新到舊（未指定時間 = 全部）"""
+        partitions = [] if UNIFIED_STORE else self.partitions()
+        if not partitions:
+            return [self.legacy_read_session]
+
+        candidates = [(p.end, p.read_session) for p in partitions if p.overlaps(start, end)]
+        lo, hi = self.legacy_bounds()
+        if lo is not None and (start is None or hi >= start) and (end is None or lo <= end):
+            candidates.append((hi, self.legacy_read_session))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return [session for _, session in candidates]
+
+    def open_read_sessions(self):
+        with self._lock:
+            return [p._read_session for p in (self._partitions or {}).values() if p._read_session is not None]
+
+    # -----------------------------------------
+    # 保留期限：整個分割區處理
+    # -----------------------------------------
+    def apply_retention(self, now=None):
+        """
+        now: 以哪個時間點計算期限（ingest 時為本輪時間，重播舊資料不會清掉較新的分割區）
+        回傳被處理的 key
+        """
+        if HISTORY_RETENTION_DAYS <= 0:
+            return []
+        cutoff = (now or datetime.utcnow()) - timedelta(days=HISTORY_RETENTION_DAYS)
+        removed = []
+        with self._lock:
+            for partition in self.partitions():
+                if partition.end > cutoff:
+                    continue
+                partition.close()
+                try:
+                    if HISTORY_RETENTION_ACTION == "drop":
+                        for path in glob.glob(partition.path + "*"):
+                            os.remove(path)
+                    else:
+                        os.makedirs(PARTITION_ARCHIVE_DIR, exist_ok=True)
+                        for path in glob.glob(partition.path + "*"):
+                            shutil.move(path, os.path.join(PARTITION_ARCHIVE_DIR, os.path.basename(path)))
+                except OSError as e:
+                    print(f"[partitions] ⚠️ {self.name} {partition.key} 處理失敗（下次再試）: {e}")
+                    continue
+                del self._partitions[partition.key]
+                removed.append(partition.key)
+                print(f"🗑️ {self.name}: 分割區 {partition.key} 超過保留期限，已 {HISTORY_RETENTION_ACTION}")
+        return removed
+
+    def status(self):
+        rows = []
+        for partition in self.partitions():
+            session = partition.read_session
+            try:
+                count = session.query(func.count(self.Model.id)).scalar()
+            finally:
+                session.remove()
+            rows.append({"key": partition.key, "path": partition.path, "rows": count,
+                         "size_mb": round(os.path.getsize(partition.path) / 1024 / 1024, 1)})
+        return rows
+
+
+ship_ais_history = PartitionedHistory(
+    "ais_data", ShipAIS, [ShipAIS.__table__, ShipAISRun.__table__, IngestCycle.__table__],
+    db.session, MainReadSession, until_columns=(ShipAISRun.last_seen,))
+china_boat_history = PartitionedHistory(
+    "chinaboat", ChinaBoatAIS, [ChinaBoatAIS.__table__], ChinaBoatSession, ChinaBoatReadSession)
+
+HISTORIES = (ship_ais_history, china_boat_history)
+
+
+def partition_sessions():
+    return tuple(session for history in HISTORIES for session in history.open_sessions())
+
+
+def partition_read_sessions():
+    return tuple(session for history in HISTORIES for session in history.open_read_sessions())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "status"
+
+    from app import app
+    with app.app_context():
+        if command == "retention":
+            for history in HISTORIES:
+                history.apply_retention()
+        elif command == "status":
+            print(f"HISTORY_PARTITION={HISTORY_PARTITION}  retention={HISTORY_RETENTION_DAYS:g} 天 "
+                  f"({HISTORY_RETENTION_ACTION})")
+            for history in HISTORIES:
+                lo, hi = history.legacy_bounds()
+                print(f"{history.name:10} legacy {lo} ~ {hi}")
+                for p in history.status():
+                    print(f"{'':10} {p['key']:10} rows={p['rows']:<9} {p['size_mb']} MB")
+        else:
+            print(__doc__)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
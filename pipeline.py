@@ -0,0 +1,200 @@
+import queue
+import threading
+import time
+
+from config import PIPELINE_QUEUE_SIZE
+from utils import log_failed_record
+
+# 串流結束標記
+_END = object()
+
+# 最近一輪的各階段統計（給 /api/ingest/stats 使用）
+LAST_CYCLE_STATS = {}
+
+
+def _count(item):
+    """tuple 視為 1 筆（例如一個 tile 的下載結果）；list / 批次以長度計算"""
+    if isinstance(item, tuple) or not hasattr(item, "__len__"):
+        return 1
+    return len(item)
+
+
+# =========================================
+# 單一階段的吞吐量 / 佇列深度統計
+# =========================================
+class StageStats:
+    def __init__(self, name, inbox=None):
+        self.name = name
+        self.inbox = inbox
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, n_in, n_out, elapsed):
+        with self._lock:
+            self.items_in += n_in
+            self.items_out += n_out
+            self.busy_seconds += elapsed
+
+    def observe_depth(self):
+        if self.inbox is None:
+            return
+        depth = self.inbox.qsize()
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "items_in": self.items_in,
+                "items_out": self.items_out,
+                "busy_seconds": round(self.busy_seconds, 4),
+                "items_per_sec": round(self.items_in / self.busy_seconds, 1) if self.busy_seconds else None,
+                "queue_depth": self.inbox.qsize() if self.inbox is not None else 0,
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+
+# =========================================
+# 一個階段：N 個 worker thread 從 inbox 取資料，結果送往下一階段
+# =========================================
+class Stage:
+    """
+    func(item) 回傳要送往下一階段的資料（None 表示丟棄）。
+    傳 list / ShipBatch 時，統計以長度計算（例如一個 tile 的所有 row）。
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.outbox = None
+        self.stats = StageStats(name, self.inbox)
+        self._threads = []
+        self._remaining = self.workers
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.inbox.put(item)
+        self.stats.observe_depth()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"ingest-{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+        # 清掉留在 inbox 的結束標記，讓 queue_depth 回到 0
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _END:
+                # 讓同階段其他 worker 也收到結束標記；最後一個 worker 通知下一階段
+                self.inbox.put(_END)
+                with self._lock:
+                    self._remaining -= 1
+                    last = self._remaining == 0
+                if last:
+                    self.outbox.put(_END)
+                return
+
+            t0 = time.perf_counter()
+            try:
+                out = self.func(item)
+            except Exception as e:
+                log_failed_record({"stage": self.name}, f"Pipeline {self.name} error: {e}")
+                out = None
+            self.stats.record(_count(item), 0 if out is None else _count(out),
+                              time.perf_counter() - t0)
+            if out is not None:
+                self.outbox.put(out)
+
+
+# =========================================
+# 多階段 ingest pipeline
+# =========================================
+class IngestPipeline:
+    """
+    fetch → parse → classify → (呼叫端) persist
+
+    各階段之間以有上限的 Queue 串接：下載可以與 CPU（解析 / 幾何判斷）重疊，
+    下游來不及處理時上游會被 block（backpressure）。最後的持久化階段在呼叫端
+    thread 執行（run() 是 generator），因此 DB session / Flask app context
+    與原本相同；批次寫入在整輪資料到齊後一次完成。
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.sink = queue.Queue(maxsize=queue_size)
+        self.sink_stats = StageStats("persist", self.sink)
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.outbox = downstream
+        stages[-1].outbox = _SinkAdapter(self.sink, self.sink_stats)
+
+    def run(self, items):
+        for stage in self.stages:
+            stage.start()
+
+        def feed():
+            for item in items:
+                self.stages[0].put(item)
+            self.stages[0].put(_END)
+
+        feeder = threading.Thread(target=feed, name="ingest-feed", daemon=True)
+        feeder.start()
+
+        finished = False
+        try:
+            while True:
+                item = self.sink.get()
+                if item is _END:
+                    finished = True
+                    break
+                t0 = time.perf_counter()
+                yield item
+                self.sink_stats.record(_count(item), _count(item), time.perf_counter() - t0)
+        finally:
+            # 呼叫端提早中斷時把剩下的資料排空，避免上游 thread 卡在滿的 Queue
+            while not finished:
+                finished = self.sink.get() is _END
+
+        feeder.join()
+        for stage in self.stages:
+            stage.join()
+
+    def record_persist_time(self, elapsed):
+        """持久化批次（整輪一次）不在 run() 迴圈內，另外計入 persist 階段"""
+        self.sink_stats.record(0, 0, elapsed)
+
+    def stats(self):
+        result = {stage.name: stage.stats.as_dict() for stage in self.stages}
+        result[self.sink_stats.name] = self.sink_stats.as_dict()
+        return result
+
+    def publish_stats(self, started_at, wall_seconds, **extra):
+        LAST_CYCLE_STATS.clear()
+        LAST_CYCLE_STATS.update({
+            "started_at": started_at.isoformat(),
+            "wall_seconds": round(wall_seconds, 3),
+            "stages": self.stats(),
+        })
+        LAST_CYCLE_STATS.update(extra)
+
+
+class _SinkAdapter:
+    def __init__(self, sink, stats):
+        self.sink = sink
+        self.stats = stats
+
+    def put(self, item):
+        self.sink.put(item)
+        self.stats.observe_depth()
@@ -1,19 +1,40 @@
 from flask import Blueprint, jsonify, request, abort
 from dateutil import parser
 from datetime import datetime
+from sqlalchemy import or_
+import numpy as np
 
+from config import DISTANCE_THRESHOLDS_NM
 from models import (
-    ShipAIS,
+    ShipAIS, ShipAISRun,
     BoatCheck12AIS, BoatCheck24AIS,
     CCGShipAIS, CCGCheck12ShipAIS, CCGCheck24ShipAIS,
-    BoatCheck12Session, BoatCheck24Session,
-    CCGSession, CCGCheck12Session, CCGCheck24Session,
-    ChinaBoatSession, ChinaBoatAIS
+    BoatCheck12ReadSession, BoatCheck24ReadSession,
+    CCGReadSession, CCGCheck12ReadSession, CCGCheck24ReadSession,
+    ChinaBoatAIS, READ_SESSIONS
 )
+from pipeline import LAST_CYCLE_STATS
+from scheduler import tile_scheduler
+from tile_health import get_tile_health
+from delta_history import expand_history
+from spatial_index import bbox_filter
+from vessel_registry import vessel_history
+from fleet_snapshot import get_fleet_state
+from geo_distance import get_distance_engine
+from compaction import time_window, MAX_SEGMENT
+from partitions import ship_ais_history, china_boat_history, partition_read_sessions
 
 # 建立 Blueprint
 api_blueprint = Blueprint("api", __name__)
 
+
+# 查詢一律走唯讀連線池（不與 ingest 寫入搶同一條連線），request 結束時歸還
+@api_blueprint.teardown_request
+def release_read_sessions(exc=None):
+    for session in READ_SESSIONS + partition_read_sessions():
+        session.remove()
+
+
 # =========================================
 # API: 最新 AIS 資料
 # =========================================
@@ -21,10 +42,11 @@ api_blueprint = Blueprint("api", __name__)
 def get_latest_data():
     try:
         results = {}
-        latest = ShipAIS.query.order_by(ShipAIS.timestamp.desc()).all()
-        for row in latest:
-            if row.source not in results:
-                results[row.source] = row.to_dict()
+        # 分割區由新到舊，每個 source 取第一次出現的（最新）那筆
+        for session in ship_ais_history.read_sessions():
+            for row in session.query(ShipAIS).order_by(ShipAIS.timestamp.desc()):
+                if row.source not in results:
+                    results[row.source] = row.to_dict()
         return jsonify({"timestamp": datetime.utcnow().isoformat(), "results": results})
     except Exception as e:
         abort(500, description=str(e))
@@ -35,21 +57,12 @@ def get_latest_data():
 @api_blueprint.route("/ais/history", methods=["GET"])
 def get_ship_history():
     try:
-        query = ShipAIS.query
-
-        # 篩選船名
-        if request.args.get("shipname"):
-            query = query.filter(ShipAIS.shipname.ilike(f"%{request.args['shipname']}%"))
-
-        # 篩選船 ID
-        if request.args.get("ship_id"):
-            query = query.filter_by(ship_id=request.args["ship_id"])
-
-        # 篩選時間區間
+        # expand=1：差異寫入模式下，把沒變化的輪次補回來（完整時間解析度）
+        expand = request.args.get("expand") in ("1", "true")
+        start = end = None
         if request.args.get("start") and request.args.get("end"):
             start = parser.parse(request.args.get("start"))
             end = parser.parse(request.args.get("end"))
-            query = query.filter(ShipAIS.timestamp.between(start, end))
 
         # 🟡【加在這裡】加入經緯度篩選條件
         min_lat = request.args.get("min_lat")
@@ -57,20 +70,61 @@ def get_ship_history():
         min_lon = request.args.get("min_lon")
         max_lon = request.args.get("max_lon")
 
-        # 經緯度範圍檢查 + 篩選
+        # 經緯度範圍檢查
+        lat_range = lon_range = None
         if min_lat and max_lat and float(min_lat) < float(max_lat):
-            query = query.filter(
-                ShipAIS.lat >= float(min_lat),
-                ShipAIS.lat <= float(max_lat)
-            )
+            lat_range = (float(min_lat), float(max_lat))
         if min_lon and max_lon and float(min_lon) < float(max_lon):
-            query = query.filter(
-                ShipAIS.lon >= float(min_lon),
-                ShipAIS.lon <= float(max_lon)
-            )
-
-        # ✅ 查詢結果
-        results = [r.to_dict() for r in query.order_by(ShipAIS.timestamp.desc())]
+            lon_range = (float(min_lon), float(max_lon))
+
+        # 依時間分割時只查與 start / end 重疊的分割區
+        results = []
+        sessions = ship_ais_history.read_sessions(start, end)
+        for session in sessions:
+            query = session.query(ShipAIS)
+
+            # 篩選船名
+            if request.args.get("shipname"):
+                query = query.filter(ShipAIS.shipname.ilike(f"%{request.args['shipname']}%"))
+
+            # 篩選船 ID
+            if request.args.get("ship_id"):
+                query = query.filter_by(ship_id=request.args["ship_id"])
+
+            # 篩選時間區間
+            if start is not None:
+                if expand:
+                    # 區間開始前寫入、但狀態一直延續到區間內的資料也要取出
+                    query = query.outerjoin(ShipAISRun, ShipAISRun.row_id == ShipAIS.id).filter(
+                        ShipAIS.timestamp <= end,
+                        or_(ShipAIS.timestamp >= start, ShipAISRun.last_seen >= start, ShipAIS.end_time >= start))
+                else:
+                    # 壓縮後的一段軌跡只要與區間重疊就取出
+                    query = query.filter(time_window(ShipAIS, start, end))
+
+            # 經緯度篩選
+            if lat_range:
+                query = query.filter(
+                    ShipAIS.lat >= lat_range[0],
+                    ShipAIS.lat <= lat_range[1]
+                )
+            if lon_range:
+                query = query.filter(
+                    ShipAIS.lon >= lon_range[0],
+                    ShipAIS.lon <= lon_range[1]
+                )
+            # 經緯度（+ 時間）範圍先由 R*Tree 篩出候選；expand 時區間開始前的資料也要保留
+            query = bbox_filter(query, session, ShipAIS, lat_range, lon_range,
+                                None if expand or start is None else start - MAX_SEGMENT, end)
+
+            # ✅ 查詢結果
+            if expand:
+                results += expand_history(query.order_by(ShipAIS.timestamp.desc()), start, end, session)
+            else:
+                results += [r.to_dict() for r in query.order_by(ShipAIS.timestamp.desc())]
+
+        if len(sessions) > 1:
+            results.sort(key=lambda d: d["timestamp"] or datetime.min, reverse=True)
 
         # ✅ 額外回傳筆數統計（可在前端 console 顯示）
         return jsonify({
@@ -82,13 +136,95 @@ def get_ship_history():
         abort(500, description=str(e))
 
 
+# =========================================
+# API: 船舶靜態資料變更歷史（VESSEL_REGISTRY=1 轉換後才有資料）
+# =========================================
+@api_blueprint.route("/ais/vessel/<ship_id>", methods=["GET"])
+def get_vessel_history(ship_id):
+    try:
+        history = vessel_history(ship_ais_history.read_sessions(), ship_id)
+        return jsonify({"ship_id": ship_id, "count": len(history), "data": history})
+    except Exception as e:
+        abort(500, description=str(e))
+
+
+# =========================================
+# API: 最新船隊狀態（記憶體快照，不查詢 DB）
+# =========================================
+@api_blueprint.route("/fleet/latest", methods=["GET"])
+def get_fleet_latest():
+    """
+    參數皆可省略：
+      ship_id : 只回傳這艘船
+      source  : 只回傳這個 tile 的船
+      ccg=1   : 只回傳海警船
+    """
+    snapshot = get_fleet_state().current()
+    rows = snapshot.rows_for(request.args.get("ship_id"), request.args.get("source"))
+    if request.args.get("ccg") == "1":
+        rows = rows[snapshot["is_ccg"][rows]]
+    data = snapshot.records(rows, meta=True)
+    return jsonify({
+        "timestamp": snapshot.timestamp.isoformat() if snapshot.timestamp else None,
+        "count": len(data),
+        "data": data,
+    })
+
+
+# =========================================
+# API: 最新船隊到 12nm / 24nm 線（或基線）的距離分級
+# =========================================
+@api_blueprint.route("/fleet/distance", methods=["GET"])
+def get_fleet_distance():
+    """
+    參數皆可省略：
+      line       : 12nm（預設）/ 24nm / baseline（需另外提供基線 GeoJSON）
+      thresholds : 海浬門檻，逗號分隔（預設 DISTANCE_THRESHOLDS_NM）
+      source     : 只計算這個 tile 的船
+      ccg=1      : 只計算海警船
+    回傳每個門檻內的船數（counts 與 thresholds_nm 對應），以及在最大門檻內的船（附距離，由近到遠）
+    """
+    engine = get_distance_engine()
+    line = request.args.get("line", "12nm")
+    if line not in engine.names():
+        abort(400, description=f"Unknown line: {line}")
+    try:
+        thresholds = sorted(float(v) for v in request.args.get("thresholds", "").split(",") if v.strip()) \
+            or sorted(DISTANCE_THRESHOLDS_NM)
+    except ValueError:
+        abort(400, description="Invalid thresholds")
+
+    snapshot = get_fleet_state().current()
+    rows = snapshot.rows_for(None, request.args.get("source"))
+    if request.args.get("ccg") == "1":
+        rows = rows[snapshot["is_ccg"][rows]]
+    lons, lats = snapshot["lon"][rows], snapshot["lat"][rows]
+    band = engine.bands(line, lons, lats, thresholds)
+
+    # 只有列出的船需要精確距離
+    near = np.flatnonzero(band < len(thresholds))
+    distance_nm = engine.distance_nm(line, lons, lats, near)
+    order = np.argsort(distance_nm, kind="stable")
+    data = snapshot.records(rows[near[order]], meta=True)
+    for record, nm in zip(data, distance_nm[order].tolist()):
+        record["distance_nm"] = round(nm, 3)
+    return jsonify({
+        "timestamp": snapshot.timestamp.isoformat() if snapshot.timestamp else None,
+        "line": line,
+        "thresholds_nm": thresholds,
+        "counts": [int(np.count_nonzero(band <= i)) for i in range(len(thresholds))],
+        "count": len(data),
+        "data": data,
+    })
+
+
 # =========================================
 # API: CCG 最新資料（所有海警船最新）
 # =========================================
 @api_blueprint.route("/ccg_data", methods=["GET"])
 def get_ccg_data():
     try:
-        results = CCGSession.query(CCGShipAIS).all()
+        results = CCGReadSession.query(CCGShipAIS).all()
         data = [
             {
                 "ship_id": r.ship_id,
@@ -109,7 +245,7 @@ def get_ccg_data():
 @api_blueprint.route("/boat_check12", methods=["GET"])
 def get_boat_check12_data():
     try:
-        results = BoatCheck12Session.query(BoatCheck12AIS).all()
+        results = BoatCheck12ReadSession.query(BoatCheck12AIS).all()
         data = [
             {
                 "ship_id": r.ship_id,
@@ -130,7 +266,7 @@ def get_boat_check12_data():
 @api_blueprint.route("/boat_check24", methods=["GET"])
 def get_boat_check24_data():
     try:
-        results = BoatCheck24Session.query(BoatCheck24AIS).all()
+        results = BoatCheck24ReadSession.query(BoatCheck24AIS).all()
         data = [
             {
                 "ship_id": r.ship_id,
@@ -151,7 +287,7 @@ def get_boat_check24_data():
 @api_blueprint.route("/ccg_check12_data", methods=["GET"])
 def get_ccg_check12_data():
     try:
-        results = CCGCheck12Session.query(CCGCheck12ShipAIS).all()
+        results = CCGCheck12ReadSession.query(CCGCheck12ShipAIS).all()
         data = [
             {
                 "ship_id": r.ship_id,
@@ -172,7 +308,7 @@ def get_ccg_check12_data():
 @api_blueprint.route("/ccg_check24_data", methods=["GET"])
 def get_ccg_check24_data():
     try:
-        results = CCGCheck24Session.query(CCGCheck24ShipAIS).all()
+        results = CCGCheck24ReadSession.query(CCGCheck24ShipAIS).all()
         data = [
             {
                 "ship_id": r.ship_id,
@@ -193,31 +329,43 @@ def get_ccg_check24_data():
 @api_blueprint.route("/chinaboat/all", methods=["GET"])
 def get_all_chinaboats():
     try:
-        query = ChinaBoatSession.query(ChinaBoatAIS)
-
-        # 船名模糊搜尋
-        if request.args.get("shipname"):
-            query = query.filter(ChinaBoatAIS.shipname.ilike(f"%{request.args['shipname']}%"))
-
         # 時間區間
+        start = end = None
         if request.args.get("start") and request.args.get("end"):
             start = parser.parse(request.args.get("start"))
             end = parser.parse(request.args.get("end"))
-            query = query.filter(ChinaBoatAIS.timestamp.between(start, end))
 
         # 經緯度範圍
         min_lat = request.args.get("min_lat")
         max_lat = request.args.get("max_lat")
         min_lon = request.args.get("min_lon")
         max_lon = request.args.get("max_lon")
-
-        if min_lat and max_lat:
-            query = query.filter(ChinaBoatAIS.lat.between(float(min_lat), float(max_lat)))
-        if min_lon and max_lon:
-            query = query.filter(ChinaBoatAIS.lon.between(float(min_lon), float(max_lon)))
-
-        # 執行查詢
-        results = query.order_by(ChinaBoatAIS.timestamp.desc()).all()
+        lat_range = (float(min_lat), float(max_lat)) if min_lat and max_lat else None
+        lon_range = (float(min_lon), float(max_lon)) if min_lon and max_lon else None
+
+        # 依時間分割時只查與 start / end 重疊的分割區
+        results = []
+        sessions = china_boat_history.read_sessions(start, end)
+        for session in sessions:
+            query = session.query(ChinaBoatAIS)
+
+            # 船名模糊搜尋
+            if request.args.get("shipname"):
+                query = query.filter(ChinaBoatAIS.shipname.ilike(f"%{request.args['shipname']}%"))
+            if start is not None:
+                query = query.filter(time_window(ChinaBoatAIS, start, end))
+            if lat_range:
+                query = query.filter(ChinaBoatAIS.lat.between(*lat_range))
+            if lon_range:
+                query = query.filter(ChinaBoatAIS.lon.between(*lon_range))
+            query = bbox_filter(query, session, ChinaBoatAIS, lat_range, lon_range,
+                                None if start is None else start - MAX_SEGMENT, end)
+
+            # 執行查詢
+            results += query.order_by(ChinaBoatAIS.timestamp.desc()).all()
+
+        if len(sessions) > 1:
+            results.sort(key=lambda r: r.timestamp or datetime.min, reverse=True)
 
         # 格式統一成 AIS 格式
         data = [
@@ -229,7 +377,10 @@ def get_all_chinaboats():
                 "speed": r.speed,
                 "course": r.course,
                 "shiptype": r.shiptype,
-                "timestamp": r.timestamp.strftime("%Y-%m-%d %H:%M:%S") if r.timestamp else None
+                "timestamp": r.timestamp.strftime("%Y-%m-%d %H:%M:%S") if r.timestamp else None,
+                # 壓縮後的一段軌跡（compaction.py）另外附上結束時間與速度範圍
+                **({"end_time": r.end_time.strftime("%Y-%m-%d %H:%M:%S"), "speed_min": r.speed_min,
+                    "speed_max": r.speed_max, "points": r.points} if r.points is not None else {})
             }
             for r in results
         ]
@@ -246,12 +397,17 @@ def get_all_chinaboats():
 @api_blueprint.route("/chinaboat/latest", methods=["GET"])
 def get_latest_chinaboats():
     try:
-        results = (
-            ChinaBoatSession.query(ChinaBoatAIS)
-            .order_by(ChinaBoatAIS.timestamp.desc())
-            .limit(200)
-            .all()
-        )
+        # 分割區由新到舊，湊滿 200 筆就不必再查更舊的
+        results = []
+        for session in china_boat_history.read_sessions():
+            results += (
+                session.query(ChinaBoatAIS)
+                .order_by(ChinaBoatAIS.timestamp.desc())
+                .limit(200 - len(results))
+                .all()
+            )
+            if len(results) >= 200:
+                break
 
         data = [
             {
@@ -262,7 +418,10 @@ def get_latest_chinaboats():
                 "speed": r.speed,
                 "course": r.course,
                 "shiptype": r.shiptype,
-                "timestamp": r.timestamp.strftime("%Y-%m-%d %H:%M:%S") if r.timestamp else None
+                "timestamp": r.timestamp.strftime("%Y-%m-%d %H:%M:%S") if r.timestamp else None,
+                # 壓縮後的一段軌跡（compaction.py）另外附上結束時間與速度範圍
+                **({"end_time": r.end_time.strftime("%Y-%m-%d %H:%M:%S"), "speed_min": r.speed_min,
+                    "speed_max": r.speed_max, "points": r.points} if r.points is not None else {})
             }
             for r in results
         ]
@@ -273,3 +432,25 @@ def get_latest_chinaboats():
         abort(500, description=str(e))
 
 
+# =========================================
+# API: ingest/stats（最近一輪 pipeline 各階段吞吐量與佇列深度）
+# =========================================
+@api_blueprint.route("/ingest/stats", methods=["GET"])
+def get_ingest_stats():
+    return jsonify({"timestamp": datetime.utcnow().isoformat(), "last_cycle": LAST_CYCLE_STATS})
+
+
+# =========================================
+# API: scheduler/tiles（各 tile 的活動程度與實際輪詢間隔）
+# =========================================
+@api_blueprint.route("/scheduler/tiles", methods=["GET"])
+def get_tile_schedule():
+    return jsonify({"timestamp": datetime.utcnow().isoformat(), **tile_scheduler.report()})
+
+
+# =========================================
+# API: tiles/health（各 tile 的 circuit breaker 狀態）
+# =========================================
+@api_blueprint.route("/tiles/health", methods=["GET"])
+def get_tiles_health():
+    return jsonify({"timestamp": datetime.utcnow().isoformat(), **get_tile_health().report()})
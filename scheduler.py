@@ -1,21 +1,68 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from fetcher import fetch_data
+from fetcher import fetch_data, urls
 from flask import Flask
 
+from config import ADAPTIVE_SCHEDULING, SCHEDULER_TICK_SECONDS, COMPACTION_ENABLED, COMPACTION_INTERVAL_MINUTES
+from tile_scheduler import AdaptiveTileScheduler
+from tile_health import get_tile_health
+
 # =========================================
 # 建立 Scheduler
 # =========================================
 scheduler = BackgroundScheduler()
 
-def init_scheduler(app: Flask):
+# 各 tile 的輪詢頻率（依海警船活動調整）
+tile_scheduler = AdaptiveTileScheduler(urls, health=get_tile_health())
+
+
+def _add_compaction_job(app: Flask):
+    """舊歷史軌跡壓縮：與 ingest 分開的 job，只在寫回時短暫取得 WRITE_LOCK"""
+    from compaction import compact_all
+
+    def scheduled_compaction():
+        with app.app_context():
+            compact_all()
+
+    scheduler.add_job(func=scheduled_compaction, trigger="interval",
+                      minutes=COMPACTION_INTERVAL_MINUTES, coalesce=True, max_instances=1)
+    print(f"[Scheduler] 舊歷史軌跡壓縮：每 {COMPACTION_INTERVAL_MINUTES} 分鐘執行一次。")
+
+
+def init_scheduler(app: Flask, first_cycle=None):
     """
     初始化排程，定期執行 fetch_data()
+
+    first_cycle: app 啟動時第一次 fetch_data() 的回傳值，
+                 讓各 tile 從啟動當下的活動程度開始排程。
     """
-    def scheduled_fetch():
+    if COMPACTION_ENABLED:
+        _add_compaction_job(app)
+
+    if not ADAPTIVE_SCHEDULING:
+        def scheduled_fetch():
+            with app.app_context():
+                fetch_data(force_push=False)
+
+        # 每 10 分鐘抓一次
+        scheduler.add_job(func=scheduled_fetch, trigger="interval", minutes=10)
+        scheduler.start()
+        print("[Scheduler] 啟動成功，每 10 分鐘抓一次資料。")
+        return
+
+    if first_cycle is not None:
+        tile_scheduler.observe(urls, first_cycle)
+
+    def scheduled_tick():
+        due = tile_scheduler.due_tiles()
+        if not due:
+            return
         with app.app_context():
-            fetch_data(force_push=False)
+            result = fetch_data(force_push=False, tile_urls=due)
+        tile_scheduler.observe(due, result)
 
-    # 每 10 分鐘抓一次
-    scheduler.add_job(func=scheduled_fetch, trigger="interval", minutes=10)
+    # 每個 tick 只抓到期的 tile
+    scheduler.add_job(func=scheduled_tick, trigger="interval",
+                      seconds=SCHEDULER_TICK_SECONDS, coalesce=True, max_instances=1)
     scheduler.start()
-    print("[Scheduler] 啟動成功，每 10 分鐘抓一次資料。")
+    print(f"[Scheduler] 啟動成功，每 {SCHEDULER_TICK_SECONDS} 秒檢查一次到期的 tile"
+          f"（每小時上限 {tile_scheduler.budget_per_hour:.0f} 次請求）。")
@@ -0,0 +1,123 @@
+"""
+歷史表的 R*Tree 空間索引（lat / lon / 時間三維）
+
+每個歷史表 {table} 對應一個 {table}_rtree 虛擬表，以 trigger 與原表同步：
+executemany 大量寫入、刪除（保留期限清理）都不需要另外處理。
+建立與回填由 migrations.py 的 history_rtree migration 負責。
+
+R*Tree 以 32-bit float 儲存邊界（向外取整），只用來縮小候選範圍；
+API 仍保留原本的經緯度 / 時間條件做精確比對。
+"""
+import calendar
+import threading
+
+from sqlalchemy import Table, Column, Integer, Float, MetaData, select, text
+
+_metadata = MetaData()
+_tables = {}
+_available = set()
+_lock = threading.Lock()
+
+
+def rtree_name(table):
+    return f"{table}_rtree"
+
+
+def epoch(dt):
+    """與 trigger 的 strftime('%s', timestamp) 相同：直接取欄位值，不做時區換算"""
+    return calendar.timegm(dt.timetuple())
+
+
+# =========================================
+# DDL（migration 使用）
+# =========================================
+def create_rtree(conn, table, source=None, lat="lat", lon="lon", scale=None):
+    """
+    建立 R*Tree、同步 trigger，並回填既有資料；回傳回填筆數
+    source    : trigger 所在的實體表（精簡列的歷史表為 {table}_pos，預設即 table）
+    lat / lon : 實體表的經緯度欄位；scale 為整數儲存時的倍率（lat_e7 → scale=1e7）
+    """
+    rtree = rtree_name(table)
+    source = source or table
+
+    def coords(row):
+        y, x = f"{row}.{lat}", f"{row}.{lon}"
+        if scale:
+            y, x = f"{y} / {scale:g}", f"{x} / {scale:g}"
+        t = f"CAST(strftime('%s', {row}.timestamp) AS INTEGER)"
+        return f"{row}.id, {y}, {y}, {x}, {x}, {t}, {t}"
+
+    def indexed(row):
+        return f"{row}.{lat} IS NOT NULL AND {row}.{lon} IS NOT NULL AND {row}.timestamp IS NOT NULL"
+
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree("
+        f"id, min_lat, max_lat, min_lon, max_lon, min_t, max_t)",
+        f"CREATE TRIGGER IF NOT EXISTS {rtree}_ai AFTER INSERT ON {source} WHEN {indexed('NEW')} BEGIN "
+        f"INSERT INTO {rtree} VALUES ({coords('NEW')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {rtree}_ad AFTER DELETE ON {source} BEGIN "
+        f"DELETE FROM {rtree} WHERE id = OLD.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {rtree}_au AFTER UPDATE OF {lat}, {lon}, timestamp ON {source} BEGIN "
+        f"DELETE FROM {rtree} WHERE id = OLD.id; "
+        f"INSERT INTO {rtree} SELECT {coords('NEW')} WHERE {indexed('NEW')}; END",
+    ]
+    for sql in statements:
+        conn.execute(text(sql))
+    return conn.execute(text(
+        f"INSERT INTO {rtree} SELECT {coords(source)} FROM {source} "
+        f"WHERE {indexed(source)} AND id NOT IN (SELECT id FROM {rtree})")).rowcount
+
+
+# =========================================
+# 查詢
+# =========================================
+def _rtree_table(table):
+    name = rtree_name(table)
+    if name not in _tables:
+        with _lock:
+            if name not in _tables:
+                _tables[name] = Table(
+                    name, _metadata,
+                    Column("id", Integer, primary_key=True),
+                    Column("min_lat", Float), Column("max_lat", Float),
+                    Column("min_lon", Float), Column("max_lon", Float),
+                    Column("min_t", Float), Column("max_t", Float))
+    return _tables[name]
+
+
+def has_rtree(session, table):
+    """背景 migration 完成前 R*Tree 可能還不存在；存在後就記住，不再查 sqlite_master"""
+    key = (str(session.get_bind().url), table)
+    if key in _available:
+        return True
+    found = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": rtree_name(table)}).first() is not None
+    if found:
+        _available.add(key)
+    return found
+
+
+def bbox_filter(query, session, Model, lat_range=None, lon_range=None, start=None, end=None):
+    """
+    有經緯度範圍時，加上 Model.id IN (R*Tree 候選)；時間條件一併交給 R*Tree。
+    只有時間條件（或 R*Tree 尚未建立）時原樣回傳，由 timestamp 索引處理。
+    """
+    if lat_range is None and lon_range is None:
+        return query
+    table = Model.__tablename__
+    if not has_rtree(session, table):
+        return query
+
+    rtree = _rtree_table(table)
+    conditions = []
+    if lat_range is not None:
+        conditions += [rtree.c.max_lat >= lat_range[0], rtree.c.min_lat <= lat_range[1]]
+    if lon_range is not None:
+        conditions += [rtree.c.max_lon >= lon_range[0], rtree.c.min_lon <= lon_range[1]]
+    # 秒以下捨去（與 trigger 相同），邊界上的資料交給原本的 timestamp 條件精確判斷
+    if start is not None:
+        conditions.append(rtree.c.max_t >= epoch(start))
+    if end is not None:
+        conditions.append(rtree.c.min_t <= epoch(end))
+    return query.filter(Model.id.in_(select(rtree.c.id).where(*conditions)))
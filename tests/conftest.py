@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 測試用的資料庫 / 失敗紀錄放在暫存目錄，且必須在 import config 之前設定
+_work = tempfile.mkdtemp(prefix="ais-test-")
+os.environ.setdefault("AIS_DB_DIR", os.path.join(_work, "db"))
+os.environ.setdefault("AIS_FAILED_LOG", os.path.join(_work, "failed_records.json"))
+os.environ.setdefault("MIGRATIONS_ONLINE", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app():
+    """Flask app context（資料庫在上面的暫存目錄）"""
+    from app import app
+    with app.app_context():
+        yield app
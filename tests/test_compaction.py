@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from compaction import simplify_track, compact_store, _compacted_until, _M_PER_DEG
+
+
+def _track(seconds, north_m, east_m=None, lat0=24.0, lon0=120.0):
+    """以公尺位移建立軌跡（與 simplify_track 相同的等距圓柱近似）"""
+    seconds = np.asarray(seconds, dtype=float)
+    north_m = np.asarray(north_m, dtype=float)
+    east_m = np.zeros_like(north_m) if east_m is None else np.asarray(east_m, dtype=float)
+    lat = lat0 + north_m / _M_PER_DEG
+    lon = lon0 + east_m / (_M_PER_DEG * np.cos(np.radians(lat0)))
+    return seconds, lat, lon
+
+
+def test_short_tracks_keep_everything():
+    assert simplify_track(np.array([]), np.array([]), np.array([])).tolist() == []
+    s, lat, lon = _track([0], [0])
+    assert simplify_track(s, lat, lon).tolist() == [True]
+    s, lat, lon = _track([0, 600], [0, 0])
+    assert simplify_track(s, lat, lon).tolist() == [True, True]
+
+
+def test_constant_motion_keeps_only_endpoints():
+    s, lat, lon = _track(np.arange(0, 3600, 600), np.arange(6) * 100.0)
+    keep = simplify_track(s, lat, lon, tolerance_m=10, max_segment_s=7200)
+    assert keep.tolist() == [True, False, False, False, False, True]
+
+
+def test_stationary_track_keeps_only_endpoints():
+    s, lat, lon = _track(np.arange(0, 3600, 600), np.zeros(6))
+    keep = simplify_track(s, lat, lon, tolerance_m=10, max_segment_s=7200)
+    assert keep[0] and keep[-1]
+    assert keep.sum() == 2
+
+
+def test_deviation_above_tolerance_is_kept():
+    east = [0, 0, 0, 150, 0, 0, 0]
+    s, lat, lon = _track(np.arange(0, 4200, 600), np.zeros(7), east)
+    assert simplify_track(s, lat, lon, tolerance_m=100, max_segment_s=7200).tolist() == \
+        [True, False, False, True, False, False, True]
+    # 偏差在容許範圍內則不保留
+    assert simplify_track(s, lat, lon, tolerance_m=200, max_segment_s=7200).tolist() == \
+        [True, False, False, False, False, False, True]
+
+
+def test_deviation_is_measured_against_time_interpolation():
+    # 路線是直線，但前半停泊、後半才移動：依時間內插的位置與實際相差很大
+    s, lat, lon = _track(np.arange(0, 3000, 600), [0, 0, 0, 1000, 2000])
+    keep = simplify_track(s, lat, lon, tolerance_m=50, max_segment_s=7200)
+    assert keep[0] and keep[-1]
+    assert keep[2]
+
+
+def test_long_segments_are_split_at_max_segment():
+    s, lat, lon = _track(np.arange(0, 13 * 3600, 600), np.zeros(13 * 6))
+    keep = simplify_track(s, lat, lon, tolerance_m=10, max_segment_s=3 * 3600)
+    kept = s[keep]
+    assert kept[0] == s[0] and kept[-1] == s[-1]
+    assert np.diff(kept).max() <= 3 * 3600
+    assert keep.sum() < len(s)
+
+
+def test_long_gap_without_inner_points_is_not_split():
+    # 中間沒有資料可保留時，段長可以超過上限
+    s, lat, lon = _track([0, 600, 36000, 36600], [0, 0, 0, 0])
+    keep = simplify_track(s, lat, lon, tolerance_m=10, max_segment_s=3600)
+    assert keep.tolist() == [True, True, True, True]
+
+
+def test_open_runs_hold_back_the_watermark(app):
+    from models import db, ShipAIS, ShipAISRun
+    from migrations import STORES
+
+    store = next(s for s in STORES if s.name == "ais_data")
+    old = datetime(2024, 1, 1)
+    rows = [(ShipAIS(ship_id="cmp-closed", timestamp=old + timedelta(minutes=30 * i),
+                     lat=24.0, lon=120.5, speed=0.0), old + timedelta(minutes=30 * i)) for i in range(10)]
+    # 差異寫入仍在延續的一段：last_seen 晚於第一次壓縮的 cutoff
+    opened = ShipAIS(ship_id="cmp-open", timestamp=old + timedelta(hours=2), lat=24.0, lon=120.6, speed=0.0)
+    rows.append((opened, old + timedelta(days=2)))
+    db.session.add_all([r for r, _ in rows])
+    db.session.flush()
+    db.session.add_all([ShipAISRun(row_id=r.id, ship_id=r.ship_id, last_seen=seen, repeats=0) for r, seen in rows])
+    db.session.commit()
+
+    compact_store(store, old + timedelta(days=1))
+    with store.engine.connect() as conn:
+        watermark = _compacted_until(conn, store.table)
+    assert str(watermark).startswith("2024-01-01 02:00:00")
+    db.session.expire_all()
+    assert db.session.get(ShipAIS, opened.id).points is None
+
+    # 該段結束後下次壓縮仍會處理到
+    compact_store(store, old + timedelta(days=3))
+    db.session.expire_all()
+    compacted = db.session.get(ShipAIS, opened.id)
+    assert compacted.points == 1
+    assert compacted.end_time == old + timedelta(days=2)
+    assert ShipAIS.query.filter_by(ship_id="cmp-closed").filter(ShipAIS.points.is_(None)).count() == 0
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from ingest import ShipBatch
+from delta_history import DeltaHistory, expand_history, _M_PER_DEG
+
+T0 = datetime(2025, 1, 1)
+
+
+def _row(ship_id, lat=24.0, lon=120.5, speed_kn=0.0, course=90):
+    return {"SHIP_ID": ship_id, "SHIPNAME": f"S{ship_id}", "LAT": str(lat), "LON": str(lon),
+            "SPEED": str(speed_kn * 10), "COURSE": str(course), "ELAPSED": "1"}
+
+
+def _batch(rows, timestamp):
+    return ShipBatch.from_rows(rows, "tile", timestamp)
+
+
+def _history(last):
+    """last: {ship_id: (lat, lon, speed, course, stored_at, last_seen)}"""
+    delta = DeltaHistory(position_tolerance_m=50, speed_tolerance_kn=0.5, course_tolerance_deg=10,
+                         keyframe_minutes=360, max_gap_minutes=60)
+    delta._last = {s: (i,) + state for i, (s, state) in enumerate(last.items(), 1)}
+    return delta
+
+
+# =========================================
+# changed_mask
+# =========================================
+def test_all_new_ships_are_written():
+    delta = _history({})
+    assert delta.changed_mask(_batch([_row("1"), _row("2")], T0)).tolist() == [True, True]
+
+
+def test_tolerances():
+    now = T0 + timedelta(minutes=10)
+    seen = now - timedelta(minutes=10)
+    delta = _history({
+        "same": (24.0, 120.5, 0.0, 90, T0, seen),
+        "jitter": (24.0, 120.5, 0.0, 90, T0, seen),
+        "moved": (24.0, 120.5, 0.0, 90, T0, seen),
+        "faster": (24.0, 120.5, 0.0, 90, T0, seen),
+        "moored_turn": (24.0, 120.5, 0.0, 90, T0, seen),
+        "underway_turn": (24.0, 120.5, 10.0, 90, T0, seen),
+    })
+    batch = _batch([
+        _row("same"),
+        _row("jitter", lat=24.0 + 20 / _M_PER_DEG),
+        _row("moved", lat=24.0 + 200 / _M_PER_DEG),
+        _row("faster", speed_kn=2.0),
+        _row("moored_turn", course=200),
+        _row("underway_turn", speed_kn=10.0, course=120),
+        _row("new"),
+    ], now)
+    assert delta.changed_mask(batch).tolist() == [False, False, True, True, False, True, True]
+
+
+def test_keyframe_interval_forces_a_row():
+    now = T0 + timedelta(minutes=360)
+    delta = _history({
+        "due": (24.0, 120.5, 0.0, 90, T0, now - timedelta(minutes=10)),
+        "recent": (24.0, 120.5, 0.0, 90, T0 + timedelta(minutes=1), now - timedelta(minutes=10)),
+    })
+    assert delta.changed_mask(_batch([_row("due"), _row("recent")], now)).tolist() == [True, False]
+
+
+def test_max_gap_forces_a_row():
+    now = T0 + timedelta(minutes=120)
+    delta = _history({
+        "gone": (24.0, 120.5, 0.0, 90, T0, now - timedelta(minutes=61)),
+        "edge": (24.0, 120.5, 0.0, 90, T0, now - timedelta(minutes=60)),
+    })
+    assert delta.changed_mask(_batch([_row("gone"), _row("edge")], now)).tolist() == [True, False]
+
+
+def test_pending_state_takes_precedence():
+    now = T0 + timedelta(minutes=10)
+    delta = _history({"1": (24.0, 120.5, 0.0, 90, T0, T0)})
+    # 尚未 commit 的上一輪已移動到新位置
+    delta._pending["1"] = (99, 24.0 + 200 / _M_PER_DEG, 120.5, 0.0, 90, T0 + timedelta(minutes=5),
+                           T0 + timedelta(minutes=5))
+    moved = _batch([_row("1", lat=24.0 + 200 / _M_PER_DEG)], now)
+    assert delta.changed_mask(moved).tolist() == [False]
+
+
+# =========================================
+# persist → expand_history 還原完整時間解析度
+# =========================================
+def test_expand_history_round_trip(app):
+    from models import db, ShipAIS
+
+    delta = DeltaHistory(position_tolerance_m=50, speed_tolerance_kn=0.5, course_tolerance_deg=10,
+                         keyframe_minutes=360, max_gap_minutes=60)
+    moving_lat = [24.0 + c * 0.01 for c in range(8)]
+    cycles = []
+    for c in range(8):
+        timestamp = T0 + timedelta(minutes=10 * c)
+        rows = [_row("rt-moored"), _row("rt-moving", lat=moving_lat[c], speed_kn=10)]
+        if c not in (3, 4):
+            rows.append(_row("rt-partial"))   # 部分輪次沒出現
+        cycles.append((timestamp, rows))
+
+    written = 0
+    for timestamp, rows in cycles:
+        batch = _batch(rows, timestamp)
+        written += delta.persist(batch, batch.records(), timestamp)[0]
+        db.session.commit()
+        delta.confirm()
+
+    stored = ShipAIS.query.filter(ShipAIS.ship_id.like("rt-%")).all()
+    assert len(stored) == written < sum(len(rows) for _, rows in cycles)
+
+    expanded = expand_history(stored)
+    got = sorted((d["ship_id"], d["timestamp"], round(d["lat"], 6)) for d in expanded)
+    want = []
+    for timestamp, rows in cycles:
+        for r in rows:
+            want.append((r["SHIP_ID"], timestamp, round(float(r["LAT"]), 6)))
+    # rt-partial 消失的兩輪（未超過 max gap）以最後已知狀態補上
+    for c in (3, 4):
+        want.append(("rt-partial", cycles[c][0], 24.0))
+    assert got == sorted(want)
+    stored_at = {s.id: s.timestamp for s in stored}
+    assert all(d["expanded"] == (d["timestamp"] != stored_at[d["id"]]) for d in expanded)
+
+    start, end = cycles[2][0], cycles[5][0]
+    window = expand_history(stored, start, end)
+    assert sorted((d["ship_id"], d["timestamp"]) for d in window) == \
+        sorted((s, t) for s, t, _ in sorted(want) if start <= t <= end)
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import fleet_snapshot
+from fleet_snapshot import FleetState, _empty_snapshot
+from ingest import ShipBatch, classify_batch
+
+T0 = datetime(2025, 1, 1)
+
+
+def _batch(minutes, tiles):
+    """tiles: {tile: [ship_id, ...]}"""
+    timestamp = T0 + timedelta(minutes=minutes)
+    batches = [ShipBatch.from_rows([{"SHIP_ID": s, "SHIPNAME": f"S{s}", "LAT": "24.0", "LON": "120.5",
+                                     "SPEED": str(minutes), "FLAG": "TW", "ELAPSED": "1"} for s in ships],
+                                   tile, timestamp, tile_index=i)
+               for i, (tile, ships) in enumerate(tiles.items())]
+    return classify_batch(ShipBatch.concat(batches))
+
+
+def _ships(snapshot):
+    return sorted(snapshot["ship_id"].tolist())
+
+
+def test_build_full_and_partial():
+    first = _empty_snapshot().build(_batch(0, {"a": ["1", "2"], "b": ["3"]}))
+    assert (first.version, first.timestamp, _ships(first)) == (1, T0, ["1", "2", "3"])
+
+    # 只重抓 tile a：b 的船保留，a 消失的船移除
+    partial = first.build(_batch(10, {"a": ["1"]}), drop_sources=["a"])
+    assert (partial.version, _ships(partial)) == (2, ["1", "3"])
+    assert partial["speed"][partial.by_ship["1"]] == 1.0
+    assert partial["timestamp"][partial.by_ship["3"]] == T0
+    # 船換到其他 tile 時不重複
+    moved = partial.build(_batch(20, {"b": ["1", "3"]}), drop_sources=["b"])
+    assert _ships(moved) == ["1", "3"]
+    assert sorted(moved["ship_id"][moved.rows_for(source="b")].tolist()) == ["1", "3"]
+    assert len(moved.rows_for(source="a")) == 0
+
+    full = moved.build(_batch(30, {"a": ["9"]}))
+    assert _ships(full) == ["9"]
+    # 原本的快照不受影響
+    assert _ships(first) == ["1", "2", "3"]
+
+
+def test_pending_changes_and_confirm(monkeypatch):
+    monkeypatch.setattr(fleet_snapshot, "FLEET_SNAPSHOT_PERSIST", True)
+    monkeypatch.setattr(fleet_snapshot, "FLEET_SNAPSHOT_PERSIST_MINUTES", 0)
+    state = FleetState()
+    state.publish(_empty_snapshot())
+
+    first = state.advance(_batch(0, {"a": ["1", "2"], "b": ["3"]}))
+    changed, removed = state.pending_changes(first)
+    assert sorted(r["ship_id"] for r in changed) == ["1", "2", "3"] and removed == []
+
+    # 未 confirm（commit 失敗）：下一輪累積比對，不遺漏
+    second = state.advance(_batch(10, {"a": ["1"]}), drop_sources=["a"])
+    changed, removed = state.pending_changes(second)
+    assert sorted(r["ship_id"] for r in changed) == ["1", "3"] and removed == []
+
+    state.confirm(second)
+    third = state.advance(None, drop_sources=["b"])
+    changed, removed = state.pending_changes(third)
+    assert changed == [] and removed == ["3"]
+
+
+def test_pending_changes_respects_persist_settings(monkeypatch):
+    monkeypatch.setattr(fleet_snapshot, "FLEET_SNAPSHOT_PERSIST", True)
+    monkeypatch.setattr(fleet_snapshot, "FLEET_SNAPSHOT_PERSIST_MINUTES", 30)
+    state = FleetState()
+    state.publish(_empty_snapshot())
+    state.confirm(state.advance(_batch(0, {"a": ["1"]})))
+    assert state.pending_changes(state.advance(_batch(10, {"a": ["1"]}))) is None
+    assert state.pending_changes(state.advance(_batch(30, {"a": ["1"]}))) is not None
+
+    monkeypatch.setattr(fleet_snapshot, "FLEET_SNAPSHOT_PERSIST", False)
+    assert state.pending_changes(state.current()) is None
+
+
+# =========================================
+# 由 data_test.db 載入
+# =========================================
+@pytest.fixture
+def stored(app):
+    from models import TestSession, TestShipAIS
+
+    def store(rows):
+        TestSession.add_all([TestShipAIS(**r) for r in rows])
+        TestSession.flush()
+        # timestamp 欄位有預設值，NULL 需另外寫入
+        missing = [r["ship_id"] for r in rows if r["timestamp"] is None]
+        TestSession.query(TestShipAIS).filter(TestShipAIS.ship_id.in_(missing)) \
+            .update({TestShipAIS.timestamp: None}, synchronize_session=False)
+        TestSession.commit()
+
+    yield store
+    TestSession.query(TestShipAIS).delete()
+    TestSession.commit()
+    TestSession.remove()
+
+
+def test_load_from_data_test(stored):
+    stored([{"ship_id": "1", "shipname": "S1", "lat": 24.0, "lon": 120.5, "timestamp": T0, "source": "a"},
+            {"ship_id": "2", "shipname": None, "lat": 24.1, "lon": 120.6, "timestamp": T0 + timedelta(minutes=5),
+             "source": "b"},
+            {"ship_id": "3", "shipname": "S3", "lat": 24.2, "lon": 120.7, "timestamp": None, "source": "b"}])
+    state = FleetState()
+    snapshot = state.current()
+    assert (snapshot.timestamp, snapshot.version, _ships(snapshot)) == (T0 + timedelta(minutes=5), 0, ["1", "2", "3"])
+    assert snapshot["shipname"][snapshot.by_ship["2"]] == ""
+    assert state.pending_changes(snapshot) == ([], [])
+
+
+def test_load_without_timestamps_starts_empty(stored):
+    stored([{"ship_id": "1", "lat": 24.0, "lon": 120.5, "timestamp": None, "source": "a"},
+            {"ship_id": "2", "lat": 24.1, "lon": 120.6, "timestamp": None, "source": "a"}])
+    state = FleetState()
+    snapshot = state.current()
+    assert len(snapshot) == 0 and snapshot.timestamp is None
+    # 無法使用的列在下次持久化時刪除
+    changed, removed = state.pending_changes(state.advance(_batch(0, {"a": ["1"]})))
+    assert [r["ship_id"] for r in changed] == ["1"] and removed == ["2"]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import shapely
+
+from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON
+from geo_distance import DistanceEngine, EARTH_RADIUS_KM, haversine_km
+from utils import km_to_nm
+
+LINES = {"12nm": TAIWAN_12NM_POLYGON, "24nm": TAIWAN_24NM_POLYGON}
+THRESHOLDS = [6, 12, 30]
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    return DistanceEngine(LINES, field_cell_deg=0.05, field_margin_nm=max(THRESHOLDS),
+                          cache_dir=str(tmp_path_factory.mktemp("field")))
+
+
+def _random_points(n, seed):
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = TAIWAN_24NM_POLYGON.bounds
+    return rng.uniform(minx - 0.5, maxx + 0.5, n), rng.uniform(miny - 0.5, maxy + 0.5, n)
+
+
+def _azimuthal(coords, lon0, lat0):
+    """以 (lon0, lat0) 為中心的等距方位投影（km）：到中心的距離即球面距離"""
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    lon0, lat0 = np.radians(lon0), np.radians(lat0)
+    d = haversine_km(np.degrees(lat0), np.degrees(lon0), coords[:, 1], coords[:, 0])
+    bearing = np.arctan2(np.sin(lon - lon0) * np.cos(lat),
+                         np.cos(lat0) * np.sin(lat) - np.sin(lat0) * np.cos(lat) * np.cos(lon - lon0))
+    return np.stack([d * np.sin(bearing), d * np.cos(bearing)], axis=1)
+
+
+def _shapely_km(geometry, lon, lat):
+    """
+    每點把邊界投影到以自己為中心的等距方位投影後，用 shapely distance 量到邊界的距離。
+    邊界先在經緯度上切短（與引擎相同，長邊在經緯度上是直線）
+    """
+    boundary = shapely.segmentize(shapely.boundary(geometry), 0.01)
+    return np.array([shapely.distance(shapely.Point(0, 0), shapely.transform(boundary, lambda c: _azimuthal(c, x, y)))
+                     for x, y in zip(lon, lat)])
+
+
+@pytest.mark.parametrize("name", ["12nm", "24nm"])
+def test_distances_match_shapely(engine, name):
+    lon, lat = _random_points(150, seed=1)
+    expected = _shapely_km(LINES[name], lon, lat)
+    got = engine.distance_km(name, lon, lat)
+    assert np.allclose(got, expected, rtol=1e-4, atol=0.005)
+    # 門檻判斷的範圍內也要有足夠的點
+    assert (expected < 60).sum() > 10
+
+
+def test_distance_is_to_the_boundary_inside_and_outside(engine):
+    # 12nm 線上的點距離為 0，往內、往外都是到邊界的距離
+    coords = shapely.get_coordinates(shapely.boundary(TAIWAN_12NM_POLYGON))[::500]
+    assert np.all(engine.distance_km("12nm", coords[:, 0], coords[:, 1]) < 0.01)
+    inland = engine.distance_km("12nm", [121.0], [23.8])[0]
+    assert inland > 20
+    assert inland == pytest.approx(_shapely_km(TAIWAN_12NM_POLYGON, [121.0], [23.8])[0], rel=1e-3)
+
+
+def test_invalid_coordinates_and_unknown_line(engine):
+    got = engine.distance_km("12nm", [np.nan, 121.0, 121.0], [24.0, np.nan, 89.9])
+    assert np.isnan(got).all()
+    assert np.isnan(engine.distance_km("baseline", [121.0], [24.0])).all()
+    assert engine.bands("baseline", [121.0], [24.0], THRESHOLDS).tolist() == [len(THRESHOLDS)]
+    assert engine.bands("12nm", [np.nan], [24.0], THRESHOLDS).tolist() == [len(THRESHOLDS)]
+
+
+def test_rows_select_subset(engine):
+    lon, lat = _random_points(20, seed=2)
+    rows = np.array([3, 7, 11])
+    assert np.array_equal(engine.distance_km("24nm", lon, lat, rows), engine.distance_km("24nm", lon[rows], lat[rows]))
+
+
+def test_bands_with_distance_field_match_exact(engine):
+    lon, lat = _random_points(20_000, seed=3)
+    nm = km_to_nm(engine.distance_km("12nm", lon, lat))
+    expected = np.searchsorted(THRESHOLDS, nm, side="left")
+    assert np.array_equal(engine.bands("12nm", lon, lat, THRESHOLDS), expected)
+    assert len(np.unique(expected)) == len(THRESHOLDS) + 1
+    assert np.array_equal(engine.within_nm("12nm", lon, lat, 6), nm <= 6)
+    # 距離場建一次後重複使用
+    assert engine.field("12nm") is engine.field("12nm")
+
+
+def test_haversine_matches_known_distance():
+    # 赤道上經度差 1 度
+    assert haversine_km(0.0, 120.0, 0.0, 121.0) == pytest.approx(np.radians(1) * EARTH_RADIUS_KM)
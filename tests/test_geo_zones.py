@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+import shapely
+
+from config import TAIWAN_12NM_POLYGON, TAIWAN_24NM_POLYGON
+from geo_zones import ZoneClassifier, ZoneGrid, BOUNDARY, ZONE_NONE, ZONE_12NM, ZONE_24NM
+
+ZONES = [(ZONE_12NM, TAIWAN_12NM_POLYGON), (ZONE_24NM, TAIWAN_24NM_POLYGON)]
+
+
+@pytest.fixture(scope="module")
+def classifier(tmp_path_factory):
+    return ZoneClassifier(ZONES, grid_cell_deg=0.01, cache_dir=str(tmp_path_factory.mktemp("grid")))
+
+
+def _random_points(n, seed):
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = TAIWAN_24NM_POLYGON.bounds
+    return rng.uniform(minx - 0.5, maxx + 0.5, n), rng.uniform(miny - 0.5, maxy + 0.5, n)
+
+
+def test_grid_agrees_with_exact_on_random_points(classifier):
+    lon, lat = _random_points(50_000, seed=1)
+    zone = classifier.classify(lon, lat)
+    assert np.array_equal(zone, classifier.classify_exact(lon, lat))
+    # 三種結果都要出現，否則比對沒有意義
+    assert set(np.unique(zone)) == {ZONE_NONE, ZONE_12NM, ZONE_24NM}
+
+
+def test_grid_agrees_near_boundaries(classifier):
+    # 邊界上的點往各方向微幅偏移：幾乎都落在邊界格，需走精確判斷
+    rng = np.random.default_rng(2)
+    coords = np.concatenate([shapely.get_coordinates(shapely.boundary(p)) for _, p in ZONES])
+    coords = coords[rng.choice(len(coords), 20_000)] + rng.normal(0, 0.002, (20_000, 2))
+    lon, lat = coords[:, 0], coords[:, 1]
+    assert (classifier.grid.lookup(lon, lat) == BOUNDARY).mean() > 0.9
+    assert np.array_equal(classifier.classify(lon, lat), classifier.classify_exact(lon, lat))
+
+
+def test_mask_and_points_outside_grid(classifier):
+    lon = np.array([121.0, 121.0, 0.0, 200.0, np.nan])
+    lat = np.array([24.0, 24.0, 0.0, 24.0, 24.0])
+    assert classifier.classify(lon, lat).tolist() == [ZONE_12NM, ZONE_12NM, ZONE_NONE, ZONE_NONE, ZONE_NONE]
+    mask = np.array([True, False, True, True, True])
+    assert classifier.classify(lon, lat, mask).tolist() == [ZONE_12NM] + [ZONE_NONE] * 4
+
+
+def test_grid_cache_is_reused_and_rebuilt_when_unreadable(classifier, tmp_path):
+    cache_dir = str(tmp_path)
+    built = ZoneGrid.load_or_build(classifier, 0.05, cache_dir)
+    [name] = os.listdir(cache_dir)
+    loaded = ZoneGrid.load_or_build(classifier, 0.05, cache_dir)
+    assert (loaded.x0, loaded.y0) == (built.x0, built.y0)
+    assert np.array_equal(loaded.cells, built.cells)
+
+    with open(os.path.join(cache_dir, name), "wb") as f:
+        f.write(b"broken")
+    rebuilt = ZoneGrid.load_or_build(classifier, 0.05, cache_dir)
+    assert np.array_equal(rebuilt.cells, built.cells)
+    # 格子大小不同時使用另一個快取檔
+    ZoneGrid.load_or_build(classifier, 0.1, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from ingest import ShipBatch, dedup_batch
+
+TS = datetime(2025, 1, 1)
+
+
+def _row(ship_id, lat=24.0, elapsed="1", **extra):
+    row = {"SHIP_ID": ship_id, "SHIPNAME": f"S{ship_id}", "LAT": str(lat), "LON": "120.5",
+           "SPEED": "10", "COURSE": "90", "ELAPSED": elapsed}
+    row.update(extra)
+    return row
+
+
+def _batch(*tiles):
+    """tiles: (tile_index, key, rows)；依給定順序串接（模擬下載完成的先後）"""
+    return ShipBatch.concat([ShipBatch.from_rows(rows, key, TS, tile_index=index)
+                             for index, key, rows in tiles])
+
+
+def _best(batch):
+    best, _ = dedup_batch(batch)
+    return dict(zip(best["ship_id"].tolist(), best["lat"].tolist()))
+
+
+def test_empty_batch():
+    assert dedup_batch(None) == (None, {})
+
+
+def test_lower_elapsed_wins():
+    batch = _batch((0, "a", [_row("1", lat=24.1, elapsed="5")]),
+                   (1, "b", [_row("1", lat=24.2, elapsed="2")]))
+    assert _best(batch) == {"1": 24.2}
+
+
+def test_missing_elapsed_is_oldest():
+    batch = _batch((0, "a", [_row("1", lat=24.1, elapsed=None)]),
+                   (1, "b", [_row("1", lat=24.2, elapsed="30")]))
+    assert _best(batch) == {"1": 24.2}
+
+
+def test_more_filled_fields_wins_on_equal_elapsed():
+    batch = _batch((0, "a", [_row("1", lat=24.1)]),
+                   (1, "b", [_row("1", lat=24.2, DESTINATION="KAOHSIUNG", FLAG="TW")]))
+    assert _best(batch) == {"1": 24.2}
+
+
+def test_elapsed_beats_completeness():
+    batch = _batch((0, "a", [_row("1", lat=24.1, elapsed="1")]),
+                   (1, "b", [_row("1", lat=24.2, elapsed="3", DESTINATION="KAOHSIUNG", FLAG="TW")]))
+    assert _best(batch) == {"1": 24.1}
+
+
+def test_full_tie_keeps_smallest_position_regardless_of_arrival():
+    # tile 1 先下載完成，仍以 (tile_index, row_index) 較小者為準
+    batch = _batch((1, "b", [_row("1", lat=24.3)]),
+                   (0, "a", [_row("2"), _row("1", lat=24.2), _row("1", lat=24.1)]))
+    assert _best(batch)["1"] == 24.2
+
+
+def test_output_order_and_seen_tiles():
+    batch = _batch((1, "b", [_row("3"), _row("1")]),
+                   (0, "a", [_row("2"), _row("1"), _row("2")]))
+    best, seen_tiles = dedup_batch(batch)
+    assert best["ship_id"].tolist() == ["2", "1", "3"]
+    assert seen_tiles == {"1": ["a", "b"], "2": ["a"], "3": ["b"]}
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import migrations
+from database import make_engine_and_session, make_read_session
+from fetcher import upsert_ships, persist_latest
+from geo_zones import ZONE_NONE, ZONE_12NM, ZONE_24NM
+from models import CCGShipAIS
+
+T0 = datetime(2025, 1, 1)
+TABLE = CCGShipAIS.__tablename__
+
+
+def _row(ship_id, minutes, **extra):
+    row = {"ship_id": ship_id, "shipname": f"CCG{ship_id}", "lat": 24.0, "lon": 120.5,
+           "speed": float(minutes), "timestamp": T0 + timedelta(minutes=minutes)}
+    row.update(extra)
+    return row
+
+
+def _ships(conn, table=TABLE):
+    return {r.ship_id: r for r in conn.execute(text(f"SELECT * FROM {table} ORDER BY id"))}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'ccg.db'}")
+    CCGShipAIS.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_upsert_inserts_new_and_updates_existing(engine):
+    with Session(engine) as session:
+        upsert_ships(session, CCGShipAIS, [_row("1", 0), _row("2", 0)])
+        session.commit()
+        upsert_ships(session, CCGShipAIS, [_row("2", 10, lat=25.0), _row("3", 10)])
+        upsert_ships(session, CCGShipAIS, [])
+        session.commit()
+
+    with engine.connect() as conn:
+        ships = _ships(conn)
+    assert sorted(ships) == ["1", "2", "3"]
+    # 既有的船原地更新（id 不變），未出現的船保留
+    assert ships["2"].id == 2 and ships["2"].lat == 25.0 and ships["2"].speed == 10.0
+    assert ships["1"].speed == 0.0
+
+
+class Batch(dict):
+    """persist_latest 只用到 is_ccg / zone 欄位"""
+
+
+def test_persist_latest_routes_ccg_by_zone(app):
+    from models import CCGSession, CCGCheck12Session, CCGCheck24Session, CCGCheck12ShipAIS, CCGCheck24ShipAIS
+
+    batch = Batch(is_ccg=np.array([True, True, True, False]),
+                  zone=np.array([ZONE_NONE, ZONE_12NM, ZONE_24NM, ZONE_12NM]))
+    records = [_row(str(i), 0) for i in range(4)]
+    try:
+        persist_latest(batch, records)
+        # 同一艘船下一輪離開 12nm：最新狀態表覆寫，12nm 表保留最後一次在區內的紀錄
+        batch["zone"] = np.array([ZONE_NONE, ZONE_NONE, ZONE_24NM, ZONE_12NM])
+        persist_latest(batch, [_row(str(i), 10) for i in range(4)])
+        for session in (CCGSession, CCGCheck12Session, CCGCheck24Session):
+            session.commit()
+
+        assert sorted((s.ship_id, s.speed) for s in CCGSession.query(CCGShipAIS)) == \
+            [("0", 10.0), ("1", 10.0), ("2", 10.0)]
+        assert [(s.ship_id, s.speed) for s in CCGCheck12Session.query(CCGCheck12ShipAIS)] == [("1", 0.0)]
+        assert [(s.ship_id, s.speed) for s in CCGCheck24Session.query(CCGCheck24ShipAIS)] == [("2", 10.0)]
+    finally:
+        for session, Model in ((CCGSession, CCGShipAIS), (CCGCheck12Session, CCGCheck12ShipAIS),
+                               (CCGCheck24Session, CCGCheck24ShipAIS)):
+            session.rollback()
+            session.query(Model).delete()
+            session.commit()
+            session.remove()
+
+
+def test_dedup_migration_keeps_newest_row(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    # 舊版資料庫：沒有 ship_id 唯一索引，同一艘船有多筆
+    CCGShipAIS.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX ux_{TABLE}_ship_id"))
+        conn.execute(text(f"INSERT INTO {TABLE} (id, ship_id, speed, timestamp) VALUES "
+                          "(1, '1', 1, '2025-01-01 00:00:00'), (2, '1', 2, '2025-01-01 00:10:00'), "
+                          "(3, '1', 3, '2025-01-01 00:05:00'), (4, '2', 4, '2025-01-01 00:00:00'), "
+                          "(5, '2', 5, '2025-01-01 00:00:00')"))
+
+    store = migrations.Store("ccg", engine, CCGShipAIS, migrations.LATEST)
+    migrations.apply_migration(store, migrations.MIGRATIONS[0])
+    with engine.connect() as conn:
+        ships = _ships(conn)
+        assert {s: (r.id, r.speed) for s, r in ships.items()} == {"1": (2, 2.0), "2": (5, 5.0)}
+        unique = [ix["name"] for ix in inspect(conn).get_indexes(TABLE) if ix["unique"]]
+        assert unique == [f"ux_{TABLE}_ship_id"]
+    engine.dispose()
+
+
+def test_read_session_sees_commits_and_refuses_writes(tmp_path):
+    path = str(tmp_path / "api.db")
+    write_engine, WriteSession, _ = make_engine_and_session(path)
+    CCGShipAIS.__table__.create(write_engine)
+    read_engine, ReadSession = make_read_session(path)
+    try:
+        upsert_ships(WriteSession, CCGShipAIS, [_row("1", 0)])
+        WriteSession.commit()
+        assert [s.ship_id for s in ReadSession.query(CCGShipAIS)] == ["1"]
+        ReadSession.remove()
+
+        with pytest.raises(OperationalError, match="readonly"):
+            upsert_ships(ReadSession, CCGShipAIS, [_row("2", 0)])
+    finally:
+        ReadSession.remove()
+        WriteSession.remove()
+        read_engine.dispose()
+        write_engine.dispose()
@@ -0,0 +1,116 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import partitions
+from database import make_engine_and_session, make_read_session
+from models import ChinaBoatAIS
+from partitions import PartitionedHistory, partition_key, partition_range
+
+
+def test_partition_keys_and_ranges():
+    assert partition_key(datetime(2025, 3, 9, 23, 59), "month") == "2025-03"
+    assert partition_key(datetime(2025, 3, 9, 23, 59), "day") == "2025-03-09"
+    assert partition_range("2025-12") == (datetime(2025, 12, 1), datetime(2026, 1, 1))
+    assert partition_range("2025-02-28") == (datetime(2025, 2, 28), datetime(2025, 3, 1))
+
+
+@pytest.fixture
+def history(app, tmp_path, monkeypatch):
+    """chinaboat 歷史表：legacy 在暫存檔，分割區在暫存目錄"""
+    monkeypatch.setattr(partitions, "PARTITION_DIR", str(tmp_path / "partitions"))
+    monkeypatch.setattr(partitions, "PARTITION_ARCHIVE_DIR", str(tmp_path / "archive"))
+    legacy_path = str(tmp_path / "legacy.db")
+    legacy_engine, legacy_session, _ = make_engine_and_session(legacy_path)
+    ChinaBoatAIS.__table__.create(legacy_engine)
+    read_engine, read_session = make_read_session(legacy_path)
+
+    history = PartitionedHistory("chinaboat", ChinaBoatAIS, [ChinaBoatAIS.__table__],
+                                 legacy_session, read_session)
+    history.enabled = True
+    yield history
+    for partition in history.partitions():
+        partition.close()
+    legacy_session.remove()
+    read_session.remove()
+    legacy_engine.dispose()
+    read_engine.dispose()
+
+
+def _write(history, ship_id, timestamp):
+    session = history.write_session(timestamp)
+    session.add(ChinaBoatAIS(ship_id=ship_id, timestamp=timestamp, lat=24.0, lon=120.5))
+    session.commit()
+    return session
+
+
+def _ship_ids(sessions):
+    ids = [[s.ship_id for s in session.query(ChinaBoatAIS)] for session in sessions]
+    for session in sessions:
+        session.remove()
+    return ids
+
+
+def test_writes_are_routed_by_timestamp(history):
+    jan = _write(history, "1", datetime(2025, 1, 31, 23, 50))
+    assert _write(history, "2", datetime(2025, 1, 5)) is jan
+    # 新的一期第一次寫入時建立分割區
+    feb = _write(history, "3", datetime(2025, 2, 1, 0, 0))
+    assert feb is not jan
+    assert [p.key for p in history.partitions()] == ["2025-01", "2025-02"]
+    assert os.path.exists(history.partitions()[1].path)
+    assert history.open_sessions() == [jan, feb]
+
+    # 重新掃描目錄也能找回分割區
+    fresh = PartitionedHistory("chinaboat", ChinaBoatAIS, [ChinaBoatAIS.__table__],
+                               history.legacy_session, history.legacy_read_session)
+    assert [p.key for p in fresh.partitions()] == ["2025-01", "2025-02"]
+
+
+def test_read_sessions_pick_overlapping_partitions(history):
+    history.legacy_session.add(ChinaBoatAIS(ship_id="0", timestamp=datetime(2024, 12, 20), lat=24.0, lon=120.5))
+    history.legacy_session.commit()
+    for ship_id, timestamp in (("1", datetime(2025, 1, 10)), ("2", datetime(2025, 2, 10)),
+                               ("3", datetime(2025, 3, 10))):
+        _write(history, ship_id, timestamp)
+
+    # 由新到舊；legacy 表依其時間範圍納入
+    assert _ship_ids(history.read_sessions()) == [["3"], ["2"], ["1"], ["0"]]
+    assert _ship_ids(history.read_sessions(datetime(2025, 2, 15), datetime(2025, 3, 1))) == [["3"], ["2"]]
+    assert _ship_ids(history.read_sessions(datetime(2024, 12, 1), datetime(2025, 1, 1))) == [["1"], ["0"]]
+    assert _ship_ids(history.read_sessions(end=datetime(2024, 12, 31))) == [["0"]]
+
+
+def test_retention_archives_expired_partitions(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, "HISTORY_RETENTION_DAYS", 30)
+    monkeypatch.setattr(partitions, "HISTORY_RETENTION_ACTION", "archive")
+    _write(history, "1", datetime(2025, 1, 10))
+    _write(history, "2", datetime(2025, 2, 10))
+    expired = history.partitions()[0].path
+
+    # 三月第一次寫入觸發保留期限：一月整期已過期（2/1 + 30 天 <= 3/5），二月未過期
+    _write(history, "3", datetime(2025, 3, 5))
+    assert [p.key for p in history.partitions()] == ["2025-02", "2025-03"]
+    assert not os.path.exists(expired)
+    assert os.path.exists(tmp_path / "archive" / os.path.basename(expired))
+    assert _ship_ids(history.read_sessions()) == [["3"], ["2"]]
+
+
+def test_retention_drop_and_disabled(history, tmp_path, monkeypatch):
+    _write(history, "1", datetime(2025, 1, 10))
+    assert history.apply_retention(datetime(2030, 1, 1)) == []
+
+    monkeypatch.setattr(partitions, "HISTORY_RETENTION_DAYS", 1)
+    monkeypatch.setattr(partitions, "HISTORY_RETENTION_ACTION", "drop")
+    path = history.partitions()[0].path
+    assert history.apply_retention(datetime(2025, 2, 1)) == []
+    assert history.apply_retention(datetime(2025, 2, 2)) == ["2025-01"]
+    assert not os.path.exists(path) and not os.path.exists(tmp_path / "archive")
+    assert history.partitions() == []
+
+
+def test_disabled_partitioning_uses_legacy_session(history):
+    history.enabled = False
+    assert history.write_session(datetime(2025, 1, 1)) is history.legacy_session
+    assert not os.path.exists(partitions.PARTITION_DIR)
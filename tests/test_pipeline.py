@@ -0,0 +1,128 @@
+import threading
+import time
+from datetime import datetime
+
+import fetcher
+from ingest import ShipBatch, tile_key
+from pipeline import IngestPipeline, Stage
+
+
+def _pipeline(*funcs, workers=1, queue_size=8):
+    return IngestPipeline([Stage(f"s{i}", func, workers=workers, queue_size=queue_size)
+                           for i, func in enumerate(funcs)], queue_size=queue_size)
+
+
+def test_items_flow_through_all_stages():
+    pipeline = _pipeline(lambda x: x + 1, lambda x: x * 10, workers=3)
+    assert sorted(pipeline.run(range(20))) == [(i + 1) * 10 for i in range(20)]
+    stats = pipeline.stats()
+    assert stats["s0"]["items_in"] == stats["s1"]["items_out"] == stats["persist"]["items_in"] == 20
+    assert all(s["queue_depth"] == 0 for s in stats.values())
+
+
+def test_none_and_errors_drop_only_that_item():
+    def picky(x):
+        if x == 3:
+            raise ValueError("bad tile")
+        return None if x % 2 else x
+
+    pipeline = _pipeline(picky, workers=2)
+    assert sorted(pipeline.run(range(8))) == [0, 2, 4, 6]
+    assert pipeline.stats()["s0"]["items_out"] == 4
+
+
+def test_batches_are_counted_by_length():
+    pipeline = _pipeline(lambda n: list(range(n)))
+    assert sorted(len(batch) for batch in pipeline.run([3, 5])) == [3, 5]
+    stats = pipeline.stats()["s0"]
+    assert (stats["items_in"], stats["items_out"]) == (2, 8)
+
+
+def test_download_workers_overlap():
+    def slow(x):
+        time.sleep(0.05)
+        return x
+
+    pipeline = _pipeline(slow, workers=8)
+    started = time.perf_counter()
+    assert sorted(pipeline.run(range(8))) == list(range(8))
+    assert time.perf_counter() - started < 8 * 0.05 / 2
+
+
+def test_backpressure_bounds_queues():
+    produced = []
+
+    def produce(x):
+        produced.append(x)
+        return x
+
+    pipeline = _pipeline(produce, workers=2, queue_size=1)
+    results = pipeline.run(range(20))
+    first = next(results)
+    time.sleep(0.1)
+    # 下游沒有取用時，上游最多只多做 佇列 + worker 數 筆
+    assert len(produced) < 10
+    assert sorted([first] + list(results)) == list(range(20))
+    assert pipeline.stats()["persist"]["max_queue_depth"] <= 1
+
+
+def test_early_exit_drains_upstream():
+    pipeline = _pipeline(lambda x: x, workers=2, queue_size=1)
+    results = pipeline.run(range(50))
+    next(results)
+    results.close()
+    for stage in pipeline.stages:
+        for t in stage._threads:
+            t.join(timeout=5)
+            assert not t.is_alive()
+    assert not any(t.name == "ingest-feed" and t.is_alive() for t in threading.enumerate())
+
+
+# =========================================
+# fetch_data 使用的 fetch → parse → classify
+# =========================================
+class Client:
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def get(self, url, timeout=None):
+        return Response(self.tiles[url])
+
+
+class Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": {"rows": self.rows}}
+
+
+def test_ingest_pipeline_parses_and_classifies_tiles():
+    urls = ["https://www.marinetraffic.com/getData/get_data_json_4/z:9/X:1/Y:1/station:0",
+            "https://www.marinetraffic.com/getData/get_data_json_4/z:9/X:2/Y:1/station:0"]
+    rows = {
+        urls[0]: [{"SHIP_ID": "1", "SHIPNAME": "CHINACOASTGUARD1", "LAT": "25.0", "LON": "119.0",
+                   "FLAG": "CN", "ELAPSED": "1"},
+                  {"SHIP_ID": "2", "SHIPNAME": "EVER", "LAT": "0", "LON": "0", "ELAPSED": "1"}],
+        urls[1]: [{"SHIP_ID": "3", "SHIPNAME": "TAIPEI", "LAT": "22.0", "LON": "121.0",
+                   "FLAG": "TW", "ELAPSED": "1"}],
+    }
+    fetched = []
+    timestamp = datetime(2025, 1, 1)
+    pipeline = fetcher.build_pipeline(Client(rows), timestamp, concurrency=2, fetched=fetched)
+    batch = ShipBatch.concat(list(pipeline.run(enumerate(urls))))
+
+    # 經緯度為 0 的列在解析時剔除
+    assert sorted(batch["ship_id"].tolist()) == ["1", "3"]
+    assert sorted(fetched) == sorted(tile_key(u) for u in urls)
+    by_id = dict(zip(batch["ship_id"].tolist(), range(len(batch))))
+    assert batch["is_ccg"][by_id["1"]] and batch["is_cn"][by_id["1"]]
+    assert not batch["is_ccg"][by_id["3"]]
+    assert batch.timestamp == timestamp
+    assert batch["tile_index"][by_id["3"]] == 1
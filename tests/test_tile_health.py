@@ -0,0 +1,190 @@
+import pytest
+
+import fetcher
+from config import (
+    BREAKER_TRANSIENT_THRESHOLD, BREAKER_PERMANENT_THRESHOLD,
+    BREAKER_TRANSIENT_OPEN_S, BREAKER_PERMANENT_OPEN_S
+)
+from tile_health import (
+    TileHealthTracker, is_transient, failure_kind,
+    CLOSED, OPEN, HALF_OPEN, TRANSIENT, PERMANENT, INVALID_BODY
+)
+
+URL = "https://example.test/tile"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def tracker():
+    return TileHealthTracker(state_file=None, clock=Clock())
+
+
+def _fail(tracker, times, status=503, kind=None):
+    for _ in range(times):
+        tracker.record_failure(URL, status, "error", kind=kind)
+
+
+def test_transient_classification():
+    assert all(is_transient(s) for s in (None, 429, 500, 502, 503))
+    assert not any(is_transient(s) for s in (301, 400, 403, 404))
+    assert failure_kind(None) == TRANSIENT
+    assert failure_kind(403) == PERMANENT
+    assert failure_kind(200, invalid_body=True) == INVALID_BODY
+
+
+def test_breaker_opens_at_threshold_and_skips_requests(tracker):
+    _fail(tracker, BREAKER_TRANSIENT_THRESHOLD - 1)
+    assert tracker.tiles[URL].state == CLOSED and tracker.allow(URL)
+
+    _fail(tracker, 1)
+    h = tracker.tiles[URL]
+    assert h.state == OPEN and tracker.is_open(URL)
+    assert 0.8 * BREAKER_TRANSIENT_OPEN_S <= h.open_until - tracker.clock() <= 1.2 * BREAKER_TRANSIENT_OPEN_S
+    assert not tracker.allow(URL) and not tracker.allow(URL)
+    assert h.skipped == 2
+
+
+def test_half_open_probe_reopens_longer_or_closes(tracker):
+    _fail(tracker, BREAKER_TRANSIENT_THRESHOLD)
+    h = tracker.tiles[URL]
+
+    # 開路時間到：放行一次試探，失敗則開路時間加倍
+    tracker.clock.now = h.open_until
+    assert tracker.allow(URL) and h.state == HALF_OPEN
+    _fail(tracker, 1)
+    assert h.state == OPEN and h.opened == 2
+    assert h.open_until - tracker.clock() >= 0.8 * 2 * BREAKER_TRANSIENT_OPEN_S
+
+    tracker.clock.now = h.open_until
+    assert tracker.allow(URL)
+    tracker.record_success(URL)
+    assert (h.state, h.failures, h.opened) == (CLOSED, 0, 0)
+    assert not tracker.is_open(URL)
+
+
+def test_permanent_errors_open_sooner_and_longer(tracker):
+    _fail(tracker, BREAKER_PERMANENT_THRESHOLD, status=400)
+    h = tracker.tiles[URL]
+    assert h.state == OPEN and h.last_kind == PERMANENT
+    assert h.open_until - tracker.clock() >= 0.8 * BREAKER_PERMANENT_OPEN_S
+
+
+def test_invalid_body_uses_transient_threshold(tracker):
+    _fail(tracker, BREAKER_TRANSIENT_THRESHOLD - 1, status=200, kind=INVALID_BODY)
+    h = tracker.tiles[URL]
+    assert h.state == CLOSED and h.last_kind == INVALID_BODY
+    _fail(tracker, 1, status=200, kind=INVALID_BODY)
+    assert h.state == OPEN
+    assert h.open_until - tracker.clock() <= 1.2 * BREAKER_TRANSIENT_OPEN_S
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / "tile_health.json")
+    clock = Clock()
+    tracker = TileHealthTracker(state_file=path, clock=clock)
+    _fail(tracker, BREAKER_TRANSIENT_THRESHOLD)
+    tracker.save()
+
+    restored = TileHealthTracker(state_file=path, clock=clock)
+    assert restored.is_open(URL)
+    assert restored.tiles[URL].failures == BREAKER_TRANSIENT_THRESHOLD
+
+
+# =========================================
+# fetch_tile：重試 / 重試時間上限
+# =========================================
+class HTTPError(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} Error")
+        self.response = response
+
+
+class Response:
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(self)
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("Expecting value")
+        return self.body
+
+
+class Client:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, url, timeout=None):
+        self.requests += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+class FakeTime:
+    """fetch_tile 的等待只推進假時鐘"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(fetcher, "time", fake)
+    monkeypatch.setattr(fetcher, "_retry_delay", lambda attempt, response=None: 5.0)
+    return fake
+
+
+def test_transient_error_is_retried(tracker, fake_time):
+    client = Client(Response(503), Response(200, {"data": {"rows": []}}))
+    assert fetcher.fetch_tile(client, URL, tracker, retry_budget=60) == {"data": {"rows": []}}
+    assert client.requests == 2 and fake_time.sleeps == [5.0]
+    assert tracker.tiles[URL].state == CLOSED and tracker.tiles[URL].failures == 0
+
+
+@pytest.mark.parametrize("response, kind", [(Response(400), PERMANENT), (Response(200), INVALID_BODY)])
+def test_permanent_and_invalid_body_are_not_retried(tracker, fake_time, response, kind):
+    client = Client(response)
+    assert fetcher.fetch_tile(client, URL, tracker, retry_budget=60) is None
+    assert client.requests == 1 and fake_time.sleeps == []
+    assert tracker.tiles[URL].last_kind == kind
+
+
+def test_retry_budget_caps_time_spent_in_worker(tracker, fake_time):
+    client = Client(Response(503))
+    assert fetcher.fetch_tile(client, URL, tracker, retry_budget=12) is None
+    assert client.requests == fetcher.FETCH_RETRIES + 1 and sum(fake_time.sleeps) <= 12
+
+    # 等待會超過剩餘時間：不睡，直接記為失敗交給 circuit breaker
+    client = Client(Response(503))
+    fake_time.sleeps.clear()
+    assert fetcher.fetch_tile(client, URL, tracker, retry_budget=3) is None
+    assert client.requests == 1 and fake_time.sleeps == []
+    assert "retry budget" in tracker.tiles[URL].last_error
+
+
+def test_open_breaker_skips_request(tracker, fake_time):
+    _fail(tracker, BREAKER_TRANSIENT_THRESHOLD)
+    client = Client(Response(200, {}))
+    assert fetcher.fetch_tile(client, URL, tracker) is None
+    assert client.requests == 0
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, insert, text
+
+import migrations
+from models import ShipAIS
+from spatial_index import create_rtree, rtree_name
+from vessel_registry import compact_table, expand_table, is_view, next_ids, pos_name, vessel_history
+
+T0 = datetime(2025, 1, 1)
+TABLE = ShipAIS.__tablename__
+
+
+def _row(ship_id, minutes, shipname="ALPHA", lat=24.1234567, source="tile-a", **extra):
+    row = {"timestamp": T0 + timedelta(minutes=minutes), "source": source, "ship_id": ship_id,
+           "shipname": shipname, "lat": lat, "lon": 120.7654321, "speed": 12.3, "course": 90.0,
+           "flag": "TW", "destination": None}
+    row.update(extra)
+    return row
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'registry.db'}")
+    ShipAIS.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX ix_{TABLE}_ship_id_timestamp ON {TABLE} (ship_id, timestamp)"))
+        conn.execute(insert(ShipAIS.__table__), [_row("1", 0), _row("1", 10), _row("2", 0, shipname="BRAVO")])
+        create_rtree(conn, TABLE)
+        compact_table(conn, TABLE)
+    yield engine
+    engine.dispose()
+
+
+def _rows(conn, where=""):
+    return [dict(r) for r in conn.execute(text(f"SELECT * FROM {TABLE} {where} ORDER BY id")).mappings()]
+
+
+def test_compacted_view_keeps_columns_and_values(engine):
+    with engine.connect() as conn:
+        assert is_view(conn, TABLE)
+        rows = _rows(conn)
+        assert [r["ship_id"] for r in rows] == ["1", "1", "2"]
+        assert rows[0]["shipname"] == "ALPHA" and rows[2]["shipname"] == "BRAVO"
+        assert rows[0]["source"] == "tile-a"
+        assert rows[0]["lat"] == pytest.approx(24.1234567, abs=1e-7)
+        assert rows[0]["speed"] == pytest.approx(12.3)
+        assert rows[0]["destination"] is None
+        # 靜態資料只存一份
+        assert conn.execute(text("SELECT COUNT(*) FROM vessel_static")).scalar() == 2
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {pos_name(TABLE)}")).scalar() == 3
+
+
+def test_insert_update_delete_through_view(engine):
+    with engine.begin() as conn:
+        ids = next_ids(conn, ShipAIS.__table__, 2)
+        assert ids == [4, 5]
+        conn.execute(insert(ShipAIS.__table__), [
+            dict(_row("1", 20, shipname="ALPHA II", source="tile-b"), id=ids[0]),
+            dict(_row("3", 20, lat=None), id=ids[1])])
+        conn.execute(text(f"UPDATE {TABLE} SET lat = 25.5, destination = 'KEELUNG' WHERE id = 2"))
+        conn.execute(text(f"DELETE FROM {TABLE} WHERE ship_id = '2'"))
+
+    with engine.connect() as conn:
+        rows = {r["id"]: r for r in _rows(conn)}
+        assert sorted(rows) == [1, 2, 4, 5]
+        assert rows[4]["shipname"] == "ALPHA II" and rows[4]["source"] == "tile-b"
+        assert rows[5]["lat"] is None
+        assert rows[2]["lat"] == pytest.approx(25.5) and rows[2]["destination"] == "KEELUNG"
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {pos_name(TABLE)}")).scalar() == 4
+        # R*Tree 跟著 {table}_pos 更新
+        indexed = {r[0]: r[1] for r in conn.execute(text(f"SELECT id, min_lat FROM {rtree_name(TABLE)}"))}
+        assert sorted(indexed) == [1, 2, 4]
+        assert indexed[2] == pytest.approx(25.5, abs=1e-4)
+        # 船名變更歷史、目前的靜態資料
+        current = conn.execute(text(
+            "SELECT s.shipname FROM vessels v JOIN vessel_static s ON s.id = v.static_id "
+            "WHERE v.ship_id = '1'")).scalar()
+        assert current == "ALPHA II"
+
+    from sqlalchemy.orm import Session
+    with Session(engine) as session:
+        history = vessel_history([session], "1")
+    assert [h["shipname"] for h in history] == ["ALPHA", "ALPHA", "ALPHA II"]
+
+
+def test_expand_table_restores_plain_table(engine):
+    with engine.begin() as conn:
+        before = _rows(conn)
+        assert expand_table(conn, TABLE, ShipAIS.__table__) == 3
+
+    with engine.begin() as conn:
+        assert not is_view(conn, TABLE)
+        assert _rows(conn) == before
+        names = inspect(conn).get_table_names()
+        assert TABLE in names and pos_name(TABLE) not in names
+        assert f"ix_{TABLE}_ship_id_timestamp" in [ix["name"] for ix in inspect(conn).get_indexes(TABLE)]
+        # 一般表可再使用 RETURNING，R*Tree trigger 掛回原表
+        new_id = conn.execute(insert(ShipAIS.__table__).returning(ShipAIS.__table__.c.id),
+                              [_row("4", 30)]).scalar()
+        assert new_id == 4
+        assert conn.execute(text(f"SELECT COUNT(*) FROM {rtree_name(TABLE)} WHERE id = 4")).scalar() == 1
+
+
+# =========================================
+# migration 7：格式記錄 / downgrade
+# =========================================
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'store.db'}")
+    ShipAIS.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(ShipAIS.__table__), [_row("1", 0), _row("2", 0)])
+    store = migrations.Store("ais_test", engine, ShipAIS, migrations.HISTORY)
+    monkeypatch.setattr(migrations, "all_stores", lambda: [store])
+    yield store
+    engine.dispose()
+
+
+def _compact_migration():
+    return next(m for m in migrations.MIGRATIONS if m.version == migrations.COMPACT_POSITION_ROWS)
+
+
+def test_check_layout_refuses_mismatched_flag(store, monkeypatch):
+    monkeypatch.setattr(migrations, "VESSEL_REGISTRY", False)
+    migrations.check_layout()
+
+    migrations.apply_migration(store, _compact_migration())
+    with pytest.raises(RuntimeError, match="downgrade 7"):
+        migrations.check_layout()
+
+    monkeypatch.setattr(migrations, "VESSEL_REGISTRY", True)
+    migrations.check_layout()
+
+
+def test_downgrade_restores_table_and_version(store, monkeypatch):
+    monkeypatch.setattr(migrations, "VESSEL_REGISTRY", False)
+    migrations.apply_migration(store, _compact_migration())
+    migrations.downgrade(migrations.COMPACT_POSITION_ROWS)
+
+    assert migrations.COMPACT_POSITION_ROWS not in migrations.applied_versions(store)
+    migrations.check_layout()
+    with store.engine.connect() as conn:
+        assert not is_view(conn, TABLE)
+        assert [r["ship_id"] for r in _rows(conn)] == ["1", "2"]
+
+    with pytest.raises(ValueError):
+        migrations.downgrade(1)
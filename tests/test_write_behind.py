@@ -0,0 +1,218 @@
+import gzip
+import os
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from ingest import ShipBatch, classify_batch
+from write_behind import CycleWrite, CycleJournal, WriteBehindWriter
+
+T0 = datetime(2025, 1, 1)
+
+
+def _batch(timestamp, prefix="wb", n=3):
+    rows = [{"SHIP_ID": f"{prefix}{i}", "SHIPNAME": f"S{i}", "LAT": "24.0", "LON": str(120.5 + i * 0.01),
+             "SPEED": "10", "COURSE": "90", "FLAG": "TW", "ELAPSED": "1"} for i in range(n)]
+    return classify_batch(ShipBatch.from_rows(rows, "tile", timestamp))
+
+
+def _cycle(minutes, prefix="wb"):
+    timestamp = T0 + timedelta(minutes=minutes)
+    return CycleWrite(timestamp, _batch(timestamp, prefix))
+
+
+class FakeWrite:
+    """依序回傳 results（用完後一律成功），記錄每一組寫入的輪次時間"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.groups = []
+        self.snapshots = []
+
+    def __call__(self, cycles):
+        self.groups.append([c.timestamp for c in cycles])
+        self.snapshots.append([c.snapshot for c in cycles])
+        result = self.results.pop(0) if self.results else True
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _writer(tmp_path, write, **kwargs):
+    return WriteBehindWriter(write, Flask(__name__), journal=CycleJournal(str(tmp_path)), **kwargs)
+
+
+def _minutes(groups):
+    return [[int((t - T0).total_seconds() // 60) for t in group] for group in groups]
+
+
+# =========================================
+# journal
+# =========================================
+def test_journal_round_trip(tmp_path):
+    journal = CycleJournal(str(tmp_path))
+    cycle = _cycle(0)
+    cycle.drop_sources = ["tile"]
+    path = journal.append(cycle)
+    journal.append(CycleWrite(T0 + timedelta(minutes=10), None))
+
+    pending = list(journal.pending())
+    assert [c.timestamp for c in pending] == [T0, T0 + timedelta(minutes=10)]
+    assert pending[0].journal_path == path
+    assert pending[0].drop_sources == ["tile"]
+    assert pending[0].batch.records() == cycle.batch.records()
+    assert pending[0].batch["zone"].tolist() == cycle.batch["zone"].tolist()
+    assert pending[1].batch is None
+
+    journal.remove(path)
+    journal.remove(path)
+    assert len(list(journal.pending())) == 1
+
+
+def test_unreadable_journal_entry_is_set_aside(tmp_path):
+    path = tmp_path / "cycle-broken.json.gz"
+    with gzip.open(path, "wt") as f:
+        f.write("{not json")
+    journal = CycleJournal(str(tmp_path))
+    assert list(journal.pending()) == []
+    assert os.path.exists(str(path) + ".bad")
+
+
+# =========================================
+# group commit / 失敗重試
+# =========================================
+def test_group_commit_removes_journal(tmp_path):
+    write = FakeWrite()
+    writer = _writer(tmp_path, write)
+    for m in (0, 10, 20):
+        writer.submit(_cycle(m))
+    writer.start()
+    writer.flush()
+    writer.close()
+
+    assert _minutes(write.groups) == [[0, 10, 20]]
+    assert list(writer.journal.pending()) == []
+    stats = writer.stats()
+    assert (stats["cycles_written"], stats["commits"], stats["failed_commits"]) == (3, 1, 0)
+
+
+def test_failed_commit_keeps_journal_and_retries(tmp_path):
+    write = FakeWrite([False])
+    writer = _writer(tmp_path, write)
+    first = _cycle(0)
+    first.snapshot = object()
+    writer.submit(first)
+    writer.start()
+    writer.flush()
+
+    assert [c.timestamp for c in writer.journal.pending()] == [T0]
+    assert writer.stats()["cycles_failed"] == 1
+
+    # 下一組之前先單獨重試，重試時不再寫過時的快照
+    writer.submit(_cycle(10))
+    writer.flush()
+    writer.close()
+    assert _minutes(write.groups) == [[0], [0], [10]]
+    assert write.snapshots[1] == [None]
+    assert list(writer.journal.pending()) == []
+    stats = writer.stats()
+    assert (stats["cycles_written"], stats["cycles_failed"], stats["cycles_retried"]) == (2, 1, 1)
+    assert (stats["commits"], stats["failed_commits"]) == (3, 1)
+
+
+def test_retry_limit_leaves_cycles_for_restart(tmp_path):
+    write = FakeWrite([False] * 10)
+    writer = _writer(tmp_path, write, max_retries=1)
+    writer.submit(_cycle(0))
+    writer.start()
+    writer.flush()
+    writer.submit(_cycle(10))
+    writer.flush()
+    writer.close()
+
+    assert _minutes(write.groups) == [[0], [0], [10], [10]]
+    assert [c.timestamp for c in writer.journal.pending()] == [T0, T0 + timedelta(minutes=10)]
+    assert writer._retry == []
+
+
+def test_write_exception_counts_as_failed_commit(tmp_path):
+    write = FakeWrite([RuntimeError("disk I/O error")])
+    writer = _writer(tmp_path, write, max_retries=0)
+    writer.submit(_cycle(0))
+    writer.start()
+    writer.flush()
+    writer.close()
+
+    assert len(list(writer.journal.pending())) == 1
+    stats = writer.stats()
+    assert (stats["cycles_written"], stats["cycles_failed"], stats["failed_commits"]) == (0, 1, 1)
+
+
+# =========================================
+# fetcher：中斷後重啟補寫 journal
+# =========================================
+def test_journal_replay_after_crash(app, monkeypatch):
+    import fetcher
+    from fleet_snapshot import get_fleet_state
+    from models import ShipAIS
+
+    monkeypatch.setattr(fetcher, "_writer", None)
+    # 上次中斷前已交給 writer、尚未 commit 的兩輪
+    journal = CycleJournal()
+    for m in (0, 10):
+        journal.append(_cycle(m, prefix="crash"))
+    live = get_fleet_state().current()
+
+    writer = fetcher.get_writer()
+    try:
+        assert list(journal.pending()) == []
+        rows = ShipAIS.query.filter(ShipAIS.ship_id.like("crash%")).all()
+        assert len(rows) == 6
+        assert sorted({r.timestamp for r in rows}) == [T0, T0 + timedelta(minutes=10)]
+        # 補寫只寫歷史，不動線上快照
+        assert get_fleet_state().current() is live
+    finally:
+        writer.close()
+
+
+def test_failed_replay_keeps_journal_and_starts_writer(app, monkeypatch):
+    import fetcher
+
+    monkeypatch.setattr(fetcher, "_writer", None)
+    journal = CycleJournal()
+    paths = [journal.append(_cycle(m, prefix="replay")) for m in (0, 10)]
+    results = [RuntimeError("boom"), (False, 0.0, 0.0)]
+
+    def failing(cycles):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(fetcher, "write_cycles", failing)
+    writer = fetcher.get_writer()
+    try:
+        assert writer._thread.is_alive()
+        assert [c.journal_path for c in journal.pending()] == paths
+    finally:
+        writer.close()
+        for path in paths:
+            journal.remove(path)
+
+
+def test_failed_write_leaves_nothing_behind(app, monkeypatch):
+    import fetcher
+    from models import ShipAIS
+
+    cycle = fetcher.prepare_cycle(_cycle(0, prefix="residue"), publish=False)
+
+    def boom(batch, records):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(fetcher, "persist_appends", boom)
+    assert fetcher.write_cycles([cycle])[0] is False
+    monkeypatch.undo()
+
+    # ship_ais 已加入 session 的資料隨失敗一起丟掉，重試時只寫入一次
+    assert fetcher.write_cycles([cycle])[0] is True
+    assert ShipAIS.query.filter(ShipAIS.ship_id.like("residue%")).count() == 3
@@ -0,0 +1,177 @@
+"""
+MarineTraffic 原始 tile 回應的錄製 / 重播
+
+錄製：每個 tile 的原始 JSON（含 url、抓取時間、所屬抓取輪次）以 gzip
+      JSON Lines 追加寫入 TILE_ARCHIVE_DIR/tiles-YYYYMMDD.jsonl.gz。
+      每筆都是獨立的 gzip member，程式中斷也不會損壞先前的資料。
+
+重播：把檔案依抓取輪次分組，透過 ReplayClient 餵回 fetch_data，
+      走與線上相同的解析 / 分類 / 寫入流程；可全速或依原始間隔重播。
+
+    python tile_archive.py db/tile_archive/tiles-20251001.jsonl.gz
+    python tile_archive.py --realtime --speed 10 db/tile_archive/*.jsonl.gz
+"""
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+
+from config import TILE_ARCHIVE_DIR
+from utils import log_failed_record
+
+
+# =========================================
+# 錄製
+# =========================================
+class TileRecorder:
+    def __init__(self, archive_dir=TILE_ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def path_for(self, when):
+        return os.path.join(self.archive_dir, f"tiles-{when:%Y%m%d}.jsonl.gz")
+
+    def record(self, url, data, cycle_at, fetched_at=None):
+        fetched_at = fetched_at or datetime.utcnow()
+        line = json.dumps({
+            "url": url,
+            "cycle_at": cycle_at.isoformat(),
+            "fetched_at": fetched_at.isoformat(),
+            "data": data,
+        }, ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            with self._lock, gzip.open(self.path_for(cycle_at), "ab") as f:
+                f.write(line.encode("utf-8"))
+        except Exception as e:
+            log_failed_record({"url": url}, f"Tile archive write failed: {e}")
+
+
+_recorder = None
+
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        _recorder = TileRecorder()
+    return _recorder
+
+
+# =========================================
+# 讀取
+# =========================================
+def iter_archive(paths):
+    """依檔案順序逐筆讀出錄製內容；最後一個 member 若不完整則停止"""
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, OSError, ValueError) as e:
+            print(f"[tile_archive] ⚠️ {path} 讀取中斷: {e}")
+
+
+def iter_cycles(paths):
+    """把錄製內容依 cycle_at 分組 → (cycle_at, [(url, data), ...])"""
+    cycle_at, tiles = None, []
+    for entry in iter_archive(paths):
+        if entry["cycle_at"] != cycle_at and tiles:
+            yield datetime.fromisoformat(cycle_at), tiles
+            tiles = []
+        cycle_at = entry["cycle_at"]
+        tiles.append((entry["url"], entry["data"]))
+    if tiles:
+        yield datetime.fromisoformat(cycle_at), tiles
+
+
+# =========================================
+# 重播
+# =========================================
+class _ReplayResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class ReplayClient:
+    """以錄製內容取代 MarineTrafficClient，介面同 get(url, timeout=...)"""
+
+    def __init__(self, tiles):
+        self._tiles = dict(tiles)
+
+    def get(self, url, timeout=None):
+        return _ReplayResponse(self._tiles[url])
+
+
+def replay(paths, realtime=False, speed=1.0, concurrency=None):
+    """
+    依序重播所有抓取輪次，回傳每輪統計。
+    realtime=True 時依原始輪次間隔等待（除以 speed），否則全速執行。
+    需在 Flask app context 內呼叫。
+    """
+    from fetcher import fetch_data
+    from pipeline import LAST_CYCLE_STATS
+
+    results = []
+    previous = None
+    for cycle_at, tiles in iter_cycles(paths):
+        if realtime and previous is not None:
+            time.sleep(max(0.0, (cycle_at - previous).total_seconds() / speed))
+        previous = cycle_at
+
+        rows = sum(len(data.get("data", {}).get("rows", [])) for _, data in tiles)
+        fetch_data(client=ReplayClient(tiles), tile_urls=[url for url, _ in tiles],
+                   concurrency=concurrency, timestamp=cycle_at,
+                   send_alerts=False, record=False, track_health=False)
+        wall = LAST_CYCLE_STATS.get("wall_seconds") or 0.0
+        results.append({
+            "cycle_at": cycle_at.isoformat(),
+            "tiles": len(tiles),
+            "rows": rows,
+            "wall_seconds": wall,
+            "rows_per_sec": round(rows / wall, 1) if wall else None,
+        })
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="重播錄製的 MarineTraffic tile，重建衍生資料庫 / 量測吞吐量")
+    ap.add_argument("paths", nargs="*", help="錄製檔（預設為 TILE_ARCHIVE_DIR 下全部）")
+    ap.add_argument("--realtime", action="store_true", help="依原始輪次間隔重播")
+    ap.add_argument("--speed", type=float, default=1.0, help="realtime 模式的加速倍率")
+    ap.add_argument("--concurrency", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    paths = args.paths or sorted(glob.glob(os.path.join(TILE_ARCHIVE_DIR, "tiles-*.jsonl.gz")))
+    if not paths:
+        print("[tile_archive] 沒有可重播的錄製檔")
+        return 1
+
+    from app import app
+    with app.app_context():
+        results = replay(paths, realtime=args.realtime, speed=args.speed,
+                         concurrency=args.concurrency)
+
+    total_rows = sum(r["rows"] for r in results)
+    total_wall = sum(r["wall_seconds"] for r in results)
+    for r in results:
+        print(f"  {r['cycle_at']}  tiles={r['tiles']:3d}  rows={r['rows']:6d}  "
+              f"{r['wall_seconds']:.3f}s  {r['rows_per_sec']} rows/s")
+    print(f"✅ 重播 {len(results)} 輪，共 {total_rows} 筆，{total_wall:.2f}s"
+          + (f"（{total_rows / total_wall:.0f} rows/s）" if total_wall else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import os
+import json
+import random
+import threading
+import time
+from datetime import datetime
+
+from config import (
+    TILE_HEALTH_FILE,
+    BREAKER_TRANSIENT_THRESHOLD, BREAKER_PERMANENT_THRESHOLD,
+    BREAKER_TRANSIENT_OPEN_S, BREAKER_PERMANENT_OPEN_S, BREAKER_MAX_OPEN_S
+)
+from utils import log_failed_record
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 失敗種類
+TRANSIENT = "transient"        # 429 / 5xx / 連線錯誤 / 逾時：同一輪內重試
+PERMANENT = "permanent"        # 其他 4xx（例如 failed_records.json 裡大量的 400 Bad Request）、3xx
+INVALID_BODY = "invalid_body"  # 200 但內容不是 JSON（通常是 Cloudflare challenge 頁）：不重試
+
+
+def is_transient(status):
+    """只有 429 / 5xx / 連線錯誤 / 逾時（status 為 None）視為暫時性錯誤"""
+    return status is None or status == 429 or status >= 500
+
+
+def failure_kind(status, invalid_body=False):
+    if invalid_body:
+        return INVALID_BODY
+    return TRANSIENT if is_transient(status) else PERMANENT
+
+
+# =========================================
+# 單一 tile 的健康狀態
+# =========================================
+class TileHealth:
+    def __init__(self, url):
+        self.url = url
+        self.state = CLOSED
+        self.failures = 0          # 連續失敗次數
+        self.opened = 0            # 連續開路次數（決定下一次開路時間）
+        self.open_until = 0.0
+        self.last_status = None
+        self.last_kind = None
+        self.last_error = None
+        self.last_failure_at = None
+        self.last_success_at = None
+        self.skipped = 0           # 開路期間省下的請求數
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        h = cls(data["url"])
+        for k, v in data.items():
+            if hasattr(h, k):
+                setattr(h, k, v)
+        return h
+
+
+# =========================================
+# 各 tile 的 circuit breaker
+# =========================================
+class TileHealthTracker:
+    """
+    closed    : 正常抓取
+    open      : 連續失敗達門檻，open_until 之前完全不發請求
+    half_open : 開路時間到，放行一次試探請求；成功回到 closed，
+                失敗則再次開路，開路時間加倍（含 jitter，上限 BREAKER_MAX_OPEN_S）
+
+    400 之類的永久性錯誤門檻低、開路時間長；429 / 5xx / 逾時門檻較高、開路時間短。
+    200 但內容不是 JSON（challenge 頁）與暫時性錯誤相同門檻（session 更新後通常就會恢復）。
+    狀態寫入 TILE_HEALTH_FILE，重啟後沿用。
+    """
+
+    def __init__(self, state_file=TILE_HEALTH_FILE, clock=time.time):
+        self.state_file = state_file
+        self.clock = clock
+        self.tiles = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _get(self, url):
+        if url not in self.tiles:
+            self.tiles[url] = TileHealth(url)
+        return self.tiles[url]
+
+    # -----------------------------------------
+    # 查詢
+    # -----------------------------------------
+    def is_open(self, url):
+        """不改變狀態的查詢（排程器用來跳過開路中的 tile）"""
+        with self._lock:
+            h = self.tiles.get(url)
+            return h is not None and h.state == OPEN and self.clock() < h.open_until
+
+    def allow(self, url):
+        """是否允許發出請求；開路時間已到則轉為 half_open 放行一次"""
+        with self._lock:
+            h = self._get(url)
+            if h.state != OPEN:
+                return True
+            if self.clock() >= h.open_until:
+                h.state = HALF_OPEN
+                self._dirty = True
+                return True
+            h.skipped += 1
+            return False
+
+    # -----------------------------------------
+    # 回報結果
+    # -----------------------------------------
+    def record_success(self, url):
+        with self._lock:
+            h = self._get(url)
+            if h.state != CLOSED:
+                print(f"[tile_health] ✅ {url} 恢復正常")
+            h.state = CLOSED
+            h.failures = 0
+            h.opened = 0
+            h.last_success_at = datetime.utcnow().isoformat()
+            self._dirty = True
+
+    def record_failure(self, url, status=None, error=None, kind=None):
+        """kind: TRANSIENT / PERMANENT / INVALID_BODY（未指定時依 status 判斷）"""
+        kind = kind or failure_kind(status)
+        with self._lock:
+            h = self._get(url)
+            h.failures += 1
+            h.last_status = status
+            h.last_kind = kind
+            h.last_error = error
+            h.last_failure_at = datetime.utcnow().isoformat()
+            self._dirty = True
+
+            permanent = kind == PERMANENT
+            threshold = BREAKER_PERMANENT_THRESHOLD if permanent else BREAKER_TRANSIENT_THRESHOLD
+            if h.state == HALF_OPEN or h.failures >= threshold:
+                base = BREAKER_PERMANENT_OPEN_S if permanent else BREAKER_TRANSIENT_OPEN_S
+                duration = min(BREAKER_MAX_OPEN_S, base * (2 ** h.opened))
+                duration *= random.uniform(0.8, 1.2)
+                h.state = OPEN
+                h.opened += 1
+                h.open_until = self.clock() + duration
+                print(f"[tile_health] ⛔ {url} 開路 {duration / 60:.0f} 分鐘（{status or error}）")
+
+    # -----------------------------------------
+    # 持久化 / 報表
+    # -----------------------------------------
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                for data in json.load(f).get("tiles", []):
+                    self.tiles[data["url"]] = TileHealth.from_dict(data)
+        except Exception as e:
+            print(f"[tile_health] ⚠️ 讀取狀態失敗，從頭開始: {e}")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.state_file:
+                return
+            payload = {"tiles": [h.as_dict() for h in self.tiles.values()]}
+            self._dirty = False
+        tmp_path = self.state_file + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            log_failed_record({"file": self.state_file}, f"Save tile health failed: {e}")
+
+    def report(self):
+        now = self.clock()
+        with self._lock:
+            tiles = []
+            for h in self.tiles.values():
+                d = h.as_dict()
+                d["open_for_s"] = round(max(0.0, h.open_until - now)) if h.state == OPEN else 0
+                tiles.append(d)
+            return {
+                "open": sum(1 for h in self.tiles.values() if h.state == OPEN),
+                "tiles": tiles,
+            }
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tile_health():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = TileHealthTracker()
+        return _tracker
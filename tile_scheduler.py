@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from config import (
+    TILE_MIN_INTERVAL, TILE_BASE_INTERVAL, TILE_MAX_INTERVAL,
+    TILE_BACKOFF, TILE_NEAR_NM, TILE_REQUEST_BUDGET_PER_HOUR
+)
+from ingest import tile_key
+from geo_distance import get_distance_engine
+
+
+# =========================================
+# 海警船是否在 24nm 內或附近
+# =========================================
+def count_near_24nm(ships, near_nm=TILE_NEAR_NM):
+    """24nm 內（zone 有值）或 24nm 線外 near_nm 海浬內的船數"""
+    outside = [s for s in ships if not s["zone"]]
+    if not outside:
+        return len(ships)
+    near = get_distance_engine().within_nm("24nm", [s["lon"] for s in outside],
+                                           [s["lat"] for s in outside], near_nm)
+    return len(ships) - len(outside) + int(np.count_nonzero(near))
+
+
+# =========================================
+# 每個 tile 的輪詢狀態
+# =========================================
+class TileState:
+    def __init__(self, url, interval, next_due):
+        self.url = url
+        self.key = tile_key(url)
+        self.interval = interval
+        self.next_due = next_due
+        self.last_polled = None
+        self.effective_interval = None   # 實際輪詢間隔（指數移動平均）
+        self.ccg = 0
+        self.ccg_near = 0
+        self.polls = 0
+
+    @property
+    def activity(self):
+        if self.ccg_near:
+            return "hot"
+        if self.ccg:
+            return "warm"
+        return "quiet"
+
+    def as_dict(self, now):
+        return {
+            "url": self.url,
+            "source": self.key,
+            "activity": self.activity,
+            "ccg": self.ccg,
+            "ccg_near": self.ccg_near,
+            "interval_s": round(self.interval),
+            "effective_interval_s": round(self.effective_interval) if self.effective_interval else None,
+            "next_due_in_s": round(self.next_due - now),
+            "last_polled": datetime.utcfromtimestamp(self.last_polled).isoformat() if self.last_polled else None,
+            "polls": self.polls,
+        }
+
+
+# =========================================
+# 依活動程度調整各 tile 輪詢頻率
+# =========================================
+class AdaptiveTileScheduler:
+    """
+    - 有海警船在 24nm 內 / 附近的 tile（hot）：以 min_interval 輪詢
+    - 有海警船但離得遠（warm）：base_interval 的一半
+    - 沒有海警船（quiet）：每輪乘上 backoff，直到 max_interval
+    總請求量以 token bucket 控制在 budget_per_hour 以內（預設與固定 10 分鐘
+    輪詢全部 tile 相同），額度不足時依逾期比例排序，hot tile 優先。
+    """
+
+    def __init__(self, tile_urls, min_interval=TILE_MIN_INTERVAL, base_interval=TILE_BASE_INTERVAL,
+                 max_interval=TILE_MAX_INTERVAL, backoff=TILE_BACKOFF,
+                 budget_per_hour=TILE_REQUEST_BUDGET_PER_HOUR, health=None, clock=time.time):
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self.health = health   # TileHealthTracker：開路中的 tile 不佔用請求額度
+        self.budget_per_hour = budget_per_hour or len(tile_urls) * 3600.0 / base_interval
+        self._capacity = max(1.0, float(len(tile_urls)))
+        self._tokens = self._capacity
+        self._refilled_at = clock()
+        self._lock = threading.Lock()
+
+        now = clock()
+        self.tiles = {url: TileState(url, base_interval, now) for url in tile_urls}
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._refilled_at)
+        self._tokens = min(self._capacity, self._tokens + elapsed * self.budget_per_hour / 3600.0)
+        self._refilled_at = now
+
+    def due_tiles(self):
+        """回傳這次要抓的 tile URL（已扣除請求額度）"""
+        now = self.clock()
+        with self._lock:
+            self._refill(now)
+            due = [t for t in self.tiles.values()
+                   if t.next_due <= now and not (self.health and self.health.is_open(t.url))]
+            # 逾期比例越高越優先；hot tile 額外加一個間隔的權重，
+            # 但安靜 tile 逾期夠久仍會輪到，不會被 hot tile 餓死
+            due.sort(key=lambda t: -((now - t.next_due) / t.interval + (t.activity == "hot")))
+            picked = due[:int(self._tokens)]
+            self._tokens -= len(picked)
+            return [t.url for t in picked]
+
+    def observe(self, polled_urls, result=None):
+        """
+        polled_urls: 本次嘗試抓取的 tile
+        result     : fetch_data 的回傳值；抓取失敗的 tile 維持原間隔
+        """
+        now = self.clock()
+        result = result or {}
+        ok = set(result.get("tiles_ok", []))
+        ccg_by_tile = result.get("ccg_by_tile", {})
+
+        with self._lock:
+            for url in polled_urls:
+                t = self.tiles.get(url)
+                if t is None:
+                    continue
+                if t.last_polled is not None:
+                    gap = now - t.last_polled
+                    t.effective_interval = gap if t.effective_interval is None \
+                        else 0.7 * t.effective_interval + 0.3 * gap
+                t.last_polled = now
+                t.polls += 1
+
+                if t.key in ok:
+                    ships = ccg_by_tile.get(t.key, [])
+                    t.ccg = len(ships)
+                    t.ccg_near = count_near_24nm(ships)
+                    if t.activity == "hot":
+                        t.interval = self.min_interval
+                    elif t.activity == "warm":
+                        t.interval = max(self.min_interval, self.base_interval / 2)
+                    else:
+                        t.interval = min(self.max_interval, max(t.interval, self.base_interval / 2) * self.backoff)
+                t.next_due = now + t.interval
+
+    def report(self):
+        now = self.clock()
+        with self._lock:
+            tiles = [t.as_dict(now) for t in self.tiles.values()]
+            planned = sum(3600.0 / t.interval for t in self.tiles.values())
+            return {
+                "budget_per_hour": round(self.budget_per_hour, 1),
+                "planned_per_hour": round(planned, 1),
+                "tokens": round(self._tokens, 2),
+                "tiles": tiles,
+            }
@@ -0,0 +1,92 @@
+"""
+把分庫模式的九個 SQLite 檔匯入單一檔案模式的 ais_unified.db
+
+    AIS_UNIFIED_STORE=1 python unified_store.py
+
+已有資料的目標表會略過（可重複執行）；原本的分庫檔案不會被修改或刪除。
+"""
+import os
+import sys
+import sqlite3
+
+from config import (
+    UNIFIED_STORE, UNIFIED_DB_PATH, MAIN_DB_PATH,
+    TEST_DB_PATH, BOAT_DB_PATH, BOAT_CHECK12_DB_PATH, BOAT_CHECK24_DB_PATH,
+    CCG_DB_PATH, CCG_CHECK12_DB_PATH, CCG_CHECK24_DB_PATH, CHINA_BOAT_DB_PATH
+)
+
+
+def split_tables():
+    """(分庫檔案, 分庫內表名, 單一檔案內表名)"""
+    from models import (
+        ShipAIS, ShipAISRun, IngestCycle, TestShipAIS, BoatShipAIS, BoatCheck12AIS, BoatCheck24AIS,
+        CCGShipAIS, CCGCheck12ShipAIS, CCGCheck24ShipAIS, ChinaBoatAIS
+    )
+    return [
+        (MAIN_DB_PATH, "ship_ais", ShipAIS.__tablename__),
+        (MAIN_DB_PATH, "ship_ais_run", ShipAISRun.__tablename__),
+        (MAIN_DB_PATH, "ingest_cycle", IngestCycle.__tablename__),
+        (TEST_DB_PATH, "ship_ais", TestShipAIS.__tablename__),
+        (BOAT_DB_PATH, "ship_ais", BoatShipAIS.__tablename__),
+        (BOAT_CHECK12_DB_PATH, "ship_ais", BoatCheck12AIS.__tablename__),
+        (BOAT_CHECK24_DB_PATH, "ship_ais", BoatCheck24AIS.__tablename__),
+        (CCG_DB_PATH, "ship_ais", CCGShipAIS.__tablename__),
+        (CCG_CHECK12_DB_PATH, "ship_ais", CCGCheck12ShipAIS.__tablename__),
+        (CCG_CHECK24_DB_PATH, "ship_ais", CCGCheck24ShipAIS.__tablename__),
+        (CHINA_BOAT_DB_PATH, "ship_ais", ChinaBoatAIS.__tablename__),
+    ]
+
+
+def _columns(conn, table, schema="main"):
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def import_split_databases(target_path=UNIFIED_DB_PATH):
+    """目標表需已建立（init_models）；回傳 {目標表: 匯入筆數}"""
+    imported = {}
+    # isolation_level=None：ATTACH 不能在交易內執行，交易由下面自行 BEGIN / COMMIT
+    conn = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        for src_path, src_table, dst_table in split_tables():
+            if not os.path.exists(src_path):
+                continue
+            if conn.execute(f"SELECT EXISTS (SELECT 1 FROM {dst_table})").fetchone()[0]:
+                print(f"[unified_store] {dst_table} 已有資料，略過")
+                continue
+
+            conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+            try:
+                src_columns = set(_columns(conn, src_table, "src"))
+                if not src_columns:
+                    continue
+                # ship_ais_run.row_id 參照 ship_ais.id，id 一併保留
+                cols = ", ".join(c for c in _columns(conn, dst_table) if c in src_columns)
+                conn.execute("BEGIN")
+                count = conn.execute(
+                    f"INSERT INTO main.{dst_table} ({cols}) SELECT {cols} FROM src.{src_table}").rowcount
+                conn.execute("COMMIT")
+                imported[dst_table] = count
+                print(f"[unified_store] ✅ {os.path.basename(src_path)}:{src_table} → {dst_table}（{count} 筆）")
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+    return imported
+
+
+def main():
+    if not UNIFIED_STORE:
+        print("[unified_store] 請以 AIS_UNIFIED_STORE=1 執行（需先建立單一檔案模式的資料表）")
+        return 1
+
+    from app import app  # noqa: F401 — 初始化時建立 ais_unified.db 的所有資料表
+
+    imported = import_split_databases()
+    print(f"✅ 匯入完成，共 {sum(imported.values())} 筆 → {UNIFIED_DB_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+歷史表精簡列 + 船舶靜態資料表（VESSEL_REGISTRY=1，由 migrations.py 的 compact_position_rows 轉換）
+
+每筆歷史資料原本都重複存放 shipname / destination / dwt / flag / shiptype / gt_shiptype / length / width
+與 source 字串。轉換後（同一個 DB 檔內）：
+  - {table}_pos      位置列：id、timestamp、ship_id、source_id、static_id 與數值欄位，
+                     lat / lon 以 1e7 倍、speed 以 10 倍存成整數（SQLite 整數依大小只占 1~4 bytes）
+  - ais_sources      source 字串對照（每個 tile 一筆）
+  - vessel_static    每艘船每組靜態資料一筆（first_seen / last_seen）＝ 船名等資料的變更歷史
+  - vessels          每艘船一筆：第一次 / 最後一次出現與目前的靜態資料
+  - {table}          原本的表名改為 view，欄位與原表相同：ORM model、查詢與 to_dict 都不需修改；
+                     INSERT / UPDATE / DELETE 由 INSTEAD OF trigger 轉寫到上述的表
+view 不支援 INSERT ... RETURNING（id 會是 NULL），需要新寫入的 id 時先以 next_ids 配號。
+還原為一般表：expand_table（migrations.py downgrade 7）；ais_sources / vessel_static / vessels 保留不刪
+（單一檔案模式下由多張歷史表共用）。
+"""
+import threading
+
+from sqlalchemy import inspect, text, select, func
+
+# 改存在 vessel_static 的欄位
+STATIC_COLUMNS = ("shipname", "destination", "dwt", "flag", "shiptype", "gt_shiptype", "length", "width")
+# 以整數儲存的欄位：欄位 → (實體欄位, 倍率)
+SCALED_COLUMNS = {"lat": ("lat_e7", 10 ** 7), "lon": ("lon_e7", 10 ** 7), "speed": ("speed_e1", 10)}
+
+_compact = set()
+_lock = threading.Lock()
+
+
+def pos_name(table):
+    return f"{table}_pos"
+
+
+def _static_key(row):
+    """靜態資料的唯一鍵（quote() 讓 NULL 與空字串可區分；UNIQUE 不會把 NULL 視為相同）"""
+    return " || ',' || ".join(f"quote({row}.{c})" for c in ("ship_id",) + STATIC_COLUMNS)
+
+
+def _scaled(row, column):
+    physical, scale = SCALED_COLUMNS[column]
+    return f"CAST(round({row}.{column} * {scale}) AS INTEGER)"
+
+
+# =========================================
+# DDL（migration 使用）
+# =========================================
+def _create_registry(conn):
+    statics = ", ".join(f"{c} VARCHAR(200)" for c in STATIC_COLUMNS)
+    for sql in (
+        "CREATE TABLE IF NOT EXISTS ais_sources (id INTEGER PRIMARY KEY, url VARCHAR(200) UNIQUE)",
+        f"CREATE TABLE IF NOT EXISTS vessel_static (id INTEGER PRIMARY KEY, ship_id VARCHAR(50), {statics}, "
+        f"key TEXT UNIQUE, first_seen DATETIME, last_seen DATETIME)",
+        "CREATE INDEX IF NOT EXISTS ix_vessel_static_ship_id ON vessel_static (ship_id, last_seen)",
+        "CREATE TABLE IF NOT EXISTS vessels (ship_id VARCHAR(50) PRIMARY KEY, static_id INTEGER, "
+        "first_seen DATETIME, last_seen DATETIME)",
+    ):
+        conn.execute(text(sql))
+
+
+def _registry_statements(row):
+    """trigger 內更新 ais_sources / vessel_static / vessels（row = NEW）"""
+    statics = ", ".join(STATIC_COLUMNS)
+    values = ", ".join(f"{row}.{c}" for c in STATIC_COLUMNS)
+    return [
+        f"INSERT OR IGNORE INTO ais_sources (url) SELECT {row}.source WHERE {row}.source IS NOT NULL",
+        f"INSERT INTO vessel_static (ship_id, {statics}, key, first_seen, last_seen) "
+        f"VALUES ({row}.ship_id, {values}, {_static_key(row)}, {row}.timestamp, {row}.timestamp) "
+        f"ON CONFLICT (key) DO UPDATE SET first_seen = min(first_seen, excluded.first_seen), "
+        f"last_seen = max(last_seen, excluded.last_seen)",
+        f"INSERT INTO vessels (ship_id, static_id, first_seen, last_seen) "
+        f"SELECT {row}.ship_id, s.id, {row}.timestamp, {row}.timestamp FROM vessel_static s "
+        f"WHERE s.key = {_static_key(row)} AND {row}.ship_id IS NOT NULL "
+        f"ON CONFLICT (ship_id) DO UPDATE SET "
+        f"static_id = CASE WHEN excluded.last_seen >= vessels.last_seen THEN excluded.static_id "
+        f"ELSE vessels.static_id END, "
+        f"first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen)",
+    ]
+
+
+def _pos_values(row, others):
+    """寫入 {table}_pos 的 (欄位, 值)；row = NEW 或來源表名稱"""
+    values = [
+        ("id", f"{row}.id"),
+        ("timestamp", f"{row}.timestamp"),
+        ("ship_id", f"{row}.ship_id"),
+        ("source_id", f"(SELECT id FROM ais_sources WHERE url = {row}.source)"),
+        ("static_id", f"(SELECT id FROM vessel_static WHERE key = {_static_key(row)})"),
+    ]
+    values += [(SCALED_COLUMNS[c][0], _scaled(row, c)) for c in SCALED_COLUMNS]
+    values += [(c, f"{row}.{c}") for c in others]
+    return values
+
+
+def compact_table(conn, table):
+    """
+    把歷史表 table 轉成 {table}_pos + view（已轉換則不動）；回傳轉換的筆數
+    原表的索引改建在 {table}_pos 上，R*Tree trigger 改掛在 {table}_pos。
+    """
+    from spatial_index import create_rtree, rtree_name
+
+    if is_view(conn, table):
+        return 0
+    inspector = inspect(conn)
+    columns = inspector.get_columns(table)
+    indexes = inspector.get_indexes(table)
+    names = [c["name"] for c in columns]
+    fixed = {"id", "timestamp", "ship_id", "source"} | set(STATIC_COLUMNS) | set(SCALED_COLUMNS)
+    others = [c for c in columns if c["name"] not in fixed]
+    pos = pos_name(table)
+    has_rtree = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                             {"name": rtree_name(table)}).first() is not None
+
+    # 1) 對照表 + 實體表
+    _create_registry(conn)
+    conn.execute(text(
+        f"CREATE TABLE {pos} (id INTEGER PRIMARY KEY, timestamp DATETIME, ship_id VARCHAR(50), "
+        f"source_id INTEGER, static_id INTEGER, "
+        + ", ".join(f"{physical} INTEGER" for physical, _ in SCALED_COLUMNS.values()) + ", "
+        + ", ".join(f"{c['name']} {c['type'].compile(dialect=conn.dialect)}" for c in others) + ")"))
+
+    # 2) 既有資料：先建對照，再整批搬到 {table}_pos
+    statics = ", ".join(STATIC_COLUMNS)
+    conn.execute(text(f"INSERT OR IGNORE INTO ais_sources (url) "
+                      f"SELECT DISTINCT source FROM {table} WHERE source IS NOT NULL"))
+    conn.execute(text(
+        f"INSERT INTO vessel_static (ship_id, {statics}, key, first_seen, last_seen) "
+        f"SELECT ship_id, {statics}, {_static_key(table)}, min(timestamp), max(timestamp) FROM {table} "
+        f"WHERE true GROUP BY {_static_key(table)} "
+        f"ON CONFLICT (key) DO UPDATE SET first_seen = min(first_seen, excluded.first_seen), "
+        f"last_seen = max(last_seen, excluded.last_seen)"))
+    conn.execute(text(
+        "INSERT INTO vessels (ship_id, first_seen, last_seen) "
+        "SELECT ship_id, min(first_seen), max(last_seen) FROM vessel_static WHERE ship_id IS NOT NULL "
+        "GROUP BY ship_id ON CONFLICT (ship_id) DO UPDATE SET "
+        "first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen)"))
+    conn.execute(text(
+        "UPDATE vessels SET static_id = (SELECT id FROM vessel_static s WHERE s.ship_id = vessels.ship_id "
+        "ORDER BY last_seen DESC LIMIT 1)"))
+    values = _pos_values(table, [c["name"] for c in others])
+    moved = conn.execute(text(
+        f"INSERT INTO {pos} ({', '.join(c for c, _ in values)}) "
+        f"SELECT {', '.join(v for _, v in values)} FROM {table}")).rowcount
+
+    # 3) 原表換成 view（欄位順序與型別與原表相同）
+    conn.execute(text(f"DROP TABLE {table}"))
+    select_list = []
+    for name in names:
+        if name == "source":
+            select_list.append("src.url AS source")
+        elif name in STATIC_COLUMNS:
+            select_list.append(f"vs.{name} AS {name}")
+        elif name in SCALED_COLUMNS:
+            physical, scale = SCALED_COLUMNS[name]
+            select_list.append(f"p.{physical} / {scale:.1f} AS {name}")
+        else:
+            select_list.append(f"p.{name} AS {name}")
+    conn.execute(text(
+        f"CREATE VIEW {table} AS SELECT {', '.join(select_list)} FROM {pos} p "
+        f"LEFT JOIN ais_sources src ON src.id = p.source_id "
+        f"LEFT JOIN vessel_static vs ON vs.id = p.static_id"))
+
+    # 4) 寫入 view → INSTEAD OF trigger
+    insert_values = _pos_values("NEW", [c["name"] for c in others])
+    conn.execute(text(
+        f"CREATE TRIGGER {table}_vi INSTEAD OF INSERT ON {table} BEGIN "
+        + "; ".join(_registry_statements("NEW")) + "; "
+        f"INSERT INTO {pos} ({', '.join(c for c, _ in insert_values)}) "
+        f"VALUES ({', '.join(v for _, v in insert_values)}); END"))
+    updates = ", ".join(f"{c} = {v}" for c, v in insert_values if c != "id")
+    conn.execute(text(
+        f"CREATE TRIGGER {table}_vu INSTEAD OF UPDATE ON {table} BEGIN "
+        + "; ".join(_registry_statements("NEW")) + "; "
+        f"UPDATE {pos} SET {updates} WHERE id = OLD.id; END"))
+    conn.execute(text(
+        f"CREATE TRIGGER {table}_vd INSTEAD OF DELETE ON {table} BEGIN "
+        f"DELETE FROM {pos} WHERE id = OLD.id; END"))
+
+    # 5) 索引與 R*Tree trigger 改到 {table}_pos（靜態欄位的索引不再需要）
+    rename = {"source": "source_id", **{c: physical for c, (physical, _) in SCALED_COLUMNS.items()}}
+    for index in indexes:
+        if any(c in STATIC_COLUMNS for c in index["column_names"]):
+            continue
+        indexed = ", ".join(rename.get(c, c) for c in index["column_names"])
+        unique = "UNIQUE " if index.get("unique") else ""
+        conn.execute(text(f"CREATE {unique}INDEX {index['name']} ON {pos} ({indexed})"))
+    if has_rtree:
+        create_rtree(conn, table, source=pos, lat="lat_e7", lon="lon_e7", scale=SCALED_COLUMNS["lat"][1])
+    return moved
+
+
+def expand_table(conn, table, model_table):
+    """
+    compact_table 的反向：view + {table}_pos 還原成一般表（未轉換則不動）；回傳還原的筆數
+    model_table 為 ORM 的 Table，提供原本的欄位型別。lat / lon / speed 為整數儲存後的精度。
+    """
+    from spatial_index import create_rtree, rtree_name
+
+    if not is_view(conn, table):
+        return 0
+    inspector = inspect(conn)
+    pos = pos_name(table)
+    names = [r[1] for r in conn.execute(text(f"PRAGMA table_info({table})"))]
+    types = {c["name"]: c["type"].compile(dialect=conn.dialect) for c in inspector.get_columns(pos)}
+    types.update({c.name: c.type.compile(dialect=conn.dialect) for c in model_table.columns})
+    indexes = inspector.get_indexes(pos)
+    has_rtree = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                             {"name": rtree_name(table)}).first() is not None
+
+    # 1) 由 view 讀出完整欄位寫到新表
+    restored = f"{table}_restored"
+    conn.execute(text(
+        f"CREATE TABLE {restored} ("
+        + ", ".join("id INTEGER NOT NULL PRIMARY KEY" if n == "id" else f"{n} {types[n]}" for n in names) + ")"))
+    moved = conn.execute(text(
+        f"INSERT INTO {restored} ({', '.join(names)}) SELECT {', '.join(names)} FROM {table}")).rowcount
+
+    # 2) view（連同 INSTEAD OF trigger）與 {table}_pos（連同索引、R*Tree trigger）移除後換回原表名
+    conn.execute(text(f"DROP VIEW {table}"))
+    conn.execute(text(f"DROP TABLE {pos}"))
+    conn.execute(text(f"ALTER TABLE {restored} RENAME TO {table}"))
+    _forget(conn, table)
+
+    # 3) 索引與 R*Tree trigger 改回原表（R*Tree 內容以 id 對應，不需重建）
+    rename = {"source_id": "source", **{physical: c for c, (physical, _) in SCALED_COLUMNS.items()}}
+    for index in indexes:
+        indexed = ", ".join(rename.get(c, c) for c in index["column_names"])
+        unique = "UNIQUE " if index.get("unique") else ""
+        conn.execute(text(f"CREATE {unique}INDEX {index['name']} ON {table} ({indexed})"))
+    if has_rtree:
+        create_rtree(conn, table)
+    return moved
+
+
+# =========================================
+# 寫入 / 查詢
+# =========================================
+def _cache_key(conn, table):
+    bind = conn.get_bind() if hasattr(conn, "get_bind") else conn.engine
+    return str(bind.url), table
+
+
+def _forget(conn, table):
+    with _lock:
+        _compact.discard(_cache_key(conn, table))
+
+
+def is_view(conn, table):
+    """table 是否已轉成精簡列（view）；只有 expand_table 會變回來，記住結果"""
+    key = _cache_key(conn, table)
+    if key in _compact:
+        return True
+    found = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = :name"),
+                         {"name": table}).first() is not None
+    if found:
+        with _lock:
+            _compact.add(key)
+    return found
+
+
+def next_ids(session, table, count):
+    """
+    view 不支援 RETURNING：依目前最大 id 先配號。
+    呼叫端必須持有 database.WRITE_LOCK 直到寫入 commit，否則兩個寫入者會配到相同的 id
+    """
+    first = (session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+    return list(range(first, first + count))
+
+
+def vessel_history(sessions, ship_id):
+    """
+    船舶的靜態資料變更歷史（依 first_seen 排序）；sessions 為同一歷史表的各分割區，
+    同一組靜態資料出現在多個分割區時合併 first_seen / last_seen
+    """
+    merged = {}
+    for session in sessions:
+        if not session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'vessel_static'")).first():
+            continue
+        rows = session.execute(text(
+            f"SELECT {', '.join(STATIC_COLUMNS)}, first_seen, last_seen FROM vessel_static "
+            f"WHERE ship_id = :ship_id"), {"ship_id": ship_id}).mappings()
+        for row in rows:
+            key = tuple(row[c] for c in STATIC_COLUMNS)
+            if key in merged:
+                merged[key]["first_seen"] = min(merged[key]["first_seen"], row["first_seen"])
+                merged[key]["last_seen"] = max(merged[key]["last_seen"], row["last_seen"])
+            else:
+                merged[key] = dict(row)
+    return sorted(merged.values(), key=lambda r: r["first_seen"] or "")
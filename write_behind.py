@@ -0,0 +1,244 @@
+"""
+Write-behind 持久化（WRITE_BEHIND=1）
+
+fetch_data 分類完一輪後只把結果交給 writer thread 就繼續推播，不等 DB commit：
+  - 佇列有上限（WRITE_BEHIND_QUEUE_SIZE 輪）；writer 落後、佇列滿時抓取端等待（backpressure）
+  - writer 一次取出佇列中所有已排隊的輪次（最多 WRITE_BEHIND_MAX_GROUP 輪），
+    全部寫入後只 commit 一次（group commit），落後時能以較少的 fsync 追上
+  - 交給 writer 前先把這一輪寫到 journal（WRITE_BEHIND_JOURNAL_DIR，一輪一個檔），
+    commit 後刪除；程式中斷後重啟時依序補寫留下的輪次
+journal 只寫入 OS（不 fsync）：程式中斷不會遺失，主機斷電時最後幾輪可能遺失。
+commit 失敗時保留 journal：失敗的輪次在下一組之前單獨重試（最多 WRITE_BEHIND_MAX_RETRIES 次，
+只寫歷史、不再寫最新船隊快照），仍失敗則留在 journal 等下次重啟補寫。
+分庫模式下 commit 失敗時已先提交的分庫不會回復，重試可能使這些分庫重複寫入。
+"""
+import os
+import glob
+import gzip
+import json
+import queue
+import threading
+import itertools
+import time
+from datetime import datetime
+
+import numpy as np
+
+from config import (
+    WRITE_BEHIND_QUEUE_SIZE, WRITE_BEHIND_MAX_GROUP, WRITE_BEHIND_MAX_RETRIES, WRITE_BEHIND_JOURNAL_DIR
+)
+from ingest import ShipBatch
+from utils import log_failed_record
+
+_STOP = object()
+
+
+# =========================================
+# 一輪要寫入的資料
+# =========================================
+class CycleWrite:
+    """
+    batch       : 去重 + 分類後的 ShipBatch（沒有資料時為 None）
+    drop_sources: 建立最新船隊快照時要換掉的 tile（None = 整輪）
+    records / snapshot 由 batch 衍生，不寫入 journal
+    """
+
+    def __init__(self, timestamp, batch, drop_sources=None, records=None, snapshot=None):
+        self.timestamp = timestamp
+        self.batch = batch
+        self.drop_sources = drop_sources
+        self.records = records
+        self.snapshot = snapshot
+        self.journal_path = None
+        self.attempts = 0
+
+
+# =========================================
+# journal：尚未 commit 的輪次
+# =========================================
+class CycleJournal:
+    def __init__(self, journal_dir=WRITE_BEHIND_JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        self._seq = itertools.count()
+        os.makedirs(journal_dir, exist_ok=True)
+
+    def append(self, cycle):
+        columns = None
+        if cycle.batch is not None:
+            columns = {name: {"dtype": str(col.dtype), "values": col.tolist()}
+                       for name, col in cycle.batch.columns.items()}
+        entry = {
+            "timestamp": cycle.timestamp.isoformat(),
+            "drop_sources": cycle.drop_sources,
+            "columns": columns,
+        }
+        name = f"cycle-{cycle.timestamp:%Y%m%dT%H%M%S%f}-{os.getpid()}-{next(self._seq):06d}.json.gz"
+        path = os.path.join(self.journal_dir, name)
+        # 先寫暫存檔再改名：重啟時不會讀到寫到一半的檔案
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=1) as f:
+            json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        return path
+
+    def remove(self, path):
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        """依寫入順序讀出留下的輪次（無法讀取的檔案改名為 .bad 後略過）"""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "cycle-*.json.gz"))):
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (EOFError, OSError, ValueError) as e:
+                print(f"[write_behind] ⚠️ journal {path} 無法讀取: {e}")
+                os.replace(path, path + ".bad")
+                continue
+            timestamp = datetime.fromisoformat(entry["timestamp"])
+            batch = None
+            if entry["columns"] is not None:
+                batch = ShipBatch(timestamp, {
+                    name: np.array(col["values"], dtype=col["dtype"])
+                    for name, col in entry["columns"].items()})
+            cycle = CycleWrite(timestamp, batch, entry["drop_sources"])
+            cycle.journal_path = path
+            yield cycle
+
+
+# =========================================
+# writer thread
+# =========================================
+class WriteBehindWriter:
+    """
+    write(cycles) 在 writer thread（Flask app context 內）寫入並提交多輪，回傳是否 commit 成功
+    """
+
+    def __init__(self, write, app, queue_size=WRITE_BEHIND_QUEUE_SIZE,
+                 max_group=WRITE_BEHIND_MAX_GROUP, journal=None, max_retries=WRITE_BEHIND_MAX_RETRIES):
+        self.write = write
+        self.app = app
+        self.max_group = max(1, max_group)
+        self.max_retries = max_retries
+        self._retry = []
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.journal = journal or CycleJournal()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "cycles_written": 0, "cycles_failed": 0, "cycles_retried": 0, "commits": 0, "failed_commits": 0,
+            "last_group_size": 0, "max_group_size": 0, "last_commit_seconds": None,
+            "backpressure_waits": 0, "backpressure_seconds": 0.0,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, cycle):
+        """寫入 journal 後排入佇列；佇列滿時等待 writer 追上"""
+        try:
+            cycle.journal_path = self.journal.append(cycle)
+        except Exception as e:
+            log_failed_record({"url": "N/A - write-behind journal"}, f"Journal write failed: {e}")
+        try:
+            self.queue.put_nowait(cycle)
+            return
+        except queue.Full:
+            pass
+        print(f"⏳ writer 落後（佇列 {self.queue.maxsize} 輪已滿），等待寫入...")
+        t0 = time.perf_counter()
+        self.queue.put(cycle)
+        with self._lock:
+            self._stats["backpressure_waits"] += 1
+            self._stats["backpressure_seconds"] += time.perf_counter() - t0
+
+    def flush(self):
+        """等待已排隊的輪次全部寫入"""
+        self.queue.join()
+
+    def close(self, timeout=60):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            stopping = False
+            while not stopping:
+                item = self.queue.get()
+                if item is _STOP:
+                    self.queue.task_done()
+                    break
+                group = [item]
+                while len(group) < self.max_group:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        self.queue.task_done()
+                        stopping = True
+                        break
+                    group.append(item)
+                try:
+                    self._commit_retries()
+                    self._commit(group)
+                finally:
+                    for _ in group:
+                        self.queue.task_done()
+            self._commit_retries()
+
+    def _commit_retries(self):
+        """先前 commit 失敗的輪次自成一組重試，不拖累新的輪次"""
+        if not self._retry:
+            return
+        retry, self._retry = self._retry, []
+        print(f"🔁 重試 {len(retry)} 輪先前 commit 失敗的資料")
+        with self._lock:
+            self._stats["cycles_retried"] += len(retry)
+        self._commit(retry)
+
+    def _commit(self, group):
+        t0 = time.perf_counter()
+        try:
+            committed = self.write(group)
+        except Exception as e:
+            log_failed_record({"url": "N/A - write-behind"}, f"Write-behind error: {e}")
+            committed = False
+        elapsed = time.perf_counter() - t0
+        if committed:
+            for cycle in group:
+                self.journal.remove(cycle.journal_path)
+        else:
+            self._keep_failed(group)
+        if len(group) > 1:
+            print(f"📦 group commit：{len(group)} 輪，{elapsed:.3f}s")
+        with self._lock:
+            s = self._stats
+            s["cycles_written" if committed else "cycles_failed"] += len(group)
+            s["commits"] += 1
+            s["failed_commits"] += 0 if committed else 1
+            s["last_group_size"] = len(group)
+            s["max_group_size"] = max(s["max_group_size"], len(group))
+            s["last_commit_seconds"] = round(elapsed, 4)
+
+    def _keep_failed(self, group):
+        """commit 失敗：journal 保留；未超過重試次數的輪次排入重試（快照已過時，只寫歷史）"""
+        for cycle in group:
+            cycle.attempts += 1
+            cycle.snapshot = None
+            if cycle.attempts <= self.max_retries:
+                self._retry.append(cycle)
+            else:
+                print(f"⚠️ 輪次 {cycle.timestamp} 重試 {self.max_retries} 次仍失敗，保留在 journal 待重啟補寫")
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats,
+                    "backpressure_seconds": round(self._stats["backpressure_seconds"], 4),
+                    "queue_depth": self.queue.qsize()}